@@ -1,8 +1,16 @@
 'use strict';
 
+// import system info
+import os from 'os';
+
 // import image status
 import top_config from '../config/configs.js';
 
+// number of images processed at once (each one is a python process holding opencv and numpy, so only a few by default),
+// and of threads each python process uses for its threshold sweep
+const CONCURRENCY = Math.max(1, +(process.env.CONTOUR_CONCURRENCY || 2));
+const SWEEP_WORKERS = Math.max(1, Math.floor(os.cpus().length / CONCURRENCY));
+
 const config = {
     NAME: '[Contour]',
     OUTPATH_PREFIX: 'contour',
@@ -10,6 +18,12 @@ const config = {
     IMG_LIMIT: 10,
     TMP_DIRPATH: './tmp/',
     PYSCRIPT_PATH: './2-meza-contour/python/run.py',
+    RUN_MODE: 'worker',                                     // 'worker': persistent python process, 'batch': one run.py call per cycle, 'spawn': one run.py call per image
+    CONCURRENCY: CONCURRENCY,                               // images processed at once (processes used by run.py in batch mode), env CONTOUR_CONCURRENCY
+    SWEEP_WORKERS: SWEEP_WORKERS,
+    WORKER_SCRIPT_PATH: './2-meza-contour/python/worker.py',
+    WORKER_MAX_JOBS: 200,                                   // the worker is restarted after this many images
+    WORKER_JOB_TIMEOUT: 10*60*1000,                         // ms, the worker is killed if an image takes longer
     status: top_config.image.status,
     IMAGE_STATUS_ON_START: top_config.image.status.CONTOUR,
     IMAGE_STATUS_ON_DONE: top_config.image.status.CUTTING
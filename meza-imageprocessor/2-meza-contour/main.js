@@ -3,9 +3,18 @@
 // child process spawner
 import { spawn } from 'child_process';
 
+// line reader
+import readline from 'readline';
+
+// filesystem
+import fs from 'fs';
+
 // import configs
 import configs from './configs.js';
 
+// import persistent python worker
+import { ContourWorker } from './worker.js';
+
 // import datatype lib
 import { isNumber, isObject, isStringNonEmpty, isArrayNonEmpty } from '../../meza-libraries/gen/datatype.js';
 
@@ -16,6 +25,9 @@ import { fileExists, load_json, write_json } from '../../meza-libraries/storage/
 import { download_file_from_remote_storage, 
             delete_image_in_local_storage } from '../libs/storage.js';
 
+// import system lib
+import { run_with_concurrency } from '../../meza-libraries/utils/node/system.js';
+
 // import database helper functions
 import { select_images_by_status, update_image_status, 
     upsert_cells_sharding, db_query } from '../../meza-libraries/sql/dbhelper.js';
@@ -26,31 +38,49 @@ const OUTPATH_PREFIX = configs.OUTPATH_PREFIX;
 const PYSCRIPT_PATH = configs.PYSCRIPT_PATH;
 const IMG_LIMIT = +configs.IMG_LIMIT;
 const TMP_DIRPATH = configs.TMP_DIRPATH;
+const RUN_MODE = configs.RUN_MODE;
+const CONCURRENCY = +configs.CONCURRENCY;
+const PYTHON_ENV = { ...process.env, 'MEZA_CONTOUR_SWEEP_WORKERS': `${configs.SWEEP_WORKERS}` };
 
 const FAILED_STATUS = +configs.status.FAILED;
 const IMAGE_STATUS_ON_START = +configs.IMAGE_STATUS_ON_START;
 const IMAGE_STATUS_ON_DONE = +configs.IMAGE_STATUS_ON_DONE;
 
+// python processes shared by all the cycles, one per concurrent image, created on first use
+const workers = [];
 
-async function contour( image_id, path ) {
-    
-    // build outpath
-    const outpath = `${TMP_DIRPATH}${image_id}/${OUTPATH_PREFIX}-out.json`;
+
+function get_worker( slot ) {
+
+    // create the worker of this slot
+    const index = slot % CONCURRENCY;
+    if (workers[index] === undefined) {
+        workers[index] = new ContourWorker(configs.WORKER_SCRIPT_PATH, +configs.WORKER_MAX_JOBS, +configs.WORKER_JOB_TIMEOUT, PYTHON_ENV);
+    }
+
+    return workers[index];
+}
+
+
+async function run_python( args, on_line = null ) {
 
     // run
     const result = await new Promise((resolve, reject) => {
 
         // run the script
-        const pyprog = spawn('/usr/bin/python3', [PYSCRIPT_PATH, path, outpath ]);
+        const pyprog = spawn('/usr/bin/python3', args, { env: PYTHON_ENV });
 
         let data_str_all = '';
         let error_str_all = '';
 
-        // wait for data
-        pyprog.stdout.on('data', (data) => {
-            const data_str = data.toString().trim();
-            data_str_all += data_str + '\n';
-            console.log(data_str); // to print out the data as it comes in
+        // wait for data, line by line
+        readline.createInterface({ input: pyprog.stdout }).on('line', (line) => {
+            data_str_all += line + '\n';
+            if (on_line !== null) {
+                on_line(line);
+            } else {
+                console.log(line); // to print out the data as it comes in
+            }
         });
 
         pyprog.stderr.on('data', (data) => {
@@ -78,6 +108,67 @@ async function contour( image_id, path ) {
 }
 
 
+async function contour( image_id, path, slot = 0 ) {
+    
+    // build outpath
+    const outpath = `${TMP_DIRPATH}${image_id}/${OUTPATH_PREFIX}-out.json`;
+
+    // run in the persistent worker of this slot
+    if (RUN_MODE === 'worker') return await get_worker(slot).run(path, outpath);
+
+    // run
+    return await run_python([PYSCRIPT_PATH, path, outpath ]);
+}
+
+
+async function contour_batch( images_df, on_result ) {
+
+    // files of this run only, cycles may overlap
+    const batch_dirpath = fs.mkdtempSync(`${TMP_DIRPATH}${OUTPATH_PREFIX}-batch-`);
+
+    // build manifest
+    const jobs = images_df.map(({ image_id, path }) => ({
+        'image_id': image_id,
+        'path': path,
+        'outpath': `${TMP_DIRPATH}${image_id}/${OUTPATH_PREFIX}-out.json`
+    }));
+
+    // build paths
+    const manifest_path = `${batch_dirpath}/manifest.json`;
+    const summary_path = `${batch_dirpath}/summary.json`;
+
+    // images already handed over
+    const reported = new Set();
+
+    try {
+
+        // write manifest
+        if (!write_json(manifest_path, jobs)) return;
+
+        // run all the images in one python invocation, each status line is handed over as soon as the image is done
+        await run_python([PYSCRIPT_PATH, '--batch', manifest_path, summary_path, `${CONCURRENCY}`], (line) => {
+
+            // parse
+            let image = null;
+            try {
+                image = JSON.parse(line);
+            } catch (error) {
+                console.log(line);
+                return;
+            }
+            if (!isObject(image) || !isStringNonEmpty(image.image_id) || reported.has(image.image_id)) return;
+
+            // same output as contour()
+            reported.add(image.image_id);
+            on_result(image.image_id, (image.status === 'done') ? image.outpath : '');
+        });
+
+    } finally {
+        fs.rmSync(batch_dirpath, { recursive: true, force: true });
+    }
+}
+
+
 function is_contour_result_valid(results){
 
     // check
@@ -94,6 +185,115 @@ function is_contour_result_valid(results){
 }
 
 
+async function save_results(database, logger, image_id, results_json_path){
+
+    // check results
+    if (!isStringNonEmpty(results_json_path) || !fileExists(results_json_path)) {
+
+        // prompt
+        logger.error(`${NAME} did not return a result json file ${image_id}`);
+
+        // build SQL query
+        const query = update_image_status(FAILED_STATUS, image_id);
+
+        // run query
+        await db_query(database, query);
+
+        // delete image from storage
+        delete_image_in_local_storage(TMP_DIRPATH, image_id);
+
+        // skip
+        return;
+    }
+
+    // load results
+    const results = load_json(results_json_path);
+
+    // validate results
+    if (!is_contour_result_valid(results)) {
+
+        // prompt
+        logger.error(`${NAME} could not process result file`);
+
+        // build SQL query
+        const query = update_image_status(FAILED_STATUS, image_id);
+
+        // run query
+        await db_query(database, query);
+
+        // delete image from storage
+        delete_image_in_local_storage(TMP_DIRPATH, image_id);
+
+        // stop here
+        return;
+    }
+
+    // ------------------------------------------------------------------------------------------------
+    // --------------------------------- Push Results to Database -------------------------------------
+    // ------------------------------------------------------------------------------------------------
+
+    // grab data
+    const { table_template_id, rectangles, rotation } = results;
+
+    // go through rectangles
+    const final_cells = rectangles.map(rectangle => {
+
+        // grab cell information
+        const { rect_id, tl_x, tl_y, tr_x, tr_y, bl_x, bl_y, br_x, br_y, opts, data_type } = rectangle;
+    
+        // create cell
+        const datum = {
+            'image_id': image_id,
+            'rect_id': +rect_id,
+            'tl_x': +tl_x,
+            'tl_y': +tl_y,
+            'tr_x': +tr_x,
+            'tr_y': +tr_y,
+            'bl_x': +bl_x,
+            'bl_y': +bl_y,
+            'br_x': +br_x,
+            'br_y': +br_y,
+            'opts': opts,
+            'data_type': data_type
+        }
+
+        return datum;
+    });
+
+    // build SQL query to delete cells
+    const query_delete_cells = `DELETE FROM cell WHERE image_id = '${image_id}'`;
+
+    // run query
+    await db_query(database, query_delete_cells);
+
+    // build SQL query to upsert cells
+    const upsert_cells = upsert_cells_sharding(final_cells);
+
+    // run query
+    await db_query(database, upsert_cells);
+    
+    // ---------------------------------------------------------------------------------------
+    // -------------------------------------- Done -------------------------------------------
+    // ---------------------------------------------------------------------------------------
+
+    // build the final update query
+    const args = [
+        isNumber(rotation) ? `rotation = ${rotation}` : 'rotation = 0', 
+        // `table_template_id = ${table_template_id}`,
+        `table_template_id = NULL`,
+        `status = ${IMAGE_STATUS_ON_DONE}`
+    ]
+
+    // build query
+    const query_update_final = `UPDATE image SET ${args.join(', ')} WHERE id = '${image_id}'`;
+    
+    // set status ready for decoding
+    await db_query(database, query_update_final);
+
+    logger.info(`${NAME} successfully extracted tables and results saved for image with id ${image_id}`);
+}
+
+
 export async function run(serviceLocator){
 
     // grab database
@@ -170,117 +370,54 @@ export async function run(serviceLocator){
     // -------------------------------------- Shard Images --------------------------------------------
     // ------------------------------------------------------------------------------------------------
 
-    for (const datum of images_df){
-
-        // grab data
-        const { path, image_id } = datum;
-
-        // shard
-        const results_json_path = await contour( image_id, path );
-
-        // check results
-        if (!isStringNonEmpty(results_json_path) || !fileExists(results_json_path)) {
-
-            // prompt
-            logger.error(`${NAME} did not return a result json file ${image_id}`);
-
-            // build SQL query
-            const query = update_image_status(FAILED_STATUS, image_id);
-
-            // run query
-            await db_query(database, query);
-
-            // delete image from storage
-            delete_image_in_local_storage(TMP_DIRPATH, image_id);
-
-            // skip
-            continue;
+    // save the result of an image, a failing image does not stop the others
+    const save = async (image_id, results_json_path) => {
+        try {
+            await save_results(database, logger, image_id, results_json_path);
+        } catch (error) {
+            logger.error(`${NAME} failed to save results of image ${image_id}: ${error}`);
         }
-
-        // load results
-        const results = load_json(results_json_path);
-
-        // validate results
-        if (!is_contour_result_valid(results)) {
-
-            // prompt
-            logger.error(`${NAME} could not process result file`);
-
-            // build SQL query
-            const query = update_image_status(FAILED_STATUS, image_id);
-
-            // run query
-            await db_query(database, query);
-
-            // delete image from storage
-            delete_image_in_local_storage(TMP_DIRPATH, image_id);
-
-            // stop here
-            continue;
+    };
+
+    // run the whole cycle in one python invocation, each result goes to the database as soon as it is ready
+    if (RUN_MODE === 'batch') {
+
+        // saves in progress, and images that got a result (even if the batch fails later on)
+        const saves = [];
+        const reported = new Set();
+        try {
+            await contour_batch(images_df, (image_id, results_json_path) => {
+                reported.add(image_id);
+                saves.push(save(image_id, results_json_path));
+            });
+        } catch (error) {
+            logger.error(`${NAME} failed to process the batch: ${error}`);
         }
 
-        // ------------------------------------------------------------------------------------------------
-        // --------------------------------- Push Results to Database -------------------------------------
-        // ------------------------------------------------------------------------------------------------
-
-        // grab data
-        const { table_template_id, rectangles, rotation } = results;
-
-        // go through rectangles
-        const final_cells = rectangles.map(rectangle => {
-
-            // grab cell information
-            const { rect_id, tl_x, tl_y, tr_x, tr_y, bl_x, bl_y, br_x, br_y, opts, data_type } = rectangle;
-        
-            // create cell
-            const datum = {
-                'image_id': image_id,
-                'rect_id': +rect_id,
-                'tl_x': +tl_x,
-                'tl_y': +tl_y,
-                'tr_x': +tr_x,
-                'tr_y': +tr_y,
-                'bl_x': +bl_x,
-                'bl_y': +bl_y,
-                'br_x': +br_x,
-                'br_y': +br_y,
-                'opts': opts,
-                'data_type': data_type
-            }
+        // images the batch never reported are failed
+        for (const { image_id } of images_df){
+            if (!reported.has(image_id)) saves.push(save(image_id, ''));
+        }
 
-            return datum;
-        });
+        await Promise.all(saves);
+        return;
+    }
 
-        // build SQL query to delete cells
-        const query_delete_cells = `DELETE FROM cell WHERE image_id = '${image_id}'`;
+    // process up to {CONCURRENCY} images at once, each result goes to the database as soon as it is ready
+    await run_with_concurrency(images_df, CONCURRENCY, async (datum, slot) => {
 
-        // run query
-        await db_query(database, query_delete_cells);
+        // grab data
+        const { path, image_id } = datum;
 
-        // build SQL query to upsert cells
-        const upsert_cells = upsert_cells_sharding(final_cells);
+        // shard
+        let results_json_path = '';
+        try {
+            results_json_path = await contour( image_id, path, slot );
+        } catch (error) {
+            logger.error(`${NAME} failed to process image ${image_id}: ${error}`);
+        }
 
-        // run query
-        await db_query(database, upsert_cells);
-        
-        // ---------------------------------------------------------------------------------------
-        // -------------------------------------- Done -------------------------------------------
-        // ---------------------------------------------------------------------------------------
-
-        // build the final update query
-        const args = [
-            isNumber(rotation) ? `rotation = ${rotation}` : 'rotation = 0', 
-            // `table_template_id = ${table_template_id}`,
-            `table_template_id = NULL`,
-            `status = ${IMAGE_STATUS_ON_DONE}`
-        ]
-
-        // build query
-        const query_update_final = `UPDATE image SET ${args.join(', ')} WHERE id = '${image_id}'`;
-        
-        // set status ready for decoding
-        await db_query(database, query_update_final);
-
-        logger.info(`${NAME} successfully extracted tables and results saved for image with id ${image_id}`);
-    }
+        // save
+        await save(image_id, results_json_path);
+    });
 }
@@ -0,0 +1,118 @@
+"""
+    Counts the full-frame images allocated by the OpenCV calls of the contour sweep and of the hough sweep, with their
+    peak memory and time. OpenCV writes into a new array unless it is given a dst, so every new array at least as large
+    as a quarter of the frame is counted
+
+    usage: python3 benchmarks/allocations.py [nbr_of_images] [seed]
+"""
+
+# import basic libs
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+# import image processing libs
+import numpy as np
+import cv2 as cv
+
+# import meza_contour from the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import meza_contour.imageproc_basic as imageproc_basic
+import meza_contour.imageproc_complex as imageproc_complex
+from meza_contour.config import PROCESS_IMG_LONGEST_DIM_MIN, PROCESS_IMG_LONGEST_DIM_MAX
+from meza_contour.imageproc_basic import bound_dimensions, resize, cvtToGray
+
+# synthetic pages, and the tables rectified from them
+from logbook import generate_table_template, render_page
+from line_detector import generate_table
+
+
+class CountingCv:
+    """
+        Stands for the cv2 module in meza_contour, counts the arrays returned by each function that are new and large
+    """
+
+    def __init__(self, module):
+        self.module = module
+        self.min_size = 0
+        self.counts = Counter()
+
+    def __getattr__(self, name):
+
+        # constants and classes as is
+        attr = getattr(self.module, name)
+        if not callable(attr) or isinstance(attr, type):
+            return attr
+
+        def counted(*args, **kwargs):
+
+            result = attr(*args, **kwargs)
+
+            # new arrays (not one of the dst given)
+            inputs = list(args) + list(kwargs.values())
+            for array in (result if isinstance(result, tuple) else (result,)):
+                if isinstance(array, np.ndarray) and array.size >= self.min_size and not any(array is arg for arg in inputs):
+                    self.counts[name] += 1
+
+            return result
+
+        return counted
+
+
+def measure(counting_cv, func, img):
+    """
+        Returns the allocations by function, the peak memory (MB) and the duration (s) of func(img)
+    """
+
+    # count the arrays of at least a quarter of the frame
+    counting_cv.min_size = img.shape[0]*img.shape[1] // 4
+    counting_cv.counts = Counter()
+
+    # run
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(img)
+    duration = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+
+    return counting_cv.counts, peak, duration
+
+
+def main(nbr_of_images, seed):
+
+    # route the OpenCV calls of meza_contour through the counter
+    counting_cv = CountingCv(cv)
+    imageproc_basic.cv = counting_cv
+    imageproc_complex.cv = counting_cv
+
+    rng = np.random.default_rng(seed)
+    stages = {'contour sweep': [], 'hough sweep': []}
+    for _ in range(nbr_of_images):
+
+        # page at the processing size
+        table_template = generate_table_template(rng)
+        page, _ = render_page(rng, table_template)
+        new_width, new_height, _ = bound_dimensions(page.shape[1], page.shape[0], MIN_LENGTH=PROCESS_IMG_LONGEST_DIM_MIN, MAX_LENGTH=PROCESS_IMG_LONGEST_DIM_MAX)
+        page = cvtToGray(resize(page, new_width, new_height))
+        stages['contour sweep'].append(measure(counting_cv, imageproc_complex.extract_contours, page))
+
+        # rectified table
+        table, _, _ = generate_table(rng, table_template)
+        stages['hough sweep'].append(measure(counting_cv, imageproc_complex.compute_hough_lines, table))
+
+    # report
+    print(f"{'stage':<16}{'frames / image':>16}{'peak (MB)':>12}{'time (s)':>10}   top allocators")
+    for stage, results in stages.items():
+        counts = sum([result[0] for result in results], Counter())
+        frames = sum(counts.values()) / len(results)
+        peak = np.mean([result[1] for result in results])
+        duration = np.mean([result[2] for result in results])
+        top = ', '.join(f'{name} {count / len(results):.0f}' for name, count in counts.most_common(4))
+        print(f"{stage:<16}{frames:>16.0f}{peak:>12.1f}{duration:>10.2f}   {top}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3, int(sys.argv[2]) if len(sys.argv) > 2 else 0)
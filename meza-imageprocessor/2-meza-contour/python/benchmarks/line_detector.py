@@ -0,0 +1,130 @@
+"""
+    Compares the recall, precision and speed of the table line detectors ('hough' and 'profile') on tables rectified from
+    synthetic logbook pages (see logbook.py)
+
+    usage: python3 benchmarks/line_detector.py [nbr_of_tables] [seed]
+"""
+
+# import basic libs
+import os
+import sys
+import time
+
+# import image processing libs
+import numpy as np
+
+# import meza_contour from the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from meza_contour.config import PROCESS_TABLE_LONGEST_DIM_MIN, PROCESS_TABLE_LONGEST_DIM_MAX
+from meza_contour.imageproc_basic import bound_dimensions, cvtToGray
+from meza_contour.imageproc_complex import compute_hough_lines, extract_table
+
+# synthetic pages
+from logbook import generate_table_template, get_template_dimensions, render_page
+
+
+# a line is found if a detected line passes within this many pixels of its middle
+MATCH_TOLERANCE = 8
+
+
+def get_template_lines(table_template, factor):
+    """
+        Returns the horz and vert lines of a table template (the edges of its rectangles), scaled by factor
+    """
+
+    # extent of each edge: y -> [x min, x max] for the horz lines, x -> [y min, y max] for the vert lines
+    horz, vert = {}, {}
+    for r in table_template['rectangles']:
+        x0, y0, x1, y1 = r['x0'], r['y0'], r['x0'] + r['w'], r['y0'] + r['h']
+        for y in [y0, y1]:
+            horz[y] = [min(horz.get(y, [x0, x1])[0], x0), max(horz.get(y, [x0, x1])[1], x1)]
+        for x in [x0, x1]:
+            vert[x] = [min(vert.get(x, [y0, y1])[0], y0), max(vert.get(x, [y0, y1])[1], y1)]
+
+    horz_lines = [[(x0*factor, y*factor), (x1*factor, y*factor)] for y, (x0, x1) in sorted(horz.items())]
+    vert_lines = [[(x*factor, y0*factor), (x*factor, y1*factor)] for x, (y0, y1) in sorted(vert.items())]
+
+    return horz_lines, vert_lines
+
+
+def generate_table(rng, table_template=None):
+    """
+        Returns a rectified table (grayscale) extracted from a synthetic logbook page like process() does, with the
+        ground truth horz and vert lines of its template
+    """
+
+    # page printed from the template
+    if table_template is None:
+        table_template = generate_table_template(rng)
+    page, corners = render_page(rng, table_template)
+
+    # rectify along the ground truth corners, at the processing size
+    template_width, template_height = get_template_dimensions(table_template)
+    width, height, _ = bound_dimensions(template_width, template_height, MIN_LENGTH=PROCESS_TABLE_LONGEST_DIM_MIN, MAX_LENGTH=PROCESS_TABLE_LONGEST_DIM_MAX)
+    table, _ = extract_table(page, corners, width, height)
+
+    # lines, in pixels of the table
+    horz_lines, vert_lines = get_template_lines(table_template, width / float(template_width))
+
+    return cvtToGray(table), horz_lines, vert_lines
+
+
+def distance_to_line(pt, line):
+    """
+        Returns the distance of a point to the infinite line through a segment
+    """
+
+    (x1, y1), (x2, y2) = line
+    length = np.hypot(x2 - x1, y2 - y1)
+    if length == 0:
+        return np.hypot(pt[0] - x1, pt[1] - y1)
+
+    return abs((x2 - x1)*(y1 - pt[1]) - (x1 - pt[0])*(y2 - y1)) / length
+
+
+def count_matches(truth_lines, found_lines):
+    """
+        Returns the number of ground truth lines found, and the number of detected lines matching a ground truth line
+    """
+
+    def middle(line):
+        return ((line[0][0] + line[1][0]) / 2.0, (line[0][1] + line[1][1]) / 2.0)
+
+    nbr_of_found = len([t for t in truth_lines if any(distance_to_line(middle(t), f) <= MATCH_TOLERANCE for f in found_lines)])
+    nbr_of_correct = len([f for f in found_lines if any(distance_to_line(middle(f), t) <= MATCH_TOLERANCE for t in truth_lines)])
+
+    return nbr_of_found, nbr_of_correct
+
+
+def main(nbr_of_tables=10, seed=0):
+
+    rng = np.random.default_rng(seed)
+    tables = [generate_table(rng) for _ in range(nbr_of_tables)]
+
+    print(f"{'detector':<10}{'recall':>10}{'precision':>12}{'ms/table':>12}")
+    for line_detector in ['hough', 'profile']:
+
+        nbr_of_truth = nbr_of_found = nbr_of_detected = nbr_of_correct = 0
+        duration = 0.0
+        for img, truth_horz, truth_vert in tables:
+
+            # detect
+            start = time.perf_counter()
+            horz_lines, vert_lines = compute_hough_lines(img, line_detector=line_detector)
+            duration += time.perf_counter() - start
+
+            # score, table borders are added by the detectors so they are not scored
+            for truth_lines, found_lines in [(truth_horz, horz_lines), (truth_vert, vert_lines)]:
+                found, correct = count_matches(truth_lines, found_lines)
+                nbr_of_truth += len(truth_lines)
+                nbr_of_found += found
+                nbr_of_detected += len(found_lines)
+                nbr_of_correct += correct
+
+        recall = nbr_of_found / float(max(nbr_of_truth, 1))
+        precision = nbr_of_correct / float(max(nbr_of_detected, 1))
+        print(f"{line_detector:<10}{recall:>10.3f}{precision:>12.3f}{1000*duration/nbr_of_tables:>12.1f}")
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
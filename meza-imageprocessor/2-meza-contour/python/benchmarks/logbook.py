@@ -0,0 +1,204 @@
+"""
+    Synthetic logbook pages for the benchmarks: table templates (same format as the table_template rows) and photos
+    of pages printed from them, with their ground truth corners
+
+    usage: python3 benchmarks/logbook.py <output_dir> [nbr_of_pages] [seed]        (writes the pages and a manifest)
+"""
+
+# import basic libs
+import os
+import sys
+import json
+
+# import image processing libs
+import numpy as np
+import cv2 as cv
+
+
+# corners of the projected rectangle, in the order of the ground truth corners
+CORNER_KEYS = [('tl_x', 'tl_y'), ('tr_x', 'tr_y'), ('br_x', 'br_y'), ('bl_x', 'bl_y')]
+
+
+def generate_table_template(rng, template_id=0):
+    """
+        Returns a table template like the table_template rows: a header row of wide cells over a grid of
+        integer cells, with a few cells merged across columns
+    """
+
+    # grid
+    nbr_of_rows, nbr_of_cols = int(rng.integers(8, 24)), int(rng.integers(4, 9))
+    col_widths = rng.integers(60, 160, size=nbr_of_cols).tolist()
+    row_height = int(rng.integers(30, 50))
+    header_height = int(rng.integers(50, 90))
+
+    # keep the proportions of a logbook page (the detector rejects tables narrower than MIN_TABLE_ASPECT_RATIO)
+    min_width = 0.5*(header_height + nbr_of_rows*row_height)
+    if sum(col_widths) < min_width:
+        col_widths = [int(np.ceil(width*min_width / sum(col_widths))) for width in col_widths]
+
+    # init
+    rectangles = []
+    def add(x0, y0, w, h, data_type):
+        rectangles.append({'id': len(rectangles), 'x0': x0, 'y0': y0, 'w': w, 'h': h, 'data_type': data_type, 'opts': ''})
+
+    # header, one cell per group of columns
+    x0 = 0
+    for width in np.array_split(col_widths, int(rng.integers(1, 3))):
+        add(x0, 0, int(sum(width)), header_height, 'info')
+        x0 += int(sum(width))
+
+    # rows
+    for r in range(nbr_of_rows):
+        y0 = header_height + r*row_height
+        c = 0
+        while c < nbr_of_cols:
+
+            # merge with the next column now and then
+            span = 2 if c < nbr_of_cols - 1 and rng.random() < 0.08 else 1
+            add(int(sum(col_widths[:c])), y0, int(sum(col_widths[c:c + span])), row_height, 'string' if c == 0 else 'integer')
+            c += span
+
+    return {'id': template_id, 'rectangles': rectangles}
+
+
+def get_template_dimensions(table_template):
+    """
+        Returns the (width, height) covered by the rectangles of a table template
+    """
+
+    width = max([r['x0'] + r['w'] for r in table_template['rectangles']])
+    height = max([r['y0'] + r['h'] for r in table_template['rectangles']])
+
+    return width, height
+
+
+def draw_handwriting(img, rng, x0, y0, w, h, color):
+    """
+        Draws a few pen strokes (smooth random walks) in the box
+    """
+
+    for _ in range(int(rng.integers(1, 4))):
+
+        # random walk with momentum
+        nbr_of_pts = int(rng.integers(6, 20))
+        steps = np.cumsum(rng.normal(0, 1, (nbr_of_pts, 2)), axis=0)
+        steps = np.cumsum(steps, axis=0)
+        steps -= steps.min(axis=0)
+        steps /= np.maximum(steps.max(axis=0), 1e-6)
+
+        # fit in the box, keeping off the borders
+        size = np.array([w*rng.uniform(0.2, 0.6), h*rng.uniform(0.3, 0.6)])
+        origin = np.array([x0 + rng.uniform(0.1, 0.9)*(w - size[0]), y0 + rng.uniform(0.2, 0.8)*(h - size[1])])
+        pts = (origin + steps*size).astype(np.int32)
+
+        cv.polylines(img, [pts], False, color, int(rng.integers(1, 4)), cv.LINE_AA)
+
+
+def render_page(rng, table_template, width=2250, height=3000, jpeg_quality=None):
+    """
+        Returns a photo (BGR) of a logbook page printed from the table template, and the ground truth corners of the
+        table in it ([tl, tr, br, bl] of the outer border). The photo has a perspective warp, a lighting gradient,
+        handwriting in the cells, blur, sensor noise and jpeg artifacts
+    """
+
+    # paper
+    paper = int(rng.integers(215, 250))
+    img = np.full((height, width, 3), paper, dtype=np.uint8)
+
+    # table placement
+    template_width, template_height = get_template_dimensions(table_template)
+    scale = min((width*rng.uniform(0.7, 0.85)) / template_width, (height*rng.uniform(0.65, 0.8)) / template_height)
+    table_width, table_height = int(template_width*scale), int(template_height*scale)
+    x0 = int(rng.integers(int(width*0.05), width - table_width - int(width*0.05)))
+    y0 = int(rng.integers(int(height*0.1), height - table_height - int(height*0.05)))
+
+    # title above the table
+    ink = tuple(int(v) for v in rng.integers(10, 60, size=3))
+    cv.putText(img, f'LOGBOOK {int(rng.integers(1, 99))}', (x0, y0 - int(height*0.03)), cv.FONT_HERSHEY_DUPLEX, 2.0, ink, 3, cv.LINE_AA)
+
+    # cells, with handwriting in some of them
+    line_thickness = int(rng.integers(2, 6))
+    pen = tuple(int(v) for v in rng.integers(20, 120, size=3))
+    for rectangle in table_template['rectangles']:
+        rx0, ry0 = x0 + int(rectangle['x0']*scale), y0 + int(rectangle['y0']*scale)
+        rx1, ry1 = x0 + int((rectangle['x0'] + rectangle['w'])*scale), y0 + int((rectangle['y0'] + rectangle['h'])*scale)
+        cv.rectangle(img, (rx0, ry0), (rx1, ry1), ink, line_thickness)
+        if rectangle['data_type'] != 'info' and rng.random() < 0.6:
+            draw_handwriting(img, rng, rx0, ry0, rx1 - rx0, ry1 - ry0, pen)
+
+    # ground truth, center of the outer border
+    corners = np.float32([[x0, y0], [x0 + table_width, y0], [x0 + table_width, y0 + table_height], [x0, y0 + table_height]])
+
+    # perspective, the page only covers part of the photo (desk around it)
+    page = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    margin = np.array([width, height], dtype=np.float32)*0.06
+    dst = page + (np.array([[1, 1], [-1, 1], [-1, -1], [1, -1]], dtype=np.float32)*margin + rng.uniform(-1, 1, (4, 2)).astype(np.float32)*margin*0.8)
+    M = cv.getPerspectiveTransform(page, dst)
+    desk = tuple(int(v) for v in rng.integers(60, 140, size=3))
+    img = cv.warpPerspective(img, M, (width, height), borderValue=desk)
+    corners = cv.perspectiveTransform(corners.reshape(-1, 1, 2), M).reshape(-1, 2)
+
+    # lighting: a linear gradient in a random direction and a vignette
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    angle = rng.uniform(0, 2*np.pi)
+    gradient = ((xs - width/2)*np.cos(angle) + (ys - height/2)*np.sin(angle)) / max(width, height)
+    vignette = ((xs - width/2)**2 + (ys - height/2)**2) / ((width/2)**2 + (height/2)**2)
+    gain = 1.0 + rng.uniform(0.2, 0.6)*gradient - rng.uniform(0.1, 0.3)*vignette
+    img = np.clip(img.astype(np.float32)*gain[:, :, None], 0, 255)
+
+    # focus blur and sensor noise
+    img = cv.GaussianBlur(img, (0, 0), rng.uniform(0.6, 1.6))
+    img = np.clip(img + rng.normal(0, rng.uniform(2, 6), img.shape).astype(np.float32), 0, 255).astype(np.uint8)
+
+    # jpeg artifacts
+    if jpeg_quality is None:
+        jpeg_quality = int(rng.integers(70, 95))
+    img = cv.imdecode(cv.imencode('.jpg', img, [cv.IMWRITE_JPEG_QUALITY, jpeg_quality])[1], cv.IMREAD_COLOR)
+
+    return img, corners.tolist()
+
+
+def generate_pages(output_dir, nbr_of_pages, seed=0, table_templates=None):
+    """
+        Writes {nbr_of_pages} jpeg pages to {output_dir}, each printed from one of the table templates (generated if none),
+        and returns the manifest: [{image_id, path, table_template_id, corners}]
+    """
+
+    rng = np.random.default_rng(seed)
+
+    # templates
+    if table_templates is None:
+        table_templates = [generate_table_template(rng, template_id=i) for i in range(max(nbr_of_pages // 4, 1))]
+
+    # pages
+    manifest = []
+    for i in range(nbr_of_pages):
+
+        # render
+        table_template = table_templates[i % len(table_templates)]
+        img, corners = render_page(rng, table_template)
+
+        # write, already compressed by render_page (quality 100 keeps its artifacts)
+        image_id = f'page-{i:04d}'
+        path = os.path.join(output_dir, f'{image_id}.jpg')
+        cv.imwrite(path, img, [cv.IMWRITE_JPEG_QUALITY, 100])
+
+        manifest.append({'image_id': image_id, 'path': path, 'table_template_id': table_template['id'], 'corners': corners})
+
+    return manifest
+
+
+if __name__ == '__main__':
+
+    # args
+    output_dir = sys.argv[1]
+    nbr_of_pages = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    # write the pages and their manifest
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = generate_pages(output_dir, nbr_of_pages, seed=seed)
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    print(os.path.join(output_dir, 'manifest.json'))
@@ -0,0 +1,98 @@
+"""
+    Compares the vectorized point sets kernels with the per-point loops they replaced
+
+    usage: python3 benchmarks/pointset.py [nbr_of_points] [repeat]
+"""
+
+# import basic libs
+import os
+import sys
+import timeit
+
+# import image processing libs
+import numpy as np
+
+# import meza_contour from the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from meza_contour.pointset import cosine_similarity, get_nearest_indexes
+
+
+def loop_get_index_of_nearest_points_in_list(pt, pts_pool, MAX_NBR=1):
+    """
+        Previous implementation, one point at a time over a list of [[x, y]] points
+    """
+
+    nodes = np.asarray([p[0] for p in pts_pool])
+    deltas = nodes - np.array(pt)
+    distances = np.einsum('ij,ij->i', deltas, deltas)
+    nbr_of_points = MAX_NBR
+    if len(distances) <= MAX_NBR:
+        nbr_of_points = len(distances)-1
+
+    return list(np.argpartition(distances, nbr_of_points)[:nbr_of_points])
+
+
+def loop_cosine_similarity(pts1, pts2, width, height):
+    """
+        Previous implementation, one pair of points at a time over lists of [[x, y]] points
+    """
+
+    _pts1 = []
+    _pts2 = []
+    for i in range(0, len(pts1)):
+        x1, y1 = np.array(pts1[i][0])
+        x2, y2 = np.array(pts2[i][0])
+        _pts1.append(((x1 - width/2.0) / float(width), (y1 - height/2.0) / float(height)))
+        _pts2.append(((x2 - width/2.0) / float(width), (y2 - height/2.0) / float(height)))
+
+    nume = 0
+    for i in range(0, len(_pts1)):
+        nume += np.dot(np.array(_pts1[i]), np.array(_pts2[i]))
+
+    return nume/(np.linalg.norm(_pts1)*np.linalg.norm(_pts2) + 0.00000001)
+
+
+def loop_score(table_pts, template_pts, width, height):
+    """
+        Nearest template point of every table point, then the cosine similarity of the pairs
+    """
+
+    analog_pts = [template_pts[loop_get_index_of_nearest_points_in_list(pt[0], template_pts)[0]] for pt in table_pts]
+
+    return loop_cosine_similarity(table_pts, analog_pts, width, height)
+
+
+def vectorized_score(table_pts, template_pts, width, height):
+    """
+        Same as loop_score on (N, 2) arrays
+    """
+
+    return cosine_similarity(table_pts, template_pts[get_nearest_indexes(table_pts, template_pts)], width, height)
+
+
+def main(nbr_of_points=500, repeat=5):
+
+    rng = np.random.default_rng(0)
+    width, height = 1000, 1400
+    table_pts = rng.integers(0, [width, height], size=(nbr_of_points, 2))
+    template_pts = rng.integers(0, [width, height], size=(nbr_of_points, 2))
+
+    # same inputs in the list format of the loops
+    table_list = [[list(pt)] for pt in table_pts.tolist()]
+    template_list = [[list(pt)] for pt in template_pts.tolist()]
+
+    # same result
+    expected = loop_score(table_list, template_list, width, height)
+    result = vectorized_score(table_pts, template_pts, width, height)
+    assert abs(expected - result) < 1e-9, (expected, result)
+
+    # timings
+    loop = min(timeit.repeat(lambda: loop_score(table_list, template_list, width, height), number=1, repeat=repeat))
+    vectorized = min(timeit.repeat(lambda: vectorized_score(table_pts, template_pts, width, height), number=1, repeat=repeat))
+    print(f"nearest + cosine similarity, {nbr_of_points} x {nbr_of_points} points")
+    print(f"    loop:       {1000*loop:.2f} ms")
+    print(f"    vectorized: {1000*vectorized:.2f} ms ({loop/vectorized:.1f}x)")
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,58 @@
+"""
+    Compares the single scale and pyramid modes of process(): time per page and distance between the corners they find
+
+    usage: python3 benchmarks/pyramid.py [image_path ...]        (synthetic logbook pages if no image is given)
+"""
+
+# import basic libs
+import os
+import sys
+import time
+
+# import image processing libs
+import numpy as np
+
+# import meza_contour from the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from meza_contour import process
+from meza_contour.imageproc_basic import imread
+
+# synthetic pages
+from logbook import CORNER_KEYS, generate_table_template, render_page
+
+
+def main(image_paths):
+
+    # pages
+    if len(image_paths) > 0:
+        pages = [(os.path.basename(path), imread(path)) for path in image_paths]
+    else:
+        rng = np.random.default_rng(0)
+        pages = [(f'synthetic-{i}', render_page(rng, generate_table_template(rng, template_id=i))[0]) for i in range(6)]
+
+    print(f"{'page':<20}{'single (s)':>12}{'pyramid (s)':>13}{'max corner dist (px)':>22}")
+    for name, img in pages:
+
+        # process both ways
+        start = time.perf_counter()
+        single = process(img, scale_mode='single')
+        single_duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pyramid = process(img, scale_mode='pyramid')
+        pyramid_duration = time.perf_counter() - start
+
+        # distance between the corners, in pixels of the original image
+        if single is None or pyramid is None:
+            distance = 'single failed' if single is None else 'pyramid failed'
+        else:
+            rect_single = single['rectangles'][0]
+            rect_pyramid = pyramid['rectangles'][0]
+            distance = max([np.hypot(rect_single[kx] - rect_pyramid[kx], rect_single[ky] - rect_pyramid[ky]) for kx, ky in CORNER_KEYS])
+            distance = f'{distance:.1f}'
+
+        print(f"{name:<20}{single_duration:>12.2f}{pyramid_duration:>13.2f}{distance:>22}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,232 @@
+"""
+    Runs meza_contour over synthetic logbook pages (see logbook.py) and reports the throughput, the p50/p95 latency of
+    each stage (from the metrics block of the results) and the accuracy of the corners against the ground truth.
+    The report is written as json so that runs on different commits can be compared
+
+    usage: python3 benchmarks/suite.py [--pages 24] [--seed 0] [--templates templates.json] [--manifest manifest.json]
+                                       [--report report.json] [--compare previous_report.json]
+"""
+
+# import basic libs
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+
+# import image processing libs
+import numpy as np
+import cv2 as cv
+
+# every page is processed, a rerun on the same commit would otherwise only hit the results cache
+os.environ['MEZA_CONTOUR_CACHE'] = 'off'
+
+# import meza_contour from the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import meza_contour.config as config
+from meza_contour.batch import run_job
+
+# synthetic pages
+from logbook import CORNER_KEYS, generate_pages
+
+
+# a page is accurate if all its corners are within this many pixels of the ground truth
+CORNER_TOLERANCE = 15
+
+# configuration reported with the results
+CONFIG_KEYS = ['IMREAD_MODE', 'IMREAD_COLOR_MODE', 'PROCESS_SCALE_MODE', 'CANNY_SEARCH_MODE', 'CANNY_SEARCH_WORKERS', 'HOUGH_LINES_MODE', 'LINE_DETECTOR']
+
+
+def get_commit():
+    """
+        Returns the current git commit (short hash, with a + if the tree is modified), or None outside of a repository
+    """
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+        modified = subprocess.run(['git', 'status', '--porcelain', '--', '..'], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+    except:
+        return None
+
+    return commit + ('+' if len(modified) > 0 else '')
+
+
+def get_percentiles(values):
+    """
+        Returns the p50, p95 and max of a list of values (None if empty)
+    """
+
+    if len(values) == 0:
+        return None
+
+    return {
+        'p50': round(float(np.percentile(values, 50)), 3),
+        'p95': round(float(np.percentile(values, 95)), 3),
+        'max': round(float(np.max(values)), 3)
+    }
+
+
+def get_corner_error(result, corners):
+    """
+        Returns the largest distance (px) between the corners of the detected table and the ground truth
+    """
+
+    rectangle = result['rectangles'][0]
+
+    return max([float(np.hypot(rectangle[kx] - x, rectangle[ky] - y)) for (kx, ky), (x, y) in zip(CORNER_KEYS, corners)])
+
+
+def run_pages(manifest, output_dir):
+    """
+        Runs meza_contour on every page of the manifest (like the batch does), returns the result of each page
+    """
+
+    pages = []
+    for page in manifest:
+
+        # run
+        job = {'image_id': page['image_id'], 'path': page['path'], 'outpath': os.path.join(output_dir, page['image_id'] + '-out.json')}
+        status = run_job(job)
+
+        # init
+        result = {
+            'image_id': page['image_id'],
+            'status': status['status'],
+            'error': status['error'],
+            'duration_ms': round(status['duration']*1e3, 3),
+            'stages': {},
+            'corner_error_px': None
+        }
+
+        # stages and accuracy
+        if status['status'] == 'done':
+            with open(status['outpath'], 'r', encoding='utf-8') as f:
+                results = json.load(f)
+            result['stages'] = {name: stage['total_ms'] for name, stage in results.get('metrics', {}).get('stages', {}).items()}
+            result['corner_error_px'] = round(get_corner_error(results, page['corners']), 3)
+
+        pages.append(result)
+
+    return pages
+
+
+def build_report(pages, duration, seed):
+    """
+        Returns the report of a run of the suite
+    """
+
+    # pages that went through
+    done = [page for page in pages if page['status'] == 'done']
+    errors = [page['corner_error_px'] for page in done]
+
+    # stages, in order of appearance
+    stage_names = []
+    for page in done:
+        stage_names += [name for name in page['stages'] if name not in stage_names]
+
+    return {
+        'commit': get_commit(),
+        'seed': seed,
+        'nbr_of_pages': len(pages),
+        'versions': {'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv.__version__},
+        'config': {key: getattr(config, key) for key in CONFIG_KEYS},
+        'summary': {
+            'throughput_pages_per_s': round(len(pages) / duration, 4) if duration > 0 else None,
+            'success_rate': round(len(done) / float(max(len(pages), 1)), 4),
+            'accuracy': round(sum([error <= CORNER_TOLERANCE for error in errors]) / float(max(len(pages), 1)), 4),
+            'corner_error_px': get_percentiles(errors),
+            'latency_ms': get_percentiles([page['duration_ms'] for page in pages])
+        },
+        'stages_ms': {name: get_percentiles([page['stages'][name] for page in done if name in page['stages']]) for name in stage_names},
+        'pages': pages
+    }
+
+
+def print_report(report, previous=None):
+    """
+        Prints the summary and the stages of a report, next to those of a previous report if given
+    """
+
+    def row(name, value, previous_value):
+        line = f"{name:<32}{value if value is not None else '-':>12}"
+        if previous is not None:
+            line += f"{previous_value if previous_value is not None else '-':>12}"
+            if isinstance(value, (int, float)) and isinstance(previous_value, (int, float)) and previous_value != 0:
+                line += f"{(value - previous_value) / previous_value*100:>+10.1f}%"
+        print(line)
+
+    # header
+    header = f"{'':<32}{str(report['commit']):>12}"
+    if previous is not None:
+        header += f"{str(previous['commit']):>12}{'delta':>11}"
+    print(header)
+
+    # summary
+    previous_summary = previous['summary'] if previous is not None else {}
+    for key in ['throughput_pages_per_s', 'success_rate', 'accuracy']:
+        row(key, report['summary'][key], previous_summary.get(key))
+    for key in ['latency_ms', 'corner_error_px']:
+        for percentile in ['p50', 'p95']:
+            row(f'{key} {percentile}', (report['summary'][key] or {}).get(percentile), (previous_summary.get(key) or {}).get(percentile))
+
+    # stages
+    previous_stages = previous['stages_ms'] if previous is not None else {}
+    for name, percentiles in report['stages_ms'].items():
+        for percentile in ['p50', 'p95']:
+            row(f'{name} {percentile} (ms)', (percentiles or {}).get(percentile), (previous_stages.get(name) or {}).get(percentile))
+
+
+def main():
+
+    # args
+    parser = argparse.ArgumentParser(description='meza_contour benchmark suite on synthetic logbook pages')
+    parser.add_argument('--pages', type=int, default=24, help='number of pages to generate')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated pages')
+    parser.add_argument('--templates', help='json list of table_template rows to print the pages from (generated if not given)')
+    parser.add_argument('--manifest', help='manifest of pages written by logbook.py (instead of generating them)')
+    parser.add_argument('--report', help='where to write the json report')
+    parser.add_argument('--compare', help='json report of a previous run to compare with')
+    args = parser.parse_args()
+
+    # the stages come from the metrics block of the results
+    if config.METRICS_MODE != 'json':
+        print("ERROR: the suite needs the metrics in the results (MEZA_CONTOUR_METRICS=json)")
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+
+        # pages
+        if args.manifest is not None:
+            with open(args.manifest, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        else:
+            table_templates = None
+            if args.templates is not None:
+                with open(args.templates, 'r', encoding='utf-8') as f:
+                    table_templates = json.load(f)
+            manifest = generate_pages(output_dir, args.pages, seed=args.seed, table_templates=table_templates)
+
+        # run
+        start = time.perf_counter()
+        pages = run_pages(manifest, output_dir)
+        duration = time.perf_counter() - start
+
+    # report
+    report = build_report(pages, duration, args.seed)
+    previous = None
+    if args.compare is not None:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    print_report(report, previous=previous)
+
+    if args.report is not None:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
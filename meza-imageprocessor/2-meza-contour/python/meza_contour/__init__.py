@@ -3,7 +3,10 @@ import json
 
 # import config
 from .config import MIN_IMG_WIDTH, MIN_IMG_HEIGHT, MAX_IMG_WIDTH, MAX_IMG_HEIGHT
-from .config import PROCESS_IMG_LONGEST_DIM_MIN, PROCESS_IMG_LONGEST_DIM_MAX
+from .config import PROCESS_IMG_LONGEST_DIM_MIN, PROCESS_IMG_LONGEST_DIM_MAX, PROCESS_SCALE_MODE
+from .config import IMREAD_MODE, IMREAD_REDUCED_MIN_LONGEST_DIM, IMREAD_COLOR_MODE
+from .config import METRICS_MODE, METRICS_TRACE_PATH
+from .config import RESULT_CACHE_MODE, RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_ENTRIES
 from .config import table_template_schema, rectangle_schema
 from .config import valid_image_extensions, valid_data_types
 
@@ -13,9 +16,15 @@ from .datatype import isNone, isStrInList, isListNonEmpty, isDict
 # import filesystem lib
 from .filesystem import fileExists, fileExtension
 
+# import metrics lib
+from .metrics import Metrics, collect, timer
+
+# import results cache lib
+from .cache import get_cache_key, load_result, store_result
+
 # import image processing lib
-from .imageproc_basic import imread, bound_dimensions, resize, cvtToGray, get_table_template_dimensions
-from .imageproc_complex import project_rectangles, compute_corners, extract_contours
+from .imageproc_basic import imread, imread_reduced, bound_dimensions, resize, cvtToGray, get_table_template_dimensions
+from .imageproc_complex import project_rectangles, compute_corners, extract_contours, extract_corners_pyramid
 
 
 def are_processing_results_valid(results):
@@ -27,7 +36,7 @@ def are_processing_results_valid(results):
     return True
 
 
-def process(img, DEBUG=False):
+def process(img, DEBUG=False, scale_mode=None, src_size=None):
 
     # init returned dict
     attributes = {
@@ -37,28 +46,44 @@ def process(img, DEBUG=False):
         "rectangles": []
     }
 
-    # extract dimensions
+    # extract dimensions, of the image on disk when img is a reduced decode of it
     height = img.shape[0]
     width = img.shape[1]
+    if src_size is not None:
+        width, height = src_size
     attributes['width'] = width
     attributes['height'] = height
 
     # bound the dimensions of the image to our min/max thresholds
     new_width, new_height, resize_factor = bound_dimensions(width, height, MIN_LENGTH=PROCESS_IMG_LONGEST_DIM_MIN, MAX_LENGTH=PROCESS_IMG_LONGEST_DIM_MAX)
 
-    # resize image to a processable size
-    img_resized = resize(img, new_width, new_height)
+    with timer('resize'):
+
+        # resize image to a processable size (the same size whether img was decoded in full or reduced)
+        img_resized = resize(img, new_width, new_height)
+
+        # convert to grayscale (unless img was decoded as grayscale)
+        img_resized_gray = img_resized if img_resized.ndim == 2 else cvtToGray(img_resized)
 
-    # convert to grayscale
-    img_resized_gray = cvtToGray(img_resized)
+    # set scale mode
+    if scale_mode is None:
+        scale_mode = PROCESS_SCALE_MODE
 
-    # extract contours of tables
-    contours_resized = extract_contours(img_resized_gray)
-    if not isListNonEmpty(contours_resized): return None
+    # find the tables on a downscaled copy, refine their corners at the processing size
+    contours_corners_resized = None
+    if scale_mode == 'pyramid':
+        contours_corners_resized = extract_corners_pyramid(img_resized_gray)
 
-    # extract corners of contours
-    contours_corners_resized = compute_corners(img_resized_gray, contours_resized)
-    if not isListNonEmpty(contours_corners_resized): return None
+    # otherwise (or if nothing was found on the downscaled copy) at the processing size
+    if not isListNonEmpty(contours_corners_resized):
+
+        # extract contours of tables
+        contours_resized = extract_contours(img_resized_gray)
+        if not isListNonEmpty(contours_resized): return None
+
+        # extract corners of contours
+        contours_corners_resized = compute_corners(img_resized_gray, contours_resized)
+        if not isListNonEmpty(contours_corners_resized): return None
 
     # scale corners back to original image
     contours_corners = []
@@ -101,7 +126,55 @@ def process(img, DEBUG=False):
     return attributes
 
 
-def run(img_path, json_outpath=None, DEBUG=False):
+def run(img_path, json_outpath=None, DEBUG=False, read_stats=None, trace_outpath=None):
+
+    # set trace path
+    if trace_outpath is None:
+        trace_outpath = METRICS_TRACE_PATH
+
+    # init
+    read_stats = read_stats if read_stats is not None else {}
+    read_stats['cache'] = 'off'
+
+    # load and process, collecting the time spent in each stage
+    metrics = Metrics(trace=trace_outpath is not None)
+    with collect(metrics), timer('run'):
+
+        # result of an identical image processed before (same code and config)
+        result = None
+        cache_key = None
+        if RESULT_CACHE_MODE == 'on' and not DEBUG:
+            with timer('cache_lookup'):
+                cache_key = get_cache_key(img_path)
+                result = load_result(RESULT_CACHE_DIR, cache_key) if cache_key is not None else None
+            read_stats['cache'] = 'hit' if result is not None else 'miss'
+
+        # otherwise process, and keep the result for the next time
+        if result is None:
+            result = run_image(img_path, DEBUG=DEBUG, read_stats=read_stats)
+            if cache_key is not None and isDict(result):
+                store_result(RESULT_CACHE_DIR, cache_key, result, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_ENTRIES)
+
+    # write the trace, failed runs included
+    if trace_outpath is not None:
+        metrics.write_trace(trace_outpath, args={'image': img_path})
+
+    # check if failed
+    if not isDict(result): return None
+
+    # add the metrics
+    if METRICS_MODE == 'json':
+        result['metrics'] = metrics.to_dict()
+
+    # write results to disk
+    if json_outpath is not None:
+        with open(json_outpath, 'w+', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=True)
+
+    return result
+
+
+def run_image(img_path, DEBUG=False, read_stats=None):
 
     """
         1. Validate Image Path
@@ -124,17 +197,24 @@ def run(img_path, json_outpath=None, DEBUG=False):
         2. Validate Image
     """
 
-    # load image
-    img_src = imread(img_path)
+    # load image, large jpegs are decoded at a reduced size that still covers the processing size
+    read_stats = read_stats if read_stats is not None else {}
+    gray = IMREAD_COLOR_MODE == 'gray'
+    with timer('imread'):
+        if IMREAD_MODE == 'reduced':
+            img_src = imread_reduced(img_path, IMREAD_REDUCED_MIN_LONGEST_DIM, read_stats=read_stats, gray=gray)
+        else:
+            img_src = imread(img_path, gray=gray)
+            read_stats['decode'] = 'full'
 
     # check if successful
     if isNone(img_src):
         print("ERROR: Image could not be loaded")
         return None
 
-    # extract dimensions
-    height = img_src.shape[0]
-    width = img_src.shape[1]
+    # extract dimensions (of the image on disk)
+    height = read_stats.get('height', img_src.shape[0])
+    width = read_stats.get('width', img_src.shape[1])
 
     # check that the image is not too small nor too big
     if width < MIN_IMG_WIDTH or height < MIN_IMG_HEIGHT:
@@ -150,14 +230,6 @@ def run(img_path, json_outpath=None, DEBUG=False):
     """
 
     # process
-    result = process(img_src, DEBUG=DEBUG)
-
-    # check if failed
-    if not isDict(result): return None
-
-    # write results to disk
-    if json_outpath is not None:
-        with open(json_outpath, 'w+', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=True)
+    result = process(img_src, DEBUG=DEBUG, src_size=(width, height))
 
     return result
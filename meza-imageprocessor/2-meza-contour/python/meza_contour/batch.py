@@ -0,0 +1,231 @@
+"""
+    This file contains functions to run meza_contour on many images in one invocation
+"""
+
+# import basic libs
+import io
+import os
+import sys
+import json
+import time
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+# import config
+from .config import valid_image_extensions
+
+# import datatype lib
+from .datatype import isDict, isListNonEmpty, isStrInList, isStringNonEmpty
+
+# import filesystem lib
+from .filesystem import fileExists, fileExtension, fileNameWithoutExtension
+
+
+def init_job_status(job, error=None):
+    """
+        Returns the status of a job that has not succeeded (yet)
+    """
+
+    return {
+        'image_id': job.get('image_id'),
+        'path': job.get('path'),
+        'outpath': None,
+        'status': 'failed',
+        'error': error,
+        'decode': None,
+        'cache': None,
+        'duration': 0.0
+    }
+
+
+def run_job(job):
+    """
+        Runs meza_contour on one job ({image_id, path, outpath}), returns its status and timing.
+        What the decoder prints is captured so that the caller controls stdout.
+    """
+
+    # import here, this module is imported by the package
+    from . import run
+
+    # init returned status
+    status = init_job_status(job)
+
+    # how the image was decoded (or if its result was cached)
+    read_stats = {}
+
+    # capture what the decoder prints
+    logs = io.StringIO()
+
+    # run
+    start = time.time()
+    try:
+        with redirect_stdout(logs):
+            results = run(job['path'], json_outpath=job['outpath'], read_stats=read_stats)
+
+        if isDict(results):
+            status['outpath'] = job['outpath']
+            status['status'] = 'done'
+
+    except Exception as e:
+        print(f"ERROR: {e}", file=logs)
+
+    status['duration'] = time.time() - start
+    status['decode'] = read_stats.get('decode')
+    status['cache'] = read_stats.get('cache')
+
+    # forward the logs
+    logs = logs.getvalue().strip()
+    if len(logs) > 0:
+        print(logs, file=sys.stderr, flush=True)
+
+        # keep the last error printed by the decoder (a job that is done may have recovered from one)
+        errors = [row for row in logs.split('\n') if row.startswith('ERROR')]
+        if len(errors) > 0 and status['status'] != 'done':
+            status['error'] = errors[-1]
+
+    return status
+
+
+def load_manifest(manifest_path):
+    """
+        Loads a list of jobs ({image_id, path, outpath}) from a json file
+    """
+
+    # check input
+    if not fileExists(manifest_path): return None
+
+    # load
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            jobs = json.load(f)
+    except:
+        return None
+
+    # validate
+    if not isListNonEmpty(jobs): return None
+    for job in jobs:
+        if not isDict(job) or not isStringNonEmpty(job.get('path')) or not isStringNonEmpty(job.get('outpath')):
+            return None
+
+    return jobs
+
+
+def jobs_from_directory(dirpath, outdirpath=None):
+    """
+        Returns one job per image of a directory, results are written next to the images unless outdirpath is set
+    """
+
+    # check input
+    if not isStringNonEmpty(dirpath) or not os.path.isdir(dirpath): return None
+
+    # set output directory
+    if outdirpath is None:
+        outdirpath = dirpath
+
+    # go through images
+    jobs = []
+    for filename in sorted(os.listdir(dirpath)):
+
+        # build path
+        path = os.path.join(dirpath, filename)
+        if not os.path.isfile(path): continue
+
+        # only keep images with an extension
+        extension = fileExtension(path)
+        if len(extension) == 0 or not isStrInList(extension.lower(), valid_image_extensions): continue
+
+        # image id is the file name
+        image_id = fileNameWithoutExtension(path)
+
+        # append
+        jobs.append({
+            'image_id': image_id,
+            'path': path,
+            'outpath': os.path.join(outdirpath, f"{image_id}-out.json")
+        })
+
+    return jobs
+
+
+def run_pool(jobs, indexes, nbr_of_workers, on_status):
+    """
+        Runs the jobs at {indexes} across {nbr_of_workers} processes, on_status(index, status) as each one completes.
+        Returns the indexes of the jobs that did not complete because a process of the pool died
+    """
+
+    broken = []
+    with ProcessPoolExecutor(max_workers=nbr_of_workers) as executor:
+
+        # submit (the pool may die before all the jobs are in)
+        futures = {}
+        for i in indexes:
+            try:
+                futures[executor.submit(run_job, jobs[i])] = i
+            except BrokenProcessPool:
+                broken.append(i)
+
+        for future in as_completed(futures):
+            i = futures[future]
+
+            # a process died (segfault, out of memory): every job it had not completed fails with it
+            try:
+                status = future.result()
+            except BrokenProcessPool:
+                broken.append(i)
+                continue
+            except Exception as e:
+                status = init_job_status(jobs[i], error=f"ERROR: {e}")
+
+            on_status(i, status)
+
+    return sorted(broken)
+
+
+def run_batch(jobs, summary_outpath=None, nbr_of_workers=1, on_done=None):
+    """
+        Runs meza_contour on every job, optionally across processes, and writes a summary with each image's status and timing.
+        on_done(status) is called as each image completes (in completion order), the summary keeps the order of the jobs.
+        If a process dies, only its own image fails: the other jobs of its pool are run again
+    """
+
+    # init
+    images = [None]*len(jobs)
+
+    def on_status(i, status):
+        images[i] = status
+        if on_done is not None:
+            on_done(status)
+
+    # run
+    start = time.time()
+    if nbr_of_workers > 1 and len(jobs) > 1:
+        broken = run_pool(jobs, range(len(jobs)), nbr_of_workers, on_status)
+
+        # a process died: run the jobs it took down again, together
+        if len(broken) > 0:
+            broken = run_pool(jobs, broken, nbr_of_workers, on_status)
+
+        # it died again: one process per job, so that only the image killing it fails
+        for i in broken:
+            if len(run_pool(jobs, [i], 1, on_status)) > 0:
+                on_status(i, init_job_status(jobs[i], error="ERROR: Process died while running the job"))
+    else:
+        for i, job in enumerate(jobs):
+            on_status(i, run_job(job))
+
+    # build summary
+    summary = {
+        'nbr_of_images': len(images),
+        'nbr_of_done': len([image for image in images if image['status'] == 'done']),
+        'nbr_of_cache_hits': len([image for image in images if image['cache'] == 'hit']),
+        'duration': time.time() - start,
+        'images': images
+    }
+
+    # write summary to disk
+    if summary_outpath is not None:
+        with open(summary_outpath, 'w+', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=True)
+
+    return summary
@@ -0,0 +1,281 @@
+"""
+    This file contains the on-disk cache of the results of run(), keyed by the content of the image, the config and
+    the code: re-queued images and duplicate uploads get the result of their first run without being processed again.
+    The batch workers share the directory, entries are written atomically and evicted least recently used first
+"""
+
+# import basic libs
+import os
+import math
+import json
+import hashlib
+import tempfile
+
+# import image processing libs (their version changes the results)
+import numpy as np
+import cv2 as cv
+
+# import config
+from . import config
+
+# import metrics lib
+from .metrics import count
+
+
+# settings that do not change the results
+CONFIG_KEYS_IGNORED = {'RESULT_CACHE_MODE', 'RESULT_CACHE_DIR', 'RESULT_CACHE_MAX_BYTES', 'RESULT_CACHE_MAX_ENTRIES', 'RESULT_CACHE_RESCAN_INTERVAL', 'METRICS_MODE', 'METRICS_TRACE_PATH', 'CANNY_SEARCH_WORKERS'}
+
+# eviction goes down to this fraction of the caps, so that the next stores do not evict (and rescan) again
+EVICTION_LOW_WATER = 0.9
+
+# extension of the entries
+CACHE_ENTRY_EXTENSION = '.json'
+
+# hash of the code and config, computed once per process
+_version = None
+
+# size of each cache directory as tracked by this process: {bytes, entries, stores since the last scan}
+_usage = {}
+
+# lookups of this process
+cache_stats = {
+    'hits': 0,
+    'misses': 0,
+    'stores': 0,
+    'evictions': 0
+}
+
+
+def get_version():
+    """
+        Returns the hash of the package's code, of the config values that change the results and of the opencv and
+        numpy versions
+    """
+
+    global _version
+
+    if _version is None:
+
+        h = hashlib.sha256()
+
+        # code
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        for filename in sorted(os.listdir(package_dir)):
+            if filename.endswith('.py'):
+                with open(os.path.join(package_dir, filename), 'rb') as f:
+                    h.update(filename.encode('utf-8'))
+                    h.update(f.read())
+
+        # config
+        values = {key: value for key, value in vars(config).items() if key.isupper() and key not in CONFIG_KEYS_IGNORED}
+        h.update(json.dumps(values, sort_keys=True, default=str).encode('utf-8'))
+
+        # libraries
+        h.update(f'opencv {cv.__version__} numpy {np.__version__}'.encode('utf-8'))
+
+        _version = h.hexdigest()
+
+    return _version
+
+
+def get_cache_key(img_path):
+    """
+        Returns the cache key of an image: sha-256 of its bytes, the code and the config. None if it can not be read
+    """
+
+    h = hashlib.sha256()
+
+    try:
+        with open(img_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    except:
+        return None
+
+    h.update(get_version().encode('utf-8'))
+
+    return h.hexdigest()
+
+
+def get_cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key + CACHE_ENTRY_EXTENSION)
+
+
+def load_result(cache_dir, key):
+    """
+        Returns the cached result of a key (and marks it as recently used), None if not cached
+    """
+
+    path = get_cache_path(cache_dir, key)
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+
+        # most recently used
+        os.utime(path)
+
+    except:
+        cache_stats['misses'] += 1
+        count('cache_misses')
+        return None
+
+    cache_stats['hits'] += 1
+    count('cache_hits')
+
+    return result
+
+
+def get_disk_size(stat):
+    """
+        Returns the space a file takes on disk (whole blocks), its size where the blocks are not reported
+    """
+
+    blocks = getattr(stat, 'st_blocks', None)
+
+    return blocks*512 if blocks is not None else stat.st_size
+
+
+def store_result(cache_dir, key, result, max_bytes, max_entries=None):
+    """
+        Stores the result of a key, then evicts the least recently used results if the cache is past max_bytes
+        or max_entries. The size of the cache is tracked, the directory is only scanned every RESULT_CACHE_RESCAN_INTERVAL
+        stores or to evict
+    """
+
+    # size of the cache, scanned on the first store of this process
+    usage = _usage.get(cache_dir)
+    if usage is None:
+        usage = scan(cache_dir)
+
+    path = get_cache_path(cache_dir, key)
+    tmp_path = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # entry replaced (another worker stored the same image)
+        try:
+            previous = get_disk_size(os.stat(path))
+        except FileNotFoundError:
+            previous = None
+
+        # write next to the entry, then move it in place (readers never see a partial entry)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=True)
+        size = get_disk_size(os.stat(tmp_path))
+        os.replace(tmp_path, path)
+
+    except:
+        print("ERROR: Result could not be cached")
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+    cache_stats['stores'] += 1
+
+    # track
+    usage['bytes'] += size - (previous or 0)
+    usage['entries'] += 1 if previous is None else 0
+    usage['stores'] += 1
+
+    # other processes store too, rescan now and then
+    if usage['stores'] >= config.RESULT_CACHE_RESCAN_INTERVAL:
+        usage = scan(cache_dir)
+
+    # bound the size of the cache
+    if usage['bytes'] > max_bytes or (max_entries is not None and usage['entries'] > max_entries):
+        evict(cache_dir, max_bytes, max_entries)
+
+    return True
+
+
+def get_entries(cache_dir):
+    """
+        Returns the (last used, disk size, path) of the entries of the cache
+    """
+
+    entries = []
+
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(CACHE_ENTRY_EXTENSION): continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, get_disk_size(stat), entry.path))
+    except FileNotFoundError:
+        pass
+
+    return entries
+
+
+def scan(cache_dir, entries=None):
+    """
+        Resets the tracked size of the cache from its entries (listed if not given), returns it
+    """
+
+    if entries is None:
+        entries = get_entries(cache_dir)
+
+    _usage[cache_dir] = {'bytes': sum([size for _, size, _ in entries]), 'entries': len(entries), 'stores': 0}
+
+    return _usage[cache_dir]
+
+
+def evict(cache_dir, max_bytes, max_entries=None):
+    """
+        Deletes the least recently used entries until the cache fits in EVICTION_LOW_WATER of max_bytes and max_entries,
+        returns the number deleted
+    """
+
+    # total size
+    entries = get_entries(cache_dir)
+    total = sum([size for _, size, _ in entries])
+    nbr_of_entries = len(entries)
+    if total <= max_bytes and (max_entries is None or nbr_of_entries <= max_entries):
+        scan(cache_dir, entries)
+        return 0
+
+    # targets
+    target_bytes = max_bytes*EVICTION_LOW_WATER
+    target_entries = max_entries*EVICTION_LOW_WATER if max_entries is not None else math.inf
+
+    # oldest first
+    entries = sorted(entries)
+    nbr_of_evictions = 0
+    kept = []
+    for i, (_, size, path) in enumerate(entries):
+
+        if total <= target_bytes and nbr_of_entries <= target_entries:
+            kept = entries[i:]
+            break
+
+        # another worker may have evicted it already
+        try:
+            os.remove(path)
+            nbr_of_evictions += 1
+        except FileNotFoundError:
+            pass
+
+        total -= size
+        nbr_of_entries -= 1
+
+    cache_stats['evictions'] += nbr_of_evictions
+
+    # what is left
+    scan(cache_dir, kept)
+
+    return nbr_of_evictions
+
+
+def get_cache_info(cache_dir):
+    """
+        Returns the number of entries and disk size of the cache, with the lookups of this process
+    """
+
+    entries = get_entries(cache_dir)
+
+    return dict(cache_stats, entries=len(entries), bytes=sum([size for _, size, _ in entries]))
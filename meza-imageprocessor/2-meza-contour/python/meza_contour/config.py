@@ -1,3 +1,7 @@
+# import basic libs
+import os
+import tempfile
+
 # quality of jpeg when writing to disk
 JPEG_QUALITY = 100
 
@@ -19,6 +23,43 @@ MAX_IMG_HEIGHT = 10000
 PROCESS_IMG_LONGEST_DIM_MIN = 1080
 PROCESS_IMG_LONGEST_DIM_MAX = 2160
 
+# How images are loaded: 'reduced' lets libjpeg decode a large jpeg at 1/2, 1/4 or 1/8 of its size as long as its longest
+# side stays at least IMREAD_REDUCED_MIN_LONGEST_DIM (so it is still only downsized to the processing size), 'full' always
+# decodes the whole image
+IMREAD_MODE = 'reduced'
+IMREAD_REDUCED_MIN_LONGEST_DIM = PROCESS_IMG_LONGEST_DIM_MAX
+
+# Channels the image is loaded with: 'color' decodes BGR and converts the resized copy to grayscale, 'gray' decodes
+# straight to 8-bit grayscale (a third of the memory, nothing downstream of the decode needs color)
+IMREAD_COLOR_MODE = 'color'
+
+# Metrics of each run (time per stage, counters of passes, contours, hough calls, lines and templates): 'json' adds
+# them to the result json as a 'metrics' block, 'off' leaves them out. If METRICS_TRACE_PATH is set, the timed calls
+# are also written as trace events: appended one per line to a .jsonl, as a chrome trace otherwise (overridable
+# through the environment)
+METRICS_MODE = os.environ.get('MEZA_CONTOUR_METRICS', 'json')
+METRICS_TRACE_PATH = os.environ.get('MEZA_CONTOUR_TRACE') or None
+
+# Results of run() are cached on disk, keyed by the sha-256 of the image bytes, the code and the config values that change
+# the results: 'on' returns the result of an identical image processed before, 'off' always processes. Past
+# RESULT_CACHE_MAX_BYTES (disk blocks) or RESULT_CACHE_MAX_ENTRIES the least recently used results are evicted
+# (overridable through the environment). The size is tracked by each process and only rescanned every
+# RESULT_CACHE_RESCAN_INTERVAL stores (other processes share the directory) or when it goes past the caps
+RESULT_CACHE_MODE = os.environ.get('MEZA_CONTOUR_CACHE', 'on')
+RESULT_CACHE_DIR = os.environ.get('MEZA_CONTOUR_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'meza-contour-cache')
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('MEZA_CONTOUR_CACHE_MAX_BYTES', 256*1024*1024))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('MEZA_CONTOUR_CACHE_MAX_ENTRIES', 20000))
+RESULT_CACHE_RESCAN_INTERVAL = 500
+
+# How the tables are found in the processed image: 'single' sweeps the Canny thresholds at the processing size,
+# 'pyramid' sweeps them on a copy downscaled by an integer factor (longest side close to PROCESS_DETECT_LONGEST_DIM)
+# and only refines the contours and corners on crops of the processing size image around each table
+PROCESS_SCALE_MODE = 'single'
+PROCESS_DETECT_LONGEST_DIM = 720
+
+# Margin around a table detected on the downscaled copy, as a fraction of its longest side
+PROCESS_ROI_MARGIN = 0.05
+
 # When processing the table we resize it so that its longest side measures
 PROCESS_TABLE_LONGEST_DIM_MIN = 900
 PROCESS_TABLE_LONGEST_DIM_MAX = 1800
@@ -37,6 +78,18 @@ LOWER_BOUND_CANNY_THRESH = [40,0]
 UPPER_BOUND_CANNY_THRESH = [200,60]
 DELTA_CANNY_THRESH = -10
 
+# How the Canny thresholds grid is searched: 'exhaustive' runs every pass, 'coarse_to_fine' runs every
+# CANNY_COARSE_STEP-th threshold and then refines around the best candidate until it stops moving
+CANNY_SEARCH_MODE = 'exhaustive'
+CANNY_COARSE_STEP = 2
+
+# The coarse search stops once the best candidate did not change for this many passes (whatever its number of tables)
+CANNY_SEARCH_PATIENCE = 6
+
+# Number of threads running the passes of the Canny thresholds search (overridable through the environment).
+# Defaults to the CPUs this process may run on (affinity / container cpuset), not to every core of the machine
+CANNY_SEARCH_WORKERS = int(os.environ.get('MEZA_CONTOUR_SWEEP_WORKERS', len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)))
+
 # When going through potential table contours, we discard the ones who are bigger in area than the previous ones by this amount
 MAX_MIN_AREA_RECT_FRAC = 1.02
 
@@ -76,6 +129,15 @@ HOUGH_LONG_LINES_TRESH = [130, 120, 110, 100, 90, 80, 70, 60]             # [110
 HOUGH_BASIC_LINES_TRESH = [60, 70, 80, 90, 100, 110]             # [60, 70, 80, 90, 100]
 HOUGH_THRESHOLD_MIN = 60
 
+# How the hough lines of a table are extracted: 'exact' runs HoughLinesP for every HOUGH_BASIC_LINES_TRESH (results are
+# reused when the edge maps of two thresholds are identical), 'single' runs it once per edge map at the lowest threshold
+# and keeps the segments with enough edge pixel votes
+HOUGH_LINES_MODE = 'exact'
+
+# How the lines of a rectified table are found: 'hough' (HoughLinesP) or 'profile' (peaks of the row/column projections
+# of the edge maps, the lines of a warped table being nearly axis aligned)
+LINE_DETECTOR = 'hough'
+
 # When grouping neighboring lines we set this thickness (> 1)
 LINE_GROUP_THICKNESS = 5
 
@@ -98,6 +160,12 @@ MIN_TABLE_INTERSECTION_POINTS = 0.02
 # Table aspect ratio and Table template aspect ratio must be higher than
 MIN_ASPECT_RATIO_TABLE_AND_TABLE_TEMPLATE = 0.6
 
+# Templates are ranked by how close their row/column lines histograms (this many bins) are to the table's lines,
+# only the best TEMPLATE_SHORTLIST_SIZE are fully scored (0 scores them all). Off by default: the shortlist can drop
+# the right template when there are many of them, set it only once its recall was checked on such a corpus
+TEMPLATE_SIGNATURE_BINS = 32
+TEMPLATE_SHORTLIST_SIZE = 0
+
 # Table template has to at least have this fit score
 MIN_TABLE_TEMPLATE_FIT_SCORE = 0.992
 
@@ -107,5 +175,8 @@ MAX_RECT_AREA_RATIO_DIFF = 0.25
 # CLOSENESS BETWEEN RECTANGLES (MUST BE < 0.5)
 CLOSENESS_FACTOR = 0.1
 
+# How far the fit propagates from the fitted rects, in number of walls (1: only their direct neighbours)
+NEIGHBOURS_FIT_MAX_LEVEL = 1
+
 # Simplification of Contour (to remove little apendages)
 SIMPLIFICATION_FACTOR=0.05
\ No newline at end of file
@@ -3,9 +3,11 @@
 """
 
 # import basic libs
-from copy import deepcopy
 import math
 
+# import point sets lib
+from .pointset import as_points, get_nearest_points
+
 # import image processing libs
 try:
     import numpy as np
@@ -248,49 +250,6 @@ def accumulate_contour_angles(contour):
     return accu
 
 
-def get_index_of_nearest_points_in_list(pt, pts_pool, MAX_NBR=1):
-    """
-        Takes a list of points and a target point and returns the closest point
-    """
-
-    # format pool of points
-    nodes = [p[0] for p in pts_pool]
-    nodes = np.asarray(nodes)
-
-    # difference between the point and the pool of points
-    deltas = nodes - np.array(pt)
-
-    # compute distances
-    distances = np.einsum('ij,ij->i', deltas, deltas)
-
-    # grab the number to select
-    nbr_of_points = MAX_NBR
-    if len(distances) <= MAX_NBR:
-        nbr_of_points = len(distances)-1
-    
-    # sort the values by index
-    sorted_distances_indexes = np.argpartition(distances, nbr_of_points)
-
-    # get closests
-    return list(sorted_distances_indexes[:nbr_of_points])
-
-
-def get_nearest_points_in_list(pt, pts_pool, MAX_NBR=1):
-    """
-        Takes a list of points and a target point and returns the closest point
-    """
-
-    # grab the nearest points
-    indexes = get_index_of_nearest_points_in_list(pt, pts_pool, MAX_NBR=MAX_NBR)
-
-    # get closests
-    nearest_pts = []
-    for ind in indexes:
-        nearest_pts.append(pts_pool[ind][0])
-
-    return nearest_pts
-
-
 def get_slope(p1, p2):
     """
         Returns the slope of the line composed of two points
@@ -442,39 +401,115 @@ def extend_lines(lines, factor=0.2):
     return extended_lines
 
 
-def get_horz_vert_intersections(src_horz_lines, src_vert_lines, extension_factor=0.0):
+def lines_to_array(lines):
+    """
+        Returns lines [[(x1, y1), (x2, y2)], ...] as a (N, 2, 2) float64 array
+    """
+
+    return np.asarray(lines, dtype=np.float64).reshape(-1, 2, 2)
+
+
+def extend_lines_array(lines, factor=0.2):
+    """
+        Extends (N, 2, 2) lines, same as extend_lines for all the lines at once
+    """
+
+    # order points by x
+    swap = lines[:, 1, 0] < lines[:, 0, 0]
+    pt1 = np.where(swap[:, None], lines[:, 1], lines[:, 0])
+    pt2 = np.where(swap[:, None], lines[:, 0], lines[:, 1])
+
+    # extension length
+    extension_length = np.trunc(np.hypot(pt2[:, 0] - pt1[:, 0], pt2[:, 1] - pt1[:, 1]) * factor)
+
+    # direction
+    theta = np.arctan((pt2[:, 1] - pt1[:, 1])/(pt2[:, 0] - pt1[:, 0] + 0.000001))   # +0.000001 not to divide by 0
+    delta = np.stack([np.cos(theta), np.sin(theta)], axis=1) * extension_length[:, None]
+
+    # extend
+    return np.trunc(np.stack([pt1 - delta, pt2 + delta], axis=1))
+
+
+def orientation_array(p, q, r):
+    """
+        Orientation of 3 points for broadcasted arrays of points: 0 colinear, 1 clockwise, -1 counterclock wise
+    """
+
+    return np.sign((q[..., 1] - p[..., 1]) * (r[..., 0] - q[..., 0]) - (q[..., 0] - p[..., 0]) * (r[..., 1] - q[..., 1]))
+
+
+def on_segment_array(p, q, r):
     """
-        Returns all the point intersections between horz and vert lines
+        Checks if 3 points are on the same segment, same as on_segment for broadcasted arrays of points
     """
 
-    # copy
-    horz_lines = deepcopy(src_horz_lines)
-    vert_lines = deepcopy(src_vert_lines)
+    return (q[..., 0] <= np.maximum(p[..., 0], r[..., 0])) & (q[..., 0] >= np.minimum(p[..., 0], r[..., 0])) & \
+           (q[..., 1] <= np.maximum(p[..., 1], r[..., 1])) & (q[..., 1] >= np.minimum(p[..., 1], r[..., 1]))
+
+
+def get_horz_vert_intersections_array(horz_lines, vert_lines, extension_factor=0.0):
+    """
+        Returns all the point intersections between horz and vert lines as a (N, 2) int array,
+        in the same order as get_horz_vert_intersections
+    """
+
+    # format
+    horz_lines = lines_to_array(horz_lines)
+    vert_lines = lines_to_array(vert_lines)
+    if len(horz_lines) == 0 or len(vert_lines) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
 
     # slightly extend to be sure lines meet
     if extension_factor > 0:
-        horz_lines = extend_lines(horz_lines, factor=extension_factor)
-        vert_lines = extend_lines(vert_lines, factor=extension_factor)
+        horz_lines = extend_lines_array(horz_lines, factor=extension_factor)
+        vert_lines = extend_lines_array(vert_lines, factor=extension_factor)
+
+    # all pairs, [i, j] is horz line i against vert line j
+    p1 = horz_lines[:, None, 0]
+    q1 = horz_lines[:, None, 1]
+    p2 = vert_lines[None, :, 0]
+    q2 = vert_lines[None, :, 1]
+
+    # orientations
+    o1 = orientation_array(p1, q1, p2)
+    o2 = orientation_array(p1, q1, q2)
+    o3 = orientation_array(p2, q2, p1)
+    o4 = orientation_array(p2, q2, q1)
+
+    # general case, then colinear special cases
+    intersect = ((o1 != o2) & (o3 != o4)) | \
+                ((o1 == 0) & on_segment_array(p1, p2, q1)) | \
+                ((o2 == 0) & on_segment_array(p1, q2, q1)) | \
+                ((o3 == 0) & on_segment_array(p2, p1, q2)) | \
+                ((o4 == 0) & on_segment_array(p2, q1, q2))
+
+    # deltas
+    xdiff = (p1[..., 0] - q1[..., 0], p2[..., 0] - q2[..., 0])
+    ydiff = (p1[..., 1] - q1[..., 1], p2[..., 1] - q2[..., 1])
 
-    # init set for unique values
-    intersection_points = []
+    # make sure determinant is not 0
+    div = xdiff[0] * ydiff[1] - xdiff[1] * ydiff[0]
+    intersect &= (div != 0)
 
-    # go through all combinations of lines
-    for horz_line in horz_lines:
-        for vert_line in vert_lines:
+    # only solve for the pairs that intersect
+    i, j = np.nonzero(intersect)
+    d1 = (p1[i, 0, 0] * q1[i, 0, 1] - p1[i, 0, 1] * q1[i, 0, 0])
+    d2 = (p2[0, j, 0] * q2[0, j, 1] - p2[0, j, 1] * q2[0, j, 0])
+    x = (d1 * xdiff[1][0, j] - d2 * xdiff[0][i, 0]) / div[i, j]
+    y = (d1 * ydiff[1][0, j] - d2 * ydiff[0][i, 0]) / div[i, j]
 
-            # get point at which the segments intersect
-            inter_pt = get_segments_intersection(horz_line, vert_line)
-            if inter_pt is None:
-                continue
+    return np.trunc(np.stack([x, y], axis=1)).astype(np.int64)
 
-            # split
-            x, y = inter_pt
 
-            # append
-            intersection_points.append([[int(x), int(y)]])
+def get_horz_vert_intersections(src_horz_lines, src_vert_lines, extension_factor=0.0):
+    """
+        Returns all the point intersections between horz and vert lines, as [[[x, y]], ...]
+    """
 
-    return intersection_points
+    # compute all at once
+    intersection_points = get_horz_vert_intersections_array(src_horz_lines, src_vert_lines, extension_factor=extension_factor)
+
+    return intersection_points.reshape(-1, 1, 2).tolist()
 
 
 def split_points_by_quadrants(pts, contour_center):
@@ -516,16 +551,10 @@ def get_best_corners_candidate(corners, contour):
         returns corners in order [tl, tr, br, bl]
     """
 
-    cnt_corners = []
-    for corner in corners:
-
-        # of all the potential corner candidates which one is closest to the contour
-        nearest_pt = get_nearest_points_in_list(corner, contour, MAX_NBR=1)[0]
-
-        # append
-        cnt_corners.append(nearest_pt)
+    # of all the potential corner candidates which one is closest to the contour
+    cnt_corners = get_nearest_points(as_points(corners), as_points(contour))
 
-    return cnt_corners
+    return list(cnt_corners)
 
 
 def extend_lines_to_borders(horz_lines, vert_lines, width, height):
@@ -765,59 +794,6 @@ def rotate_points(pts, angle, initial_width, initial_height):
     return None, None, None
 
 
-def cosine_similarity(pts1, pts2, width, height):
-    """
-        Returns the cosine angle between two sets of points
-    """
-
-    # center points on the unit circle
-    _pts1 = []
-    _pts2 = []
-
-    for i in range(0, len(pts1)):
-
-        # grab points
-        pt1 = np.array(pts1[i][0])
-        pt2 = np.array(pts2[i][0])
-        x1, y1 = pt1
-        x2, y2 = pt2
-
-        # center points around origin
-        x1 = x1 - width/2.0
-        x2 = x2 - width/2.0
-        y1 = y1 - height/2.0
-        y2 = y2 - height/2.0
-
-        # scale points around the origin
-        x1 = x1 / float(width)
-        x2 = x2 / float(width)
-        y1 = y1 / float(height)
-        y2 = y2 / float(height)
-
-        # append
-        _pts1.append((x1, y1))
-        _pts2.append((x2, y2))
-
-    # init
-    nume = 0
-
-    for i in range(0, len(_pts1)):
-
-        # grab points
-        pt1 = np.array(_pts1[i])
-        pt2 = np.array(_pts2[i])
-
-        # accumulate dot product
-        nume += np.dot(pt1, pt2)
-
-    # compute denominator
-    denom = (np.linalg.norm(_pts1)*np.linalg.norm(_pts2) + 0.00000001)
-
-    cos_sim = nume/denom
-
-    return cos_sim
-
-
 def return_closest_line_to_point(pt, lines, max_dist_for_match):
 
     # init
@@ -845,6 +821,109 @@ def return_closest_line_to_point(pt, lines, max_dist_for_match):
     return None
 
 
+def distance_points_to_segments_array(pts, lines):
+    """
+        Returns the distances between broadcasted (..., 2) points and (..., 2, 2) segments, same as distance_point_to_segment
+    """
+
+    # segment points
+    p1 = lines[..., 0, :]
+    p2 = lines[..., 1, :]
+
+    # unit vector
+    unit_line = p2 - p1
+    norm_line = np.sqrt(unit_line[..., 0]*unit_line[..., 0] + unit_line[..., 1]*unit_line[..., 1])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        norm_unit_line = unit_line / norm_line[..., None]
+
+        # compute the perpendicular distance to the theoretical infinite segment
+        segment_dist = np.abs(unit_line[..., 0]*(p1[..., 1] - pts[..., 1]) - unit_line[..., 1]*(p1[..., 0] - pts[..., 0])) / norm_line
+
+    # projection of the point on the infinite segment
+    diff = norm_unit_line[..., 0]*(pts[..., 0] - p1[..., 0]) + norm_unit_line[..., 1]*(pts[..., 1] - p1[..., 1])
+    x_seg = norm_unit_line[..., 0]*diff + p1[..., 0]
+    y_seg = norm_unit_line[..., 1]*diff + p1[..., 1]
+
+    # distance to the closest endpoint
+    endpoint_dist = np.minimum(
+        np.hypot(p1[..., 0] - pts[..., 0], p1[..., 1] - pts[..., 1]),
+        np.hypot(p2[..., 0] - pts[..., 0], p2[..., 1] - pts[..., 1])
+    )
+
+    # decide if the intersection point falls on the segment (never for a 0 length segment)
+    is_betw_x = ((p1[..., 0] <= x_seg) & (x_seg <= p2[..., 0])) | ((p2[..., 0] <= x_seg) & (x_seg <= p1[..., 0]))
+    is_betw_y = ((p1[..., 1] <= y_seg) & (y_seg <= p2[..., 1])) | ((p2[..., 1] <= y_seg) & (y_seg <= p1[..., 1]))
+
+    return np.where(is_betw_x & is_betw_y, segment_dist, endpoint_dist)
+
+
+def get_lines_index(lines, axis):
+    """
+        Returns the lines sorted by the coordinate of their middle point along an axis (1: y for horz lines, 0: x for vert lines),
+        to search them with return_closest_lines_indexes
+    """
+
+    # format
+    lines = lines_to_array(lines)
+
+    # middle coordinates, sorted
+    mids = (lines[:, 0, axis] + lines[:, 1, axis]) / 2.0
+    order = np.argsort(mids, kind='stable')
+
+    return {
+        'axis': axis,
+        'lines': lines[order],
+        'order': order,
+        'mids': mids[order],
+        'half_extent': float(np.max(np.abs(lines[:, 0, axis] - lines[:, 1, axis]), initial=0.0)) / 2.0
+    }
+
+
+def return_closest_lines_indexes(pts, lines_index, max_dists_for_match):
+    """
+        Same as return_closest_line_to_point for (N, 2) points at once: returns the (N,) indexes of the closest lines,
+        -1 when none is closer than its max distance. Only the lines whose middle falls in the window of a point
+        (found by bisection) can be close enough, the others are not measured
+    """
+
+    # init
+    pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+    max_dists_for_match = np.broadcast_to(np.asarray(max_dists_for_match, dtype=np.float64), (len(pts),))
+    indexes = np.full(len(pts), -1, dtype=np.intp)
+
+    # a line is at least as far as the gap between the point and its extent along the axis
+    radius = max_dists_for_match + lines_index['half_extent']
+    coords = pts[:, lines_index['axis']]
+    start = np.searchsorted(lines_index['mids'], coords - radius, side='left')
+    end = np.searchsorted(lines_index['mids'], coords + radius, side='right')
+
+    # no candidate
+    window = int(np.max(end - start, initial=0))
+    if window == 0:
+        return indexes
+
+    # candidates of each point, padded to the largest window
+    candidates = start[:, None] + np.arange(window)
+    valid = candidates < end[:, None]
+    candidates = np.minimum(candidates, len(lines_index['mids']) - 1)
+
+    # distances
+    distances = distance_points_to_segments_array(pts[:, None, :], lines_index['lines'][candidates])
+    distances[~valid] = np.inf
+
+    # closest, ties go to the first line in the input order
+    best = np.min(distances, axis=1)
+    lines_order = np.where(distances == best[:, None], lines_index['order'][candidates], len(lines_index['order']))
+    closest = np.min(lines_order, axis=1)
+
+    # if we have a match
+    match = best < max_dists_for_match
+    indexes[match] = closest[match]
+
+    return indexes
+
+
 def pts_to_rectangular_lines(x0, y0, w, h):
 
     # round
@@ -3,6 +3,8 @@ from .config import JPEG_QUALITY
 
 # import basic libs
 import math
+import threading
+import itertools
 
 # import core image processing libs
 import numpy as np
@@ -27,17 +29,18 @@ def show(img, title='img'):
         assert False
 
         
-def imread(img_path):
+def imread(img_path, gray=False):
     """
-        Loads the image from disk
+        Loads the image from disk (as 8-bit grayscale if gray, without going through a color frame)
     """
 
     # check input
     if not isStringNonEmpty(img_path): return None
 
     # try to load
+    img_src = None
     try:
-        img_src = cv.imread(img_path)
+        img_src = cv.imread(img_path, cv.IMREAD_GRAYSCALE if gray else cv.IMREAD_COLOR)
     except:
         pass
 
@@ -46,9 +49,10 @@ def imread(img_path):
 
     # check dims
     try:
-        height, width, depth = img_src.shape
+        height, width = img_src.shape[:2]
+        depth = img_src.shape[2] if img_src.ndim == 3 else 1
     except:
-        pass
+        return None
 
     if not isNumber(width) or not isNumber(height) or not isNumber(depth):
         return None
@@ -56,6 +60,127 @@ def imread(img_path):
     return img_src
 
 
+# JPEG start of frame markers (0xC4, 0xC8 and 0xCC are not frames)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def read_jpeg_dimensions(img_path):
+    """
+        Returns the (width, height) stored in the header of a jpeg (before any exif rotation), without decoding it
+    """
+
+    try:
+        with open(img_path, 'rb') as f:
+
+            # start of image
+            if f.read(2) != b'\xff\xd8': return None
+
+            # go through the segments until the start of frame
+            while True:
+
+                # next marker
+                byte = f.read(1)
+                while byte and byte != b'\xff':
+                    byte = f.read(1)
+                while byte == b'\xff':
+                    byte = f.read(1)
+                if not byte: return None
+                marker = byte[0]
+
+                # markers without a segment
+                if marker == 0x01 or 0xD0 <= marker <= 0xD8: continue
+
+                # reached the image data (or its end) without a frame
+                if marker == 0xD9 or marker == 0xDA: return None
+
+                # segment length (includes the 2 bytes of the length)
+                length = int.from_bytes(f.read(2), 'big')
+
+                # frame: precision, height, width
+                if marker in JPEG_SOF_MARKERS:
+                    frame = f.read(5)
+                    if len(frame) < 5: return None
+                    return int.from_bytes(frame[3:5], 'big'), int.from_bytes(frame[1:3], 'big')
+
+                f.seek(length - 2, 1)
+
+    except:
+        return None
+
+
+def get_reduced_decode_factor(width, height, min_longest_dim):
+    """
+        Returns the largest jpeg decode reduction (8, 4 or 2, 1 for none) keeping the longest side at least min_longest_dim
+    """
+
+    for factor in [8, 4, 2]:
+        if max(width, height) // factor >= min_longest_dim:
+            return factor
+
+    return 1
+
+
+# opencv flags of the reduced decodes, by factor
+IMREAD_REDUCED_FLAGS = {
+    2: cv.IMREAD_REDUCED_COLOR_2,
+    4: cv.IMREAD_REDUCED_COLOR_4,
+    8: cv.IMREAD_REDUCED_COLOR_8
+}
+IMREAD_REDUCED_GRAYSCALE_FLAGS = {
+    2: cv.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv.IMREAD_REDUCED_GRAYSCALE_8
+}
+
+
+def imread_reduced(img_path, min_longest_dim, read_stats=None, gray=False):
+    """
+        Loads the image from disk, a jpeg large enough to keep a longest side of at least min_longest_dim is decoded
+        at 1/2, 1/4 or 1/8 of its size (libjpeg scales while decoding). read_stats gets the decode path ('reduced' or
+        'full'), the factor, and the dimensions of the image on disk. Decoded as 8-bit grayscale if gray
+    """
+
+    # check input
+    if not isStringNonEmpty(img_path): return None
+
+    # dimensions from the header, jpeg only
+    dimensions = read_jpeg_dimensions(img_path)
+    factor = get_reduced_decode_factor(*dimensions, min_longest_dim) if dimensions is not None else 1
+
+    # reduced decode
+    img_src = None
+    if factor > 1:
+        try:
+            img_src = cv.imread(img_path, (IMREAD_REDUCED_GRAYSCALE_FLAGS if gray else IMREAD_REDUCED_FLAGS)[factor])
+        except:
+            img_src = None
+
+    # check, the decode is ceil(width/factor) x ceil(height/factor), or the transpose when rotated by the exif orientation
+    if img_src is not None:
+        width, height = dimensions
+        reduced_size = (-(-width // factor), -(-height // factor))
+        if (img_src.shape[1], img_src.shape[0]) == reduced_size[::-1]:
+            width, height = height, width
+        elif (img_src.shape[1], img_src.shape[0]) != reduced_size:
+            img_src = None
+
+    # otherwise full decode
+    if img_src is None:
+        factor = 1
+        img_src = imread(img_path, gray=gray)
+        if img_src is None: return None
+        height, width = img_src.shape[:2]
+
+    # report
+    if read_stats is not None:
+        read_stats['decode'] = 'reduced' if factor > 1 else 'full'
+        read_stats['factor'] = factor
+        read_stats['width'] = width
+        read_stats['height'] = height
+
+    return img_src
+
+
 def imwrite(img_path, img):
 
     # check input
@@ -149,65 +274,57 @@ def bound_dimensions(width, height, MIN_LENGTH, MAX_LENGTH):
     return new_width, new_height, resize_factor
 
 
-def resize(img, new_width, new_height):
+def resize(img, new_width, new_height, dst=None):
     """
-        Resizes an image between the provided bounds and also returns resize factor
+        Resizes an image to the provided dimensions (into dst when given)
     """
 
-    # extract dimensions
-    height = img.shape[0]
-    width = img.shape[1]
+    # resize (img is left untouched). Bilinear both ways: the INTER_CUBIC / INTER_AREA flags this used to pass
+    # positionally landed in fy, which opencv ignores when the size is given, and the results are tuned on that
+    img_resized = cv.resize(img, (new_width, new_height), dst=dst, interpolation=cv.INTER_LINEAR)
 
-    # copy
-    img_resized = img.copy()
-
-    # compute resize factor
-    resize_factor = new_width / float(width)
+    return img_resized
 
-    # resize
-    if resize_factor > 1.0:
-        img_resized = cv.resize(img_resized, (new_width, new_height), 0, 0, cv.INTER_CUBIC)
-    else:
-        img_resized = cv.resize(img_resized, (new_width, new_height), 0, 0, cv.INTER_AREA)
 
-    return img_resized
+# opencv codes of the counterclockwise rotations, by number of 90 deg rotations
+ROTATE_CODES = {
+    1: cv.ROTATE_90_COUNTERCLOCKWISE,
+    2: cv.ROTATE_180,
+    3: cv.ROTATE_90_CLOCKWISE
+}
 
 
-def rotate(img, nbr_of_rotations):
+def rotate(img, nbr_of_rotations, dst=None):
     """
-        Rotates image counterclockwise by n number of 90 deg rotations
+        Rotates image counterclockwise by n number of 90 deg rotations (into dst when given)
     """
 
-    # copy
-    img_rotated = img.copy()
-
-    for i in range(0, nbr_of_rotations):
-        img_rotated = cv.rotate(img_rotated, cv.ROTATE_90_COUNTERCLOCKWISE)
+    # no rotation, still a new image
+    nbr_of_rotations = nbr_of_rotations % 4
+    if nbr_of_rotations == 0:
+        if dst is None:
+            return img.copy()
+        np.copyto(dst, img)
+        return dst
 
-    return img_rotated
+    return cv.rotate(img, ROTATE_CODES[nbr_of_rotations], dst)
 
 
-def cvtToGray(img):
+def cvtToGray(img, dst=None):
     """
-        Converts the image to grayscale
+        Converts the image to grayscale (into dst when given)
     """
 
-    # copy
-    img_gray = img.copy()
-
-    # convert to grayscale
-    img_gray = cv.cvtColor(img_gray, cv.COLOR_BGR2GRAY)
+    # convert to grayscale (img is left untouched)
+    img_gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY, dst)
 
     return img_gray
 
 
-def cvtToColor(img_gray):
+def cvtToColor(img_gray, dst=None):
 
-    # copy
-    _img_gray = img_gray.copy()
-
-    # convert to grayscale
-    img = cv.cvtColor(_img_gray, cv.COLOR_GRAY2BGR)
+    # convert to color (img_gray is left untouched)
+    img = cv.cvtColor(img_gray, cv.COLOR_GRAY2BGR, dst)
 
     return img
     
@@ -234,21 +351,30 @@ def normal_info(img_gray):
     return mean, std
 
 
-def get_edges(img, low_thresh=None, up_thresh=None):
+def get_gradients(img):
     """
-        Returns the image with the canny transformation applied
+        Returns the sobel derivatives of the blurred image, the part of the canny transformation that does not depend on the thresholds
     """
 
-    # make a copy
-    img_edges = img.copy()
-
     # convert to grayscale
-    if len(img_edges.shape) == 3:
-        img_edges = cv.cvtColor(img_edges, cv.COLOR_BGR2GRAY)
-    
-    # apply a light blur
-    img_edges = cv.GaussianBlur(img_edges, (5, 5), 0)
-    # blur = cv.bilateralFilter(blur, 5, 30, 50)
+    img_blur = img
+    if len(img_blur.shape) == 3:
+        img_blur = cv.cvtColor(img_blur, cv.COLOR_BGR2GRAY)
+
+    # apply a light blur (into a new image, img is left untouched)
+    img_blur = cv.GaussianBlur(img_blur, (5, 5), 0)
+
+    # compute derivatives (same aperture and border as cv.Canny so the edges are identical)
+    dx = cv.Sobel(img_blur, cv.CV_16S, 1, 0, ksize=3, borderType=cv.BORDER_REPLICATE)
+    dy = cv.Sobel(img_blur, cv.CV_16S, 0, 1, ksize=3, borderType=cv.BORDER_REPLICATE)
+
+    return dx, dy
+
+
+def get_edges(img, low_thresh=None, up_thresh=None, gradients=None, dst=None):
+    """
+        Returns the image with the canny transformation applied (into dst when given)
+    """
 
     # set thresholds
     lower_thresh = 30
@@ -261,17 +387,36 @@ def get_edges(img, low_thresh=None, up_thresh=None):
     if up_thresh is not None:
         upper_thresh = up_thresh
 
+    # precomputed derivatives, only the hysteresis is left to do
+    if gradients is not None:
+        dx, dy = gradients
+        return cv.Canny(dx, dy, lower_thresh, upper_thresh, dst)
+
+    # convert to grayscale
+    img_edges = img
+    if len(img_edges.shape) == 3:
+        img_edges = cv.cvtColor(img_edges, cv.COLOR_BGR2GRAY)
+    
+    # apply a light blur (into a new image, img is left untouched)
+    img_edges = cv.GaussianBlur(img_edges, (5, 5), 0)
+    # blur = cv.bilateralFilter(blur, 5, 30, 50)
+
     # canny for edges
-    img_edges = cv.Canny(img_edges, lower_thresh, upper_thresh)
+    img_edges = cv.Canny(img_edges, lower_thresh, upper_thresh, dst)
 
     return img_edges
 
 
-def get_dilated_edges(img, low_thresh=None, up_thresh=None, kernel_size=3, close_lines=True):
+def get_dilated_edges(img, low_thresh=None, up_thresh=None, kernel_size=3, close_lines=True, edges_cache=None):
     """
-        Returns the image with the canny transformation applied and a dilation morphological transformation to connect neighboring lines
+        Returns the image with the canny transformation applied and a dilation morphological transformation to connect neighboring lines.
+        With an edges cache, the image is one of the cache's scratch buffers: only valid until the next call on the same thread
     """
 
+    # threshold sweeps go through the cache
+    if edges_cache is not None:
+        return get_cached_dilated_edges(edges_cache, low_thresh, up_thresh, kernel_size=kernel_size, close_lines=close_lines)
+
     # Get edges
     img_edges = get_edges(img, low_thresh=low_thresh, up_thresh=up_thresh)
 
@@ -288,6 +433,95 @@ def get_dilated_edges(img, low_thresh=None, up_thresh=None, kernel_size=3, close
     return img_edges
 
 
+def init_edges_cache(img):
+    """
+        Returns the cache shared by all the passes of a canny threshold sweep over the same image
+    """
+
+    return {
+        'shape': img.shape[:2],
+        'gradients': get_gradients(img),
+        'edges': {},
+        'contours': {},
+        'scratch': {}
+    }
+
+
+# slot of the calling thread in the pool running the sweep (the calling thread itself is slot 0)
+_worker = threading.local()
+
+
+def init_worker_slots(nbr_of_workers):
+    """
+        Returns the initializer of a sweep's pool: numbers its threads 0..nbr_of_workers-1, so that the scratch
+        buffers are reused by the next pool of the same size instead of growing with every thread started
+    """
+
+    slots = itertools.count()
+
+    def initializer():
+        _worker.slot = next(slots) % nbr_of_workers
+
+    return initializer
+
+
+def get_scratch(edges_cache, name, shape, dtype=np.uint8):
+    """
+        Returns the {name} scratch buffer of the calling worker, allocated on first use and reused by the next passes.
+        Its content is overwritten by the next pass, the sweeps run on several threads so each worker has its own buffers
+    """
+
+    # buffers of the calling worker
+    scratch = edges_cache['scratch'].setdefault(getattr(_worker, 'slot', 0), {})
+
+    # allocate on first use (or if the shape changed)
+    buffer = scratch.get(name)
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        buffer = np.empty(shape, dtype=dtype)
+        scratch[name] = buffer
+
+    return buffer
+
+
+def get_cached_dilated_edges(edges_cache, low_thresh, up_thresh, kernel_size=3, close_lines=True):
+    """
+        Same as get_dilated_edges, but the canny + dilation result is computed once per thresholds and kept bit-packed in the cache.
+        The returned image is a scratch buffer of the cache
+    """
+
+    # grab dimensions
+    height, width = edges_cache['shape']
+
+    # init kernels
+    kernel_rect = cv.getStructuringElement(cv.MORPH_RECT, (kernel_size, kernel_size))
+
+    # the closing step is cheap, so the cache is keyed without it
+    key = (low_thresh, up_thresh, kernel_size)
+
+    if key in edges_cache['edges']:
+
+        # unpack (0/1 to 0/255)
+        img_edges = np.unpackbits(edges_cache['edges'][key], count=height*width).reshape(height, width)
+        img_edges *= 255
+
+    else:
+
+        # Get edges from the precomputed derivatives
+        img_edges = get_edges(None, low_thresh=low_thresh, up_thresh=up_thresh, gradients=edges_cache['gradients'], dst=get_scratch(edges_cache, 'edges', (height, width)))
+
+        # dilate intersection points
+        img_edges = cv.dilate(img_edges, kernel_rect, get_scratch(edges_cache, 'dilated', (height, width)))
+
+        # store, 8x smaller than the edge map
+        edges_cache['edges'][key] = np.packbits(img_edges > 0)
+
+    # close lines
+    if close_lines:
+        img_edges = cv.morphologyEx(img_edges, cv.MORPH_CLOSE, kernel_rect, get_scratch(edges_cache, 'closed', (height, width)))
+
+    return img_edges
+
+
 def get_contours_area_sum(contours):
     """
         Takes a list of contours as input. Accumulates the closed area and return the sum
@@ -434,118 +668,57 @@ def get_table_template_dimensions(table_template):
     return width, height
 
 
-def get_index_of_nearest_points_in_list(pt, pts_pool, MAX_NBR=1):
+def validate_transform_matrix(M):
     """
-        Takes a list of points and a target point and returns the closest point
+        Checks that the transformation matrix is 3x3, without null values
     """
 
-    # format pool of points
-    nodes = [p[0] for p in pts_pool]
-    nodes = np.asarray(nodes)
-
-    # difference between the point and the pool of points
-    deltas = nodes - np.array(pt)
-
-    # compute distances
-    distances = np.einsum('ij,ij->i', deltas, deltas)
-
-    # grab the number to select
-    nbr_of_points = MAX_NBR
-    if len(distances) <= MAX_NBR:
-        nbr_of_points = len(distances)-1
-    
-    # sort the values by index
-    sorted_distances_indexes = np.argpartition(distances, nbr_of_points)
-
-    # get closests
-    return list(sorted_distances_indexes[:nbr_of_points])
-
-
-def get_nearest_points_in_list(pt, pts_pool, MAX_NBR=1):
-    """
-        Takes a list of points and a target point and returns the closest point
-    """
-
-    # grab the nearest points
-    indexes = get_index_of_nearest_points_in_list(pt, pts_pool, MAX_NBR=MAX_NBR)
+    # Check dimensions of M
+    w, h = np.array(M).shape
+    if w != 3 or h != 3:
+        print("ERROR: Transformation matrix is not 3x3")
+        return False
 
-    # get closests
-    nearest_pts = []
-    for ind in indexes:
-        nearest_pts.append(pts_pool[ind][0])
+    # Check values of M
+    if np.any(np.array(M) == 0.0):
+        print("ERROR: Transformation matrix value is too small")
+        return False
 
-    return nearest_pts
+    return True
 
 
-def cosine_similarity(pts1, pts2, width, height):
+def retrieve_src_from_projected(M, x1, y1):
     """
-        Returns the cosine angle between two sets of points
+        Using the 3x3 transformation matrix, retrieve the original coordinates of a projected point
     """
 
-    # center points on the unit circle
-    _pts1 = []
-    _pts2 = []
-
-    for i in range(0, len(pts1)):
-
-        # grab points
-        pt1 = np.array(pts1[i][0])
-        pt2 = np.array(pts2[i][0])
-        x1, y1 = pt1
-        x2, y2 = pt2
-
-        # center points around origin
-        x1 = x1 - width/2.0
-        x2 = x2 - width/2.0
-        y1 = y1 - height/2.0
-        y2 = y2 - height/2.0
-
-        # scale points around the origin
-        x1 = x1 / float(width)
-        x2 = x2 / float(width)
-        y1 = y1 / float(height)
-        y2 = y2 / float(height)
-
-        # append
-        _pts1.append((x1, y1))
-        _pts2.append((x2, y2))
-
-    # init
-    nume = 0
-
-    for i in range(0, len(_pts1)):
-
-        # grab points
-        pt1 = np.array(_pts1[i])
-        pt2 = np.array(_pts2[i])
-
-        # accumulate dot product
-        nume += np.dot(pt1, pt2)
+    # Check M
+    if not validate_transform_matrix(M):
+        return None
 
-    # compute denominator
-    denom = (np.linalg.norm(_pts1)*np.linalg.norm(_pts2) + 0.00000001)
+    # Get x
+    x = ((M[1][2]*(M[0][1] - M[2][1]*x1))/((M[2][0]*x1 - M[0][0])*(M[2][1]*y1 - M[1][1])) - (M[2][2]*y1*(M[0][1] - M[2][1]*x1))/((M[2][0]*x1 - M[0][0])*(M[2][1]*y1 - M[1][1])) + M[0][2]/(M[2][0]*x1 - M[0][0]) - (M[2][2]*x1)/(M[2][0]*x1 - M[0][0]))/(-(M[1][0]*(M[0][1] - M[2][1]*x1))/((M[2][0]*x1 - M[0][0])*(M[2][1]*y1 - M[1][1])) + (M[2][0]*y1*(M[0][1] - M[2][1]*x1))/((M[2][0]*x1 - M[0][0])*(M[2][1]*y1 - M[1][1])) + 1)
 
-    cos_sim = nume/denom
+    # Get y
+    y = (x*(M[1][0] - y1*M[2][0]) + M[1][2] - y1*M[2][2])/(M[2][1]*y1 - M[1][1])
 
-    return cos_sim
+    return (x, y)
 
 
-def retrieve_src_from_projected(M, x1, y1):
+def retrieve_src_from_projected_array(M, x1, y1):
     """
-        Using the 3x3 transformation matrix, retrieve the original coordinates of a projected point
+        Same as retrieve_src_from_projected for arrays of coordinates, the matrix is checked once.
+        Keeps the closed form (not the inverse matrix) so the coordinates truncate to the same integers
     """
 
-    # Check dimensions of M
-    w, h = np.array(M).shape
-    if w != 3 or h != 3:
-        print("ERROR: Transformation matrix is not 3x3")
+    # Check M
+    if not validate_transform_matrix(M):
         return None
 
-    # Check values of M
-    for val in np.array(M).reshape(-1):
-        if abs(val) == 0.0:
-            print("ERROR: Transformation matrix value is too small")
-            return None
+    # format
+    M = np.asarray(M, dtype=np.float64)
+    x1 = np.asarray(x1, dtype=np.float64)
+    y1 = np.asarray(y1, dtype=np.float64)
 
     # Get x
     x = ((M[1][2]*(M[0][1] - M[2][1]*x1))/((M[2][0]*x1 - M[0][0])*(M[2][1]*y1 - M[1][1])) - (M[2][2]*y1*(M[0][1] - M[2][1]*x1))/((M[2][0]*x1 - M[0][0])*(M[2][1]*y1 - M[1][1])) + M[0][2]/(M[2][0]*x1 - M[0][0]) - (M[2][2]*x1)/(M[2][0]*x1 - M[0][0]))/(-(M[1][0]*(M[0][1] - M[2][1]*x1))/((M[2][0]*x1 - M[0][0])*(M[2][1]*y1 - M[1][1])) + (M[2][0]*y1*(M[0][1] - M[2][1]*x1))/((M[2][0]*x1 - M[0][0])*(M[2][1]*y1 - M[1][1])) + 1)
@@ -553,4 +726,4 @@ def retrieve_src_from_projected(M, x1, y1):
     # Get y
     y = (x*(M[1][0] - y1*M[2][0]) + M[1][2] - y1*M[2][2])/(M[2][1]*y1 - M[1][1])
 
-    return (x, y)
+    return x, y
@@ -1,9 +1,14 @@
 # import config
 from .config import MAX_NBR_TABLES, MIN_NBR_OF_CHILDREN, CLOSENESS_FACTOR, MIN_TABLE_ASPECT_RATIO, MIN_TABLE_AREA, MAX_PERIMETER_AREA, MAX_MIN_AREA_RECT_FRAC, MIN_CONTOUR_AREA_TO_RECT_AREA_RATIO, MAX_CNT_ANGLE_POLY, MAX_CNT_ANGLE_OPEN, LOWER_BOUND_CANNY_THRESH, UPPER_BOUND_CANNY_THRESH, DELTA_CANNY_THRESH, SMOOTH_FACTOR, LINE_GROUP_THICKNESS, MIN_LINE_LENGTH_TABLE_CNT, ANGLE_RESOLUTION, MAX_HORZ_SLOPE, MIN_VERT_SLOPE, MAX_HORZ_SLOPE_CNT, MIN_VERT_SLOPE_CNT, HOUGH_THRESHOLD_MIN, HOUGH_BASIC_LINES_TRESH, HOUGH_KERNEL_SIZE, MAX_LINE_GAP, MIN_NBR_OF_HORZ_LINES, MIN_NBR_OF_VERT_LINES, MIN_LINE_LENGTH, MIN_TABLE_INTERSECTION_POINTS, MAX_RECT_AREA_RATIO_DIFF, HOUGH_SMALL_LINES_TRESH, HOUGH_LONG_LINES_TRESH, MIN_LINE_LENGTH, MIN_CHILD_CONTOUR_AREA_TO_PARENT, MIN_ASPECT_RATIO_TABLE_AND_TABLE_TEMPLATE, PROCESS_TABLE_LONGEST_DIM_MIN, PROCESS_TABLE_LONGEST_DIM_MAX, SIMPLIFICATION_FACTOR, LINES_EXTENSION_FACTOR, MIN_TABLE_TEMPLATE_FIT_SCORE
+from .config import CANNY_SEARCH_MODE, CANNY_COARSE_STEP, CANNY_SEARCH_PATIENCE, CANNY_SEARCH_WORKERS
+from .config import TEMPLATE_SHORTLIST_SIZE, HOUGH_LINES_MODE, LINE_DETECTOR, NEIGHBOURS_FIT_MAX_LEVEL
+from .config import PROCESS_DETECT_LONGEST_DIM, PROCESS_ROI_MARGIN
 
 # import basic libs
 import math
-from copy import deepcopy
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # import core image processing libs
 import numpy as np
@@ -13,45 +18,44 @@ import cv2 as cv
 from .datatype import isListNonEmpty, isNumber
 
 # import geometry lib
-from .geometry import pts_to_rectangular_lines, angle_between_3_points, distance_point_to_segment, accumulate_contour_angles, is_line_horz, is_line_vert, get_slope_intercept, euclidian_distance, split_points_by_quadrants, get_horz_vert_intersections, return_closest_line_to_point, get_segment_y_at_x, get_segment_x_at_y
+from .geometry import pts_to_rectangular_lines, angle_between_3_points, distance_point_to_segment, accumulate_contour_angles, is_line_horz, is_line_vert, get_slope_intercept, euclidian_distance, split_points_by_quadrants, get_horz_vert_intersections, get_horz_vert_intersections_array, return_closest_line_to_point, get_lines_index, return_closest_lines_indexes, get_segment_y_at_x, get_segment_x_at_y
+
+# import table templates index
+from .template_index import TemplateIndex, get_template_index
+
+# import point sets lib
+from .pointset import as_points, get_nearest_indexes, cosine_similarity
+
+# import rectangles sets lib
+from .rectset import RectSet, get_rect_set
+
+# import metrics lib
+from .metrics import timed, timer, count
 
 # import image processing helper functions
-from .imageproc_basic import cvtToColor, draw_circles, show, return_blank_canvas, bound_dimensions, get_contours_area_sum, approx_poly_contour, get_contours_min_area_rect_sum, get_dilated_edges, get_contour_centroid, draw_lines, compute_PCA, get_nearest_points_in_list, cosine_similarity, get_table_template_dimensions, remap_rectangles_origin_to_corners, remap_rectangles_corners_to_origin, retrieve_src_from_projected
+from .imageproc_basic import cvtToColor, draw_circles, show, return_blank_canvas, bound_dimensions, get_contours_area_sum, approx_poly_contour, get_contours_min_area_rect_sum, get_dilated_edges, init_edges_cache, init_worker_slots, get_scratch, get_contour_centroid, draw_lines, compute_PCA, get_table_template_dimensions, remap_rectangles_origin_to_corners, remap_rectangles_corners_to_origin, retrieve_src_from_projected, retrieve_src_from_projected_array
 
 
+@timed('project_rectangles')
 def project_rectangles(template_rectangles, corners):
 
     # init
     rectangles_projected = []
 
-    # go through rectangles
-    max_width = 0
-    max_height = 0
-    points = []
-    for rectangle in template_rectangles:
-
-        # unpack
-        x0 = rectangle['x0']
-        y0 = rectangle['y0']
-        w = rectangle['w']
-        h = rectangle['h']
+    # work on arrays
+    rectangles = get_rect_set(template_rectangles)
 
-        # update
-        if x0 + w > max_width: max_width = x0 + w
-        if y0 + h > max_height: max_height = y0 + h
-
-        # convert to points
-        tl_x = x0
-        tl_y = y0
-        tr_x = x0 + w
-        tr_y = y0
-        br_x = x0 + w
-        br_y = y0 + h
-        bl_x = x0
-        bl_y = y0 + h
+    # dimensions of the template
+    max_width, max_height = rectangles.dimensions()
 
-        # append
-        points.append([ [tl_x, tl_y], [tr_x, tr_y], [br_x, br_y], [bl_x, bl_y] ])
+    # convert to points, (N, 4, 2): tl, tr, br, bl
+    x1, y1, x2, y2 = rectangles.corners()
+    points = np.stack([
+        np.stack([x1, y1], axis=1),
+        np.stack([x2, y1], axis=1),
+        np.stack([x2, y2], axis=1),
+        np.stack([x1, y2], axis=1)
+    ], axis=1)
 
     # define source points
     src_points = [ [0, 0], [max_width, 0], [max_width, max_height], [0, max_height]]
@@ -59,26 +63,15 @@ def project_rectangles(template_rectangles, corners):
     # findHomography
     M, _ = cv.findHomography(np.array(src_points), np.array(corners), cv.RANSAC)
 
-    # project points
-    for i, point in enumerate(points):
-
-        # init
-        coordinates = []
+    # nothing to project
+    if len(rectangles) == 0:
+        return rectangles_projected
 
-        # loop
-        for x, y in point:
+    # project all the points at once
+    projected_points = cv.perspectiveTransform(points.reshape(-1, 1, 2).astype(np.float32), M).reshape(-1, 4, 2)
 
-            # convert to np array
-            d = np.array([[[x, y]]], dtype=np.float32)
-
-            # project
-            projected_point = cv.perspectiveTransform(d, M)
-
-            # unpack
-            x, y = projected_point[0][0]
-
-            # append
-            coordinates.append([x, y])
+    # go through rectangles
+    for i, coordinates in enumerate(projected_points.tolist()):
 
         # unpack
         tl_x = coordinates[0][0]
@@ -91,7 +84,7 @@ def project_rectangles(template_rectangles, corners):
         bl_y = coordinates[3][1]
 
         # get rectangle
-        rectangle = template_rectangles[i]
+        rectangle = rectangles.rectangles[i]
         data_type = rectangle['data_type']
         opts = rectangle['opts']
         rect_id = rectangle['id']
@@ -202,17 +195,22 @@ def simplify_contour(img, contour):
         kernel_length = 6
     kernel = cv.getStructuringElement(cv.MORPH_RECT, (kernel_length, kernel_length))
 
+    # the mask only needs to cover the contour and a kernel of margin (the opening can not reach further), clipped to the image
+    x, y, cnt_w, cnt_h = cv.boundingRect(contour)
+    x0, y0 = max(x - kernel_length, 0), max(y - kernel_length, 0)
+    x1, y1 = min(x + cnt_w + kernel_length, w), min(y + cnt_h + kernel_length, h)
+
     # init a black mask
-    mask_cnt = np.zeros((h, w, 1), np.uint8)
+    mask_cnt = np.zeros((y1 - y0, x1 - x0, 1), np.uint8)
 
     # draw open contour and convex hull on mask
-    mask_cnt = cv.drawContours(mask_cnt, [contour], -1, color=255, thickness=cv.FILLED)
+    mask_cnt = cv.drawContours(mask_cnt, [contour], -1, color=255, thickness=cv.FILLED, offset=(-x0, -y0))
 
-    # erode and then expand
-    mask_cnt = cv.morphologyEx(mask_cnt, cv.MORPH_OPEN, kernel)
+    # erode and then expand (in place)
+    mask_cnt = cv.morphologyEx(mask_cnt, cv.MORPH_OPEN, kernel, mask_cnt)
 
-    # Get contours
-    contours, hierarchy = cv.findContours(mask_cnt, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
+    # Get contours (in image coordinates)
+    contours, hierarchy = cv.findContours(mask_cnt, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE, offset=(x0, y0))
 
     # make sure we have contours
     if contours is None or hierarchy is None or len(contours) == 0:
@@ -285,79 +283,310 @@ def validate_contour(contour, img):
     return True
 
 
-def bruteForceFindContour(img, extra_dilate=False):
+def get_canny_thresholds_grid(step=1):
+    """
+        Returns the (low, up) canny thresholds pairs of the sweep, in sweep order
+    """
 
-    # init contour array
-    resized_tables_contours = []
-    total_min_area_rect_final = math.inf
-    total_area_final = math.inf
+    # init
+    thresholds = []
 
     # iterate over canny low thresh
-    for j in range(LOWER_BOUND_CANNY_THRESH[0], LOWER_BOUND_CANNY_THRESH[1], DELTA_CANNY_THRESH):
+    for j in range(LOWER_BOUND_CANNY_THRESH[0], LOWER_BOUND_CANNY_THRESH[1], DELTA_CANNY_THRESH*step):
 
         # iterate over canny up thresh
-        for i in range(UPPER_BOUND_CANNY_THRESH[0], UPPER_BOUND_CANNY_THRESH[1], DELTA_CANNY_THRESH):
+        for i in range(UPPER_BOUND_CANNY_THRESH[0], UPPER_BOUND_CANNY_THRESH[1], DELTA_CANNY_THRESH*step):
+            thresholds.append((j, i))
+
+    return thresholds
+
+
+def init_contours_candidate():
+    """
+        Returns the best candidate of a sweep before any pass was run
+    """
 
-            # iterate over close lines option
-            for k in [False, True]:
+    return {
+        'contours': [],
+        'total_area': math.inf,
+        'total_min_area_rect': math.inf,
+        'params': None
+    }
 
-                # get table contours
-                out_contours = get_contours_tables(img, low_thresh=j, up_thresh=i, close_lines=k, extra_dilate=extra_dilate)
-                if out_contours is None or len(out_contours) == 0:
-                    continue
 
-                # get the value of properties we are trying to optimize
-                total_area = get_contours_area_sum(out_contours)
-                total_min_area_rect = get_contours_min_area_rect_sum(out_contours)
+def update_contours_candidate(candidate, out_contours, params):
+    """
+        Replaces the best candidate by the contours of a pass if they are better, returns True if they were
+    """
+
+    # check
+    if out_contours is None or len(out_contours) == 0:
+        return False
+
+    # get the value of properties we are trying to optimize
+    total_area = get_contours_area_sum(out_contours)
+    total_min_area_rect = get_contours_min_area_rect_sum(out_contours)
 
-                # if less contours than previous attempt
-                if len(out_contours) < len(resized_tables_contours):
+    # if less contours than previous attempt
+    if len(out_contours) < len(candidate['contours']):
 
-                    # ignore if total area is smaller
-                    if total_area < total_area_final:
-                        continue
+        # ignore if total area is smaller
+        if total_area < candidate['total_area']:
+            return False
 
-                # if same number of contours has previous attempt
-                if len(out_contours) == len(resized_tables_contours):
+    # if same number of contours has previous attempt
+    if len(out_contours) == len(candidate['contours']):
 
-                    # ignore if total area is smaller
-                    if total_area < total_area_final:
-                        continue
+        # ignore if total area is smaller
+        if total_area < candidate['total_area']:
+            return False
 
-                    # ignore if total area is similar and min rect area is bigger
-                    if abs(total_area - total_area_final) < total_area*(MAX_MIN_AREA_RECT_FRAC - 1):
-                        if total_min_area_rect > total_min_area_rect_final*MAX_MIN_AREA_RECT_FRAC:
-                            continue
+        # ignore if total area is similar and min rect area is bigger
+        if abs(total_area - candidate['total_area']) < total_area*(MAX_MIN_AREA_RECT_FRAC - 1):
+            if total_min_area_rect > candidate['total_min_area_rect']*MAX_MIN_AREA_RECT_FRAC:
+                return False
 
-                # update
-                resized_tables_contours = out_contours
-                total_area_final = total_area
-                total_min_area_rect_final = total_min_area_rect
+    # update
+    candidate['contours'] = out_contours
+    candidate['total_area'] = total_area
+    candidate['total_min_area_rect'] = total_min_area_rect
+    candidate['params'] = params
 
-    return resized_tables_contours
+    return True
 
 
-def get_contours_tables(img, low_thresh=None, up_thresh=None, close_lines=True, extra_dilate=False):
+def run_canny_passes(img, passes, extra_dilate=False, edges_cache=None, executor=None):
+    """
+        Runs get_contours_tables for each (low, up, close_lines) pass, returns the contours in the order of the passes.
+        The passes run on the threads of the executor if given
+    """
+
+    # passes sharing thresholds run in the same task so their edge map is computed once
+    groups = {}
+    for params in passes:
+        groups.setdefault(params[:2], []).append(params)
+
+    def run_group(group):
+        return [(params, get_contours_tables(img, low_thresh=params[0], up_thresh=params[1], close_lines=params[2], extra_dilate=extra_dilate, edges_cache=edges_cache)) for params in group]
+
+    # run
+    if executor is None or len(groups) <= 1:
+        groups_results = [run_group(group) for group in groups.values()]
+    else:
+        groups_results = list(executor.map(run_group, groups.values()))
+
+    # restore the order of the passes
+    results = {}
+    for group_results in groups_results:
+        results.update(group_results)
+
+    return [results[params] for params in passes]
+
+
+def exhaustiveCannySearch(img, extra_dilate=False, edges_cache=None, executor=None):
+    """
+        Runs every pass of the canny thresholds grid, returns the best candidate and the number of passes run
+    """
+
+    # init
+    candidate = init_contours_candidate()
+
+    # every threshold with every close lines option
+    passes = [(j, i, k) for j, i in get_canny_thresholds_grid() for k in [False, True]]
+
+    # get table contours
+    passes_contours = run_canny_passes(img, passes, extra_dilate=extra_dilate, edges_cache=edges_cache, executor=executor)
+
+    # keep the best, in sweep order
+    for params, out_contours in zip(passes, passes_contours):
+        update_contours_candidate(candidate, out_contours, params)
+
+    return candidate, len(passes)
+
+
+def coarseToFineCannySearch(img, extra_dilate=False, edges_cache=None, executor=None, nbr_of_workers=1):
+    """
+        Runs a coarse canny thresholds grid, then refines around the best candidate until it stops moving.
+        Returns the best candidate and the number of passes run
+    """
+
+    # init
+    candidate = init_contours_candidate()
+    visited = set()
+    nbr_of_passes = 0
+    stable_passes = 0
+
+    """
+        Coarse grid
+    """
+
+    # run as many thresholds at once as there are workers
+    coarse_grid = get_canny_thresholds_grid(step=CANNY_COARSE_STEP)
+    batch_size = max([nbr_of_workers, 1])
+
+    for b in range(0, len(coarse_grid), batch_size):
+
+        # get table contours
+        passes = [(j, i, k) for j, i in coarse_grid[b:b+batch_size] for k in [False, True]]
+        passes_contours = run_canny_passes(img, passes, extra_dilate=extra_dilate, edges_cache=edges_cache, executor=executor)
+        nbr_of_passes += len(passes)
+
+        # keep the best, in sweep order
+        for n, (params, out_contours) in enumerate(zip(passes, passes_contours)):
+
+            # early exit: the best candidate did not change for CANNY_SEARCH_PATIENCE passes
+            # (checked per threshold like a sequential sweep would, the rest of the batch is ignored)
+            if n % 2 == 0 and stable_passes >= CANNY_SEARCH_PATIENCE:
+                break
+
+            # best candidate before this pass
+            nbr_of_tables, total_area = len(candidate['contours']), candidate['total_area']
+
+            visited.add(params)
+            update_contours_candidate(candidate, out_contours, params)
+
+            # stable: same number of tables and the area moved less than the selection tolerance
+            # (a pass with the same contours still replaces the candidate, so the update itself is no signal)
+            if candidate['params'] is not None and len(candidate['contours']) == nbr_of_tables and abs(candidate['total_area'] - total_area) <= total_area*(MAX_MIN_AREA_RECT_FRAC - 1):
+                stable_passes += 1
+            else:
+                stable_passes = 0
+
+        if stable_passes >= CANNY_SEARCH_PATIENCE:
+            break
+
+    """
+        Local refinement
+    """
+
+    # all the thresholds of the full grid
+    grid = set(get_canny_thresholds_grid())
+
+    while candidate['params'] is not None:
+
+        # center of the neighborhood
+        best_j, best_i, _ = candidate['params']
+
+        # neighbors on the full grid
+        neighbors = []
+        for dj in [-DELTA_CANNY_THRESH, 0, DELTA_CANNY_THRESH]:
+            for di in [-DELTA_CANNY_THRESH, 0, DELTA_CANNY_THRESH]:
+                for k in [False, True]:
+                    params = (best_j + dj, best_i + di, k)
+                    if (params[0], params[1]) in grid and params not in visited:
+                        neighbors.append(params)
+
+        # keep the sweep order (the selection rules depend on it)
+        neighbors = sorted(neighbors, key=lambda p: (-p[0], -p[1], p[2]))
+
+        # converged
+        if len(neighbors) == 0:
+            break
+
+        # best candidate before this round
+        nbr_of_tables, total_area = len(candidate['contours']), candidate['total_area']
+
+        # run neighbors
+        passes_contours = run_canny_passes(img, neighbors, extra_dilate=extra_dilate, edges_cache=edges_cache, executor=executor)
+        nbr_of_passes += len(neighbors)
+        visited.update(neighbors)
+        for params, out_contours in zip(neighbors, passes_contours):
+            update_contours_candidate(candidate, out_contours, params)
+
+        # converged: the best candidate did not move
+        if candidate['params'][:2] == (best_j, best_i):
+            break
+
+        # converged: it moved to a pass with the same tables (same stability test as the coarse grid)
+        if len(candidate['contours']) == nbr_of_tables and abs(candidate['total_area'] - total_area) <= total_area*(MAX_MIN_AREA_RECT_FRAC - 1):
+            break
+
+    return candidate, nbr_of_passes
+
+
+@timed('canny_sweep')
+def bruteForceFindContour(img, extra_dilate=False, edges_cache=None, search_mode=None, search_stats=None, nbr_of_workers=None):
+
+    # set search strategy
+    if search_mode is None:
+        search_mode = CANNY_SEARCH_MODE
+
+    # set the number of threads running passes
+    if nbr_of_workers is None:
+        nbr_of_workers = CANNY_SEARCH_WORKERS
+
+    # one pool for the whole sweep (opencv releases the GIL in canny, dilate and findContours)
+    executor = None
+    if nbr_of_workers > 1:
+        executor = ThreadPoolExecutor(max_workers=nbr_of_workers, initializer=init_worker_slots(nbr_of_workers))
+
+    # search
+    try:
+        if search_mode == 'coarse_to_fine':
+            candidate, nbr_of_passes = coarseToFineCannySearch(img, extra_dilate=extra_dilate, edges_cache=edges_cache, executor=executor, nbr_of_workers=nbr_of_workers)
+        else:
+            candidate, nbr_of_passes = exhaustiveCannySearch(img, extra_dilate=extra_dilate, edges_cache=edges_cache, executor=executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # report how much of the grid was skipped
+    if search_stats is not None:
+        nbr_of_grid_passes = 2*len(get_canny_thresholds_grid())
+        search_stats['search_mode'] = search_mode
+        search_stats['passes_run'] = search_stats.get('passes_run', 0) + nbr_of_passes
+        search_stats['passes_skipped'] = search_stats.get('passes_skipped', 0) + nbr_of_grid_passes - nbr_of_passes
+
+        # winning pass, (low, up, close_lines) and dilation
+        if candidate['params'] is not None:
+            search_stats['params'] = candidate['params']
+            search_stats['extra_dilate'] = extra_dilate
+
+    return candidate['contours']
+
+
+def get_contours_tables(img, low_thresh=None, up_thresh=None, close_lines=True, extra_dilate=False, edges_cache=None):
     """
         Returns all the contours that look like tables in an image
     """
 
+    # return the result of a previous pass with the same parameters
+    key = (low_thresh, up_thresh, close_lines, extra_dilate)
+    if edges_cache is not None and key in edges_cache['contours']:
+        count('canny_passes_reused')
+        return edges_cache['contours'][key]
+
+    # find the contours
+    final_contours = _get_contours_tables(img, low_thresh=low_thresh, up_thresh=up_thresh, close_lines=close_lines, extra_dilate=extra_dilate, edges_cache=edges_cache)
+
+    # keep for later passes
+    if edges_cache is not None:
+        edges_cache['contours'][key] = final_contours
+
+    return final_contours
+
+
+@timed('canny_pass')
+def _get_contours_tables(img, low_thresh=None, up_thresh=None, close_lines=True, extra_dilate=False, edges_cache=None):
+
     # Grab dimensions of image
     height = img.shape[0]
     width = img.shape[1]
 
     # Get edges
-    img_edges = get_dilated_edges(img, low_thresh=low_thresh, up_thresh=up_thresh, close_lines=close_lines)
+    img_edges = get_dilated_edges(img, low_thresh=low_thresh, up_thresh=up_thresh, close_lines=close_lines, edges_cache=edges_cache)
 
     if extra_dilate:
         # init kernels
         kernel_rect = cv.getStructuringElement(cv.MORPH_RECT, (5, 5))
 
-        # dilate intersection points
-        img_edges = cv.dilate(img_edges, kernel_rect)
+        # dilate intersection points (into a scratch buffer of the sweep)
+        img_edges = cv.dilate(img_edges, kernel_rect, get_scratch(edges_cache, 'extra_dilated', img_edges.shape) if edges_cache is not None else None)
 
     # Get contours
     contours, hierarchy = cv.findContours(img_edges, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
+    count('canny_passes')
+    count('contours_seen', len(contours) if contours is not None else 0)
 
     # make sure we have contours
     if contours is None or hierarchy is None or len(contours) == 0:
@@ -496,7 +725,9 @@ def approximate_corners(height, width, contour):
     min_line_length = min_rect_width*MIN_LINE_LENGTH_TABLE_CNT
 
     # Apply Hough Transform
-    lines = cv.HoughLinesP(mask_cnt, 1, ANGLE_RESOLUTION, HOUGH_THRESHOLD_MIN, None, min_line_length, 0)
+    with timer('hough'):
+        lines = cv.HoughLinesP(mask_cnt, 1, ANGLE_RESOLUTION, HOUGH_THRESHOLD_MIN, None, min_line_length, 0)
+    count('hough_calls')
     if lines is None:
         return None
 
@@ -529,7 +760,9 @@ def approximate_corners(height, width, contour):
     min_line_length = min_rect_height*MIN_LINE_LENGTH_TABLE_CNT
 
     # Apply Hough Transform
-    lines = cv.HoughLinesP(mask_cnt, 1, ANGLE_RESOLUTION, HOUGH_THRESHOLD_MIN, None, min_line_length, 0)
+    with timer('hough'):
+        lines = cv.HoughLinesP(mask_cnt, 1, ANGLE_RESOLUTION, HOUGH_THRESHOLD_MIN, None, min_line_length, 0)
+    count('hough_calls')
     if lines is None:
         return None
 
@@ -708,14 +941,11 @@ def approximate_corners(height, width, contour):
     return corners
 
 
-def extract_table(img, corners, width, height):
+def extract_table(img, corners, width, height, dst=None):
     """
-        Extracts a trapezoid from the image and projects it to a rectangle
+        Extracts a trapezoid from the image and projects it to a rectangle (into dst when given)
     """
 
-    # copy img
-    table = img.copy()
-
     src = np.array(corners, dtype="float32")
 
     dest = np.array([
@@ -735,81 +965,207 @@ def extract_table(img, corners, width, height):
             if abs(val) < 1e-6:
                 transform_matrix[i][j] = 1e-6
 
-    # Apply the transformation on our image
-    table = cv.warpPerspective(table, transform_matrix, (width, height))
+    # Apply the transformation on our image (img is left untouched)
+    table = cv.warpPerspective(img, transform_matrix, (width, height), dst)
 
     return table, transform_matrix
 
 
-def get_table_horz_vert_lines(table, up_thresh=120, minLineLength=0.3, close_lines=False):
+def init_hough_cache(img, hough_mode=None):
     """
-        Returns the horz and vert lines in a table
+        Returns the cache shared by all the hough lines extractions over the same table
     """
 
-    # get dimensions
-    height = table.shape[0]
-    width = table.shape[1]
+    # set mode
+    if hough_mode is None:
+        hough_mode = HOUGH_LINES_MODE
+
+    return {
+        'mode': hough_mode,
+        'edges_cache': init_edges_cache(img),
+        'directional_edges': {},
+        'lines': {},
+        'stats': {
+            'nbr_of_edge_maps': 0,
+            'nbr_of_hough_calls': 0,
+            'nbr_of_hough_reused': 0
+        }
+    }
 
-    # get edges
-    edges = get_dilated_edges(table.copy(), low_thresh=20, up_thresh=up_thresh, close_lines=close_lines)
 
-    # init
-    horz_lines = []
-    vert_lines = []
+def get_directional_edges(hough_cache, up_thresh, close_lines):
+    """
+        Returns the (horz, vert) edge maps of a table, computed once per (up_thresh, close_lines).
+        Each map comes with a digest so that identical maps share their hough lines
+    """
+
+    # lookup
+    key = (up_thresh, close_lines)
+    if key in hough_cache['directional_edges']:
+        return hough_cache['directional_edges'][key]
+
+    # get edges (canny derivatives and dilation are shared with the other thresholds)
+    edges = get_dilated_edges(None, low_thresh=20, up_thresh=up_thresh, close_lines=close_lines, edges_cache=hough_cache['edges_cache'])
 
     # kernels
     vert_kernel = cv.getStructuringElement(cv.MORPH_RECT, (HOUGH_KERNEL_SIZE, 1))
     horz_kernel = cv.getStructuringElement(cv.MORPH_RECT, (1, HOUGH_KERNEL_SIZE))
 
-    # -------------------------------------------------------
-    # ---------------- Horizontal Lines ---------------------
-    # -------------------------------------------------------
+    # intermediate steps go through scratch buffers, only the final maps are kept
+    eroded = get_scratch(hough_cache['edges_cache'], 'eroded', edges.shape)
+    opened = get_scratch(hough_cache['edges_cache'], 'opened', edges.shape)
 
     # erode vert lines
-    horzEdges = edges.copy()
-    horzEdges = cv.morphologyEx(horzEdges, cv.MORPH_ERODE, vert_kernel)
-    horzEdges = cv.morphologyEx(horzEdges, cv.MORPH_OPEN, vert_kernel)
-    horzEdges = cv.morphologyEx(horzEdges, cv.MORPH_CLOSE, horz_kernel)
+    cv.morphologyEx(edges, cv.MORPH_ERODE, vert_kernel, eroded)
+    cv.morphologyEx(eroded, cv.MORPH_OPEN, vert_kernel, opened)
+    horz_edges = cv.morphologyEx(opened, cv.MORPH_CLOSE, horz_kernel)
+
+    # erode horz lines
+    cv.morphologyEx(edges, cv.MORPH_ERODE, horz_kernel, eroded)
+    cv.morphologyEx(eroded, cv.MORPH_OPEN, horz_kernel, opened)
+    vert_edges = cv.morphologyEx(opened, cv.MORPH_CLOSE, vert_kernel)
+
+    # store
+    directional_edges = {
+        'horz': (horz_edges, hashlib.blake2b(horz_edges, digest_size=16).digest()),
+        'vert': (vert_edges, hashlib.blake2b(vert_edges, digest_size=16).digest())
+    }
+    hough_cache['directional_edges'][key] = directional_edges
+    hough_cache['stats']['nbr_of_edge_maps'] += 1
+
+    return directional_edges
 
-    # Set Parameters
-    widthLineLength = int(width*minLineLength)
-    lineGap = int(width*MAX_LINE_GAP)
-    if lineGap < 4:
-        lineGap = 4
 
-    for maxLineGap in [0, lineGap]:
+def get_segments_votes(edges, lines):
+    """
+        Returns the number of edge pixels along each (N, 4) [x1, y1, x2, y2] segment
+    """
+
+    # nothing to count
+    if len(lines) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # one sample per pixel along the longest segment
+    nbr_of_samples = int(np.max(np.abs(lines[:, 2:] - lines[:, :2]))) + 1
+    t = np.linspace(0.0, 1.0, nbr_of_samples)
+
+    # sample coordinates, (N, nbr_of_samples)
+    xs = np.rint(lines[:, 0, None] + (lines[:, 2, None] - lines[:, 0, None]) * t[None, :]).astype(np.int64)
+    ys = np.rint(lines[:, 1, None] + (lines[:, 3, None] - lines[:, 1, None]) * t[None, :]).astype(np.int64)
+
+    # count each pixel once per segment
+    pixels = ys * edges.shape[1] + xs
+    pixels.sort(axis=1)
+    unique = np.ones(pixels.shape, dtype=bool)
+    unique[:, 1:] = pixels[:, 1:] != pixels[:, :-1]
+
+    return np.sum((edges.reshape(-1)[pixels] > 0) & unique, axis=1)
+
+
+def get_cached_hough_lines(hough_cache, edges, digest, thresh, min_line_length, max_line_gap):
+    """
+        Returns HoughLinesP as a (N, 4) array, computed once per identical edge map and parameters
+    """
+
+    # single mode: one run at the lowest threshold, then filtered by votes
+    if hough_cache['mode'] == 'single':
+        key = (digest, min(HOUGH_BASIC_LINES_TRESH), min_line_length, max_line_gap)
+    else:
+        key = (digest, thresh, min_line_length, max_line_gap)
+
+    # lookup
+    if key in hough_cache['lines']:
+        lines, votes = hough_cache['lines'][key]
+        hough_cache['stats']['nbr_of_hough_reused'] += 1
+        count('hough_reused')
+
+    else:
+
+        # compute hough lines
+        with timer('hough'):
+            lines = cv.HoughLinesP(edges, 1, ANGLE_RESOLUTION, key[1], None, minLineLength=min_line_length, maxLineGap=max_line_gap)
+        count('hough_calls')
+        lines = np.zeros((0, 4), dtype=np.int32) if lines is None else lines.reshape(-1, 4)
+
+        # votes of each segment, for the single mode filter
+        votes = get_segments_votes(edges, lines) if hough_cache['mode'] == 'single' else None
+
+        # store
+        hough_cache['lines'][key] = (lines, votes)
+        hough_cache['stats']['nbr_of_hough_calls'] += 1
+
+    # filter by votes
+    if votes is not None:
+        lines = lines[votes >= thresh]
+
+    return lines
+
+
+def get_table_lines_in_direction(hough_cache, edges, digest, line_length, line_gap, is_line_in_direction, min_nbr_of_lines, width, height):
+    """
+        Returns the lines of an edge map, same search as get_table_horz_vert_lines for one direction
+    """
+
+    # init
+    lines_in_direction = []
+
+    for max_line_gap in [0, line_gap]:
 
         # Apply Hough Transform
         for thresh in HOUGH_BASIC_LINES_TRESH:
 
             # compute hough lines
-            lines = cv.HoughLinesP(horzEdges, 1, ANGLE_RESOLUTION, thresh, None, minLineLength=widthLineLength, maxLineGap=maxLineGap)
-            if lines is None:
+            lines = get_cached_hough_lines(hough_cache, edges, digest, thresh, line_length, max_line_gap)
+            if len(lines) == 0:
                 continue
 
-            # Go through each Hough line and only keep the horizontal ones
-            temp_horz_lines = []
-            for line in lines:
-
-                x1 = line[0][0]
-                y1 = line[0][1]
-                x2 = line[0][2]
-                y2 = line[0][3]
-
-                if is_line_horz((x1, y1), (x2, y2), MAX_HORZ_SLOPE):
-                    temp_horz_lines.append([(x1, y1), (x2, y2)])
+            # only keep the lines in the right direction
+            temp_lines = [[(x1, y1), (x2, y2)] for x1, y1, x2, y2 in lines if is_line_in_direction((x1, y1), (x2, y2))]
 
             # if more than earlier set as new lines
-            if len(temp_horz_lines) > len(horz_lines):
-                horz_lines = temp_horz_lines
+            if len(temp_lines) > len(lines_in_direction):
+                lines_in_direction = temp_lines
 
         # get unique lines
-        unique_lines = reduce_lines(horz_lines, width, height)
+        unique_lines = reduce_lines(lines_in_direction, width, height)
 
-        # if we found horz lines, we break
-        if len(unique_lines) > MIN_NBR_OF_HORZ_LINES:
+        # if we found lines, we break
+        if len(unique_lines) > min_nbr_of_lines:
             break
 
+    return lines_in_direction
+
+
+def get_table_horz_vert_lines(table, up_thresh=120, minLineLength=0.3, close_lines=False, hough_cache=None):
+    """
+        Returns the horz and vert lines in a table
+    """
+
+    # get dimensions
+    height = table.shape[0]
+    width = table.shape[1]
+
+    # the cache shares the edge maps and hough lines across calls on the same table
+    if hough_cache is None:
+        hough_cache = init_hough_cache(table)
+
+    # get horz and vert edges
+    directional_edges = get_directional_edges(hough_cache, up_thresh, close_lines)
+
+    # -------------------------------------------------------
+    # ---------------- Horizontal Lines ---------------------
+    # -------------------------------------------------------
+
+    # Set Parameters
+    widthLineLength = int(width*minLineLength)
+    lineGap = int(width*MAX_LINE_GAP)
+    if lineGap < 4:
+        lineGap = 4
+
+    # find lines
+    horz_edges, horz_digest = directional_edges['horz']
+    horz_lines = get_table_lines_in_direction(hough_cache, horz_edges, horz_digest, widthLineLength, lineGap, lambda p1, p2: is_line_horz(p1, p2, MAX_HORZ_SLOPE), MIN_NBR_OF_HORZ_LINES, width, height)
+
     # add the two borders
     if len(horz_lines) > 0:
 
@@ -824,102 +1180,223 @@ def get_table_horz_vert_lines(table, up_thresh=120, minLineLength=0.3, close_lin
     # ------------------ Vertical Lines ---------------------
     # -------------------------------------------------------
 
-    # erode horz lines
-    vertEdges = edges.copy()
-    vertEdges = cv.morphologyEx(vertEdges, cv.MORPH_ERODE, horz_kernel)
-    vertEdges = cv.morphologyEx(vertEdges, cv.MORPH_OPEN, horz_kernel)
-    vertEdges = cv.morphologyEx(vertEdges, cv.MORPH_CLOSE, vert_kernel)
-
     # set parameter
     vertLineLength = int(height*minLineLength)
     lineGap = int(height*MAX_LINE_GAP)
     if lineGap < 4:
         lineGap = 4
 
-    for maxLineGap in [0, lineGap]:
+    # find lines
+    vert_edges, vert_digest = directional_edges['vert']
+    vert_lines = get_table_lines_in_direction(hough_cache, vert_edges, vert_digest, vertLineLength, lineGap, lambda p1, p2: is_line_vert(p1, p2, MIN_VERT_SLOPE), MIN_NBR_OF_VERT_LINES, width, height)
 
-        # Apply Hough Transform
-        for thresh in HOUGH_BASIC_LINES_TRESH:
+    # add the two borders
+    if len(vert_lines) > 0:
 
-            # compute probabilistic hough lines
-            lines = cv.HoughLinesP(vertEdges, 1, ANGLE_RESOLUTION, thresh, lines=None, minLineLength=vertLineLength, maxLineGap=maxLineGap)
-            if lines is None:
-                continue
+        # left
+        vert_lines.append([(1, 1), (1, height-1)])
 
-            # Go through each Hough line and only keep the horizontal ones
-            temp_vert_lines = []
-            for line in lines:
+        # right
+        vert_lines.append([(width-1, 1), (width-1, height-1)])
 
-                x1 = line[0][0]
-                y1 = line[0][1]
-                x2 = line[0][2]
-                y2 = line[0][3]
 
-                if is_line_vert((x1, y1), (x2, y2), MIN_VERT_SLOPE):
-                    temp_vert_lines.append([(x1, y1), (x2, y2)])
+    return horz_lines, vert_lines
 
 
-            # if more than earlier set as new lines
-            if len(temp_vert_lines) > len(vert_lines):
-                vert_lines = temp_vert_lines
+def get_profile_lines(edges, min_line_length, line_gap):
+    """
+        Returns the horizontal lines of an edge map as (x1, y1, x2, y2), found from the peaks of its row projection profile.
+        Peaks are refined to sub-pixel, and each line gets its own skew from the edge pixels around its peak
+    """
 
+    # get dimensions
+    height, width = edges.shape[:2]
+    mask = edges.reshape(height, width) > 0
+
+    # fraction of each row covered by edges, smoothed
+    profile = np.count_nonzero(mask, axis=1).astype(np.float64) / width
+    kernel = cv.getGaussianKernel(2*LINE_GROUP_THICKNESS + 1, 0).reshape(-1)
+    profile = np.convolve(profile, kernel, mode='same')
+
+    # local maxima covering enough of the row
+    min_coverage = 0.5 * min_line_length / float(width)
+    peaks = np.nonzero((profile[1:-1] >= profile[:-2]) & (profile[1:-1] > profile[2:]) & (profile[1:-1] >= min_coverage))[0] + 1
+
+    # non-maximum suppression, strongest first
+    kept = []
+    for peak in peaks[np.argsort(-profile[peaks], kind='stable')]:
+        if all(abs(peak - other) > LINE_GROUP_THICKNESS for other in kept):
+            kept.append(peak)
+
+    lines = []
+    for peak in sorted(kept):
+
+        # sub-pixel peak (parabola through the 3 samples)
+        left, center, right = profile[peak - 1], profile[peak], profile[peak + 1]
+        denominator = left - 2*center + right
+        y0 = peak + (0.5 * (left - right) / denominator if denominator < 0 else 0.0)
+
+        # edge pixels around the peak
+        band_start = max(int(y0) - LINE_GROUP_THICKNESS, 0)
+        band_end = min(int(y0) + LINE_GROUP_THICKNESS + 1, height)
+        ys, xs = np.nonzero(mask[band_start:band_end])
+        if len(xs) == 0:
+            continue
+        ys = ys + band_start
+
+        # extent, the longest run of columns with gaps of at most {line_gap}
+        cols = np.unique(xs)
+        breaks = np.nonzero(np.diff(cols) > line_gap + 1)[0]
+        starts = np.concatenate([[0], breaks + 1])
+        ends = np.concatenate([breaks, [len(cols) - 1]])
+        longest = int(np.argmax(cols[ends] - cols[starts]))
+        x1, x2 = int(cols[starts[longest]]), int(cols[ends[longest]])
+        if x2 - x1 < min_line_length:
+            continue
 
-        # get unique lines
-        unique_lines = reduce_lines(vert_lines, width, height)
+        # local skew from the pixels of the line, y = slope*x + intercept through their mean (the slope is clipped)
+        in_line = (xs >= x1) & (xs <= x2)
+        xs, ys = xs[in_line], ys[in_line]
+        slope = 0.0
+        if np.ptp(xs) > 0:
+            slope = float(np.clip(np.polyfit(xs, ys, 1)[0], -MAX_HORZ_SLOPE, MAX_HORZ_SLOPE))
+        intercept = ys.mean() - slope * xs.mean()
 
-        # if we found horz lines, we break
-        if len(unique_lines) > MIN_NBR_OF_VERT_LINES:
-            break
+        # append
+        lines.append((x1, int(round(slope*x1 + intercept)), x2, int(round(slope*x2 + intercept))))
 
+    return lines
+
+
+def get_table_horz_vert_lines_profile(table, up_thresh=120, minLineLength=0.3, close_lines=False, hough_cache=None):
+    """
+        Returns the horz and vert lines in a table from projection profiles, same output as get_table_horz_vert_lines
+    """
+
+    # get dimensions
+    height = table.shape[0]
+    width = table.shape[1]
+
+    # the cache shares the edge maps across calls on the same table
+    if hough_cache is None:
+        hough_cache = init_hough_cache(table)
+
+    # get horz and vert edges
+    directional_edges = get_directional_edges(hough_cache, up_thresh, close_lines)
+
+    # horizontal lines, from the rows
+    lineGap = max(int(width*MAX_LINE_GAP), 4)
+    horz_lines = [[(x1, y1), (x2, y2)] for x1, y1, x2, y2 in get_profile_lines(directional_edges['horz'][0], int(width*minLineLength), lineGap)]
+
+    # vertical lines, from the columns (transposed)
+    lineGap = max(int(height*MAX_LINE_GAP), 4)
+    vert_lines = [[(x1, y1), (x2, y2)] for y1, x1, y2, x2 in get_profile_lines(directional_edges['vert'][0].T, int(height*minLineLength), lineGap)]
 
     # add the two borders
-    if len(vert_lines) > 0:
+    if len(horz_lines) > 0:
+        horz_lines.append([(1, 1), (width-1, 1)])
+        horz_lines.append([(1, height-1), (width-1, height-1)])
 
-        # left
+    if len(vert_lines) > 0:
         vert_lines.append([(1, 1), (1, height-1)])
-
-        # right
         vert_lines.append([(width-1, 1), (width-1, height-1)])
 
-
     return horz_lines, vert_lines
 
 
-def reduce_lines(lines, width, height):
+def get_lines_groups(lines, width, height):
     """
-        Remove duplicate lines
+        Returns the mask of the lines drawn with a {LINE_GROUP_THICKNESS} thickness and its labels image,
+        one label per group of touching lines (holes enclosed by a group belong to it)
     """
 
     # create a mask
-    src_mask = np.zeros((height, width, 1), np.uint8)
+    src_mask = np.zeros((height, width), np.uint8)
     src_mask = draw_lines(src_mask, lines, line_thickness=LINE_GROUP_THICKNESS, color=(255))
 
-    # dims
-    height = src_mask.shape[0]
-    width = src_mask.shape[1]
+    # one label per group
+    _, labels = cv.connectedComponents(src_mask, connectivity=8, ltype=cv.CV_32S)
+
+    # background areas not connected to the borders are holes
+    nbr_of_bg_labels, bg_labels, bg_stats, _ = cv.connectedComponentsWithStats(255 - src_mask, connectivity=4, ltype=cv.CV_32S)
+    left, top, w, h = bg_stats[:, 0], bg_stats[:, 1], bg_stats[:, 2], bg_stats[:, 3]
+    holes = np.nonzero((left > 0) & (top > 0) & (left + w < width) & (top + h < height))[0]
+    holes = holes[holes > 0]
+
+    # fill each hole with the group on the left of its first pixel
+    if len(holes) > 0:
+        _, first_pixels = np.unique(bg_labels, return_index=True)
+        hole_to_label = np.zeros(nbr_of_bg_labels, dtype=np.int32)
+        hole_to_label[holes] = labels.reshape(-1)[first_pixels[holes] - 1]
+        filled = hole_to_label[bg_labels]
+        labels = np.where(filled > 0, filled, labels)
+
+    return src_mask, labels
+
+
+def get_labels_moments(labels):
+    """
+        Returns the number of pixels, the mean (x, y) and the (xx, xy, yy) second central moments of every label at once
+    """
+
+    # pixels of every label
+    ys, xs = np.nonzero(labels)
+    pixel_labels = labels[ys, xs]
+    nbr_of_labels = int(labels.max()) + 1 if len(pixel_labels) > 0 else 1
+
+    # first moments
+    nbr_of_pixels = np.bincount(pixel_labels, minlength=nbr_of_labels).astype(np.float64)
+    mean_x = np.bincount(pixel_labels, weights=xs, minlength=nbr_of_labels) / np.maximum(nbr_of_pixels, 1)
+    mean_y = np.bincount(pixel_labels, weights=ys, minlength=nbr_of_labels) / np.maximum(nbr_of_pixels, 1)
+
+    # second central moments
+    dx = xs - mean_x[pixel_labels]
+    dy = ys - mean_y[pixel_labels]
+    moments = np.stack([
+        np.bincount(pixel_labels, weights=dx*dx, minlength=nbr_of_labels),
+        np.bincount(pixel_labels, weights=dx*dy, minlength=nbr_of_labels),
+        np.bincount(pixel_labels, weights=dy*dy, minlength=nbr_of_labels)
+    ], axis=1)
+
+    return nbr_of_pixels, mean_x, mean_y, moments
+
+
+def reduce_lines(lines, width, height):
+    """
+        Remove duplicate lines
+    """
+
+    # group touching lines
+    src_mask, labels = get_lines_groups(lines, width, height)
 
     # Get contours
     contours, _ = cv.findContours(src_mask, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
     if contours is None or len(contours) == 0:
         return []
 
+    # moments of every group, in one pass over the labels
+    _, mean_x, mean_y, moments = get_labels_moments(labels)
+
     # go through lines
     new_lines = []
     for cnt in contours:
 
+        # holes are part of the group around them
+        if cv.contourArea(cnt, oriented=True) > 0:
+            continue
+
+        # group of the contour
+        label = labels[cnt[0, 0, 1], cnt[0, 0, 0]]
+
         # get the width & height of the rectangle with minimum area that enclose the contour
         _, (min_rect_width, min_rect_height), _ = cv.minAreaRect(cnt)
         max_cnt_length = max([min_rect_width, min_rect_height])
 
-        # create a mask
-        mask = np.zeros((height, width, 1), np.uint8)
-        mask = cv.drawContours(mask, [cnt], -1, (255), -1)
-
-        # append all white pixel coordinates to an array
-        white_pixels = cv.findNonZero(mask)
-
-        # compute PCA
-        angle, center = compute_PCA(white_pixels)
+        # main axis of the group, same as compute_PCA
+        cov_xx, cov_xy, cov_yy = moments[label]
+        _, _, eigenvectors = cv.eigen(np.array([[cov_xx, cov_xy], [cov_xy, cov_yy]]))
+        angle = math.atan2(eigenvectors[0, 1], eigenvectors[0, 0])
+        center = (int(mean_x[label]), int(mean_y[label]))
 
         # compute segment
         r = max_cnt_length/2.0
@@ -995,18 +1472,19 @@ def score_table_template_fit(table_intersection_points, template_intersection_po
     if len(table_intersection_points) <= len(template_intersection_points)*MIN_TABLE_INTERSECTION_POINTS:
         return 0.0
 
+    # format as (N, 2) arrays (a template's points can be passed already formatted)
+    table_pts = as_points(table_intersection_points)
+    template_pts = as_points(template_intersection_points)
+
     """
         How well do table intersection points match with the template intersection points
     """
 
     # get the template intersection points closest to the table
-    analog_pts = []
-    for pt in table_intersection_points:
-        analog_pt = get_nearest_points_in_list(pt[0], template_intersection_points, MAX_NBR=1)[0]
-        analog_pts.append([analog_pt])
+    analog_pts = template_pts[get_nearest_indexes(table_pts, template_pts)]
 
     # compute cosine similarity
-    cos_sim = cosine_similarity(table_intersection_points, analog_pts, width, height)
+    cos_sim = cosine_similarity(table_pts, analog_pts, width, height)
 
     # normalize
     table_fit_score = (cos_sim + 1)/2.0
@@ -1015,14 +1493,11 @@ def score_table_template_fit(table_intersection_points, template_intersection_po
         (Inverse) How well do template intersection points match with the table intersection points
     """
 
-    # get the template intersection points closest to the table
-    analog_pts = []
-    for pt in template_intersection_points:
-        analog_pt = get_nearest_points_in_list(pt[0], table_intersection_points, MAX_NBR=1)[0]
-        analog_pts.append([analog_pt])
+    # get the table intersection points closest to the template
+    analog_pts = table_pts[get_nearest_indexes(template_pts, table_pts)]
 
     # compute cosine similarity
-    cos_sim = cosine_similarity(template_intersection_points, analog_pts, width, height)
+    cos_sim = cosine_similarity(template_pts, analog_pts, width, height)
 
     # normalize
     template_fit_score = (cos_sim + 1)/2.0
@@ -1037,9 +1512,6 @@ def score_table_template_fit(table_intersection_points, template_intersection_po
 
 def scale_table_template(table_template, width, height):
 
-    # copy template
-    scaled_table_template = deepcopy(table_template)
-
     # get table template dimensions
     template_width, template_height = get_table_template_dimensions(table_template)
 
@@ -1047,48 +1519,22 @@ def scale_table_template(table_template, width, height):
     width_ratio = width / float(template_width)
     height_ratio = height / float(template_height)
 
-    # get aspect ratio
-    aspect_ratio = template_width / float(template_height)
-
-    # set height if not provided
-    if height is None:
-        height = int( width / float(aspect_ratio) )
+    # scale all the rectangles at once
+    rectangles = get_rect_set(table_template['rectangles']).scale(width_ratio, height_ratio)
 
-    # go through and scale
-    for i, rectangle in enumerate(scaled_table_template['rectangles']):
-
-        # compute new coordinates
-        x0 = int(rectangle['x0'] * width_ratio)
-        y0 = int(rectangle['y0'] * height_ratio)
-        w = int(rectangle['w'] * width_ratio)
-        h = int(rectangle['h'] * height_ratio)
-
-        # update
-        scaled_table_template['rectangles'][i]['x0'] = x0
-        scaled_table_template['rectangles'][i]['y0'] = y0
-        scaled_table_template['rectangles'][i]['w'] = w
-        scaled_table_template['rectangles'][i]['h'] = h
-
-        # if AOI,
-        if 'aoi' in rectangle:
-
-            # compute new coordinates
-            x0 = int(rectangle['aoi']['x0'] * width_ratio)
-            y0 = int(rectangle['aoi']['y0'] * height_ratio)
-            w = int(rectangle['aoi']['w'] * width_ratio)
-            h = int(rectangle['aoi']['h'] * height_ratio)
-
-            # update
-            scaled_table_template['rectangles'][i]['aoi']['x0'] = x0
-            scaled_table_template['rectangles'][i]['aoi']['y0'] = y0
-            scaled_table_template['rectangles'][i]['aoi']['w'] = w
-            scaled_table_template['rectangles'][i]['aoi']['h'] = h
+    # copy template (only the rectangles are modified), keep the input's format
+    scaled_table_template = dict(table_template)
+    scaled_table_template['rectangles'] = rectangles if isinstance(table_template['rectangles'], RectSet) else rectangles.to_rectangles()
 
     return scaled_table_template
 
 
 def get_rectangles_intersections(rectangles):
 
+    # rect set, all at once
+    if isinstance(rectangles, RectSet):
+        return rectangles.intersections()
+
     # init empty set
     intersection_points = set()
 
@@ -1131,18 +1577,35 @@ def fitUsingHough(to_be_fitted_rectangles, horz_lines, vert_lines, FACTOR):
         Fit rects using nearby hough lines
     """
 
+    # work on arrays
+    rectangles = get_rect_set(to_be_fitted_rectangles)
+    fitted = np.zeros(len(rectangles), dtype=bool)
+
     # index of valid hough lines
     valid_horz_lines = []
     valid_vert_lines = []
 
-    # go through rects
-    for i, rectangle in enumerate(to_be_fitted_rectangles):
+    # lines sorted by position (horz lines by y, vert lines by x)
+    horz_lines_index = get_lines_index(horz_lines, 1)
+    vert_lines_index = get_lines_index(vert_lines, 0)
 
-        # grab rect position
-        x0 = rectangle['x0']
-        y0 = rectangle['y0']
-        w = rectangle['w']
-        h = rectangle['h']
+    # find middle points
+    x1, y1, x2, y2 = rectangles.corners()
+    mid_x = rectangles.boxes[:, 0] + rectangles.boxes[:, 2]/2.0
+    mid_y = rectangles.boxes[:, 1] + rectangles.boxes[:, 3]/2.0
+
+    # spacing
+    minColSpacing = rectangles.boxes[:, 2]*FACTOR
+    minRowSpacing = rectangles.boxes[:, 3]*FACTOR
+
+    # find the closest hough line to the midde point of each rectangle side, for all the rectangles at once (-1 if none)
+    top_lines_index = return_closest_lines_indexes(np.stack([mid_x, y1], axis=1), horz_lines_index, minRowSpacing).tolist()
+    bottom_lines_index = return_closest_lines_indexes(np.stack([mid_x, y2], axis=1), horz_lines_index, minRowSpacing).tolist()
+    left_lines_index = return_closest_lines_indexes(np.stack([x1, mid_y], axis=1), vert_lines_index, minColSpacing).tolist()
+    right_lines_index = return_closest_lines_indexes(np.stack([x2, mid_y], axis=1), vert_lines_index, minColSpacing).tolist()
+
+    # go through rects
+    for i, (x0, y0, w, h) in enumerate(rectangles.boxes.tolist()):
 
         # find middle points
         mid_x = x0 + w/2.0
@@ -1151,15 +1614,11 @@ def fitUsingHough(to_be_fitted_rectangles, horz_lines, vert_lines, FACTOR):
         # change mapping
         x1, y1, x2, y2 = remap_rectangles_origin_to_corners(x0, y0, w, h)
 
-        # spacing
-        minColSpacing = w*FACTOR
-        minRowSpacing = h*FACTOR
-
-        # find the closest hough line to the midde point of each rectangle side
-        top_line_index = return_closest_line_to_point((mid_x, y1), horz_lines, minRowSpacing)
-        bottom_line_index = return_closest_line_to_point((mid_x, y2), horz_lines, minRowSpacing)
-        left_line_index = return_closest_line_to_point((x1, mid_y), vert_lines, minColSpacing)
-        right_line_index = return_closest_line_to_point((x2, mid_y), vert_lines, minColSpacing)
+        # closest lines
+        top_line_index = top_lines_index[i] if top_lines_index[i] >= 0 else None
+        bottom_line_index = bottom_lines_index[i] if bottom_lines_index[i] >= 0 else None
+        left_line_index = left_lines_index[i] if left_lines_index[i] >= 0 else None
+        right_line_index = right_lines_index[i] if right_lines_index[i] >= 0 else None
 
         # new pos
         new_x1 = x1
@@ -1224,17 +1683,20 @@ def fitUsingHough(to_be_fitted_rectangles, horz_lines, vert_lines, FACTOR):
 
         # update
         if new_x1 != new_x2 and new_x2 > new_x1:
-            to_be_fitted_rectangles[i]['x0'] = new_x0
-            to_be_fitted_rectangles[i]['w'] = new_w
+            rectangles.boxes[i, 0] = new_x0
+            rectangles.boxes[i, 2] = new_w
             x_validated = True
 
         if new_y1 != new_y2 and new_y2 > new_y1:
-            to_be_fitted_rectangles[i]['y0'] = new_y0
-            to_be_fitted_rectangles[i]['h'] = new_h
+            rectangles.boxes[i, 1] = new_y0
+            rectangles.boxes[i, 3] = new_h
             y_validated = True
 
         # if all fitted
-        to_be_fitted_rectangles[i]['fitted'] = (x1_fitted and y1_fitted and x2_fitted and y2_fitted and x_validated and y_validated)
+        fitted[i] = (x1_fitted and y1_fitted and x2_fitted and y2_fitted and x_validated and y_validated)
+
+    # set fitted flags
+    rectangles.fitted = fitted
 
     # grab unique lines
     valid_horz_lines = list(set(valid_horz_lines))
@@ -1242,7 +1704,11 @@ def fitUsingHough(to_be_fitted_rectangles, horz_lines, vert_lines, FACTOR):
     valid_horz_lines = [horz_lines[ind] for ind in valid_horz_lines]
     valid_vert_lines = [vert_lines[ind] for ind in valid_vert_lines]
 
-    return to_be_fitted_rectangles, valid_horz_lines, valid_vert_lines
+    # keep the input's format
+    if not isinstance(to_be_fitted_rectangles, RectSet):
+        rectangles = rectangles.to_rectangles()
+
+    return rectangles, valid_horz_lines, valid_vert_lines
 
 
 def are_rectangles_adjacent(rectangle_1, rectangle_2):
@@ -1336,7 +1802,15 @@ def relative_position_of_rect(rect_center, rect_adjacent):
     # center
     _cx = rect_adjacent['x0'] + (rect_adjacent['w'] / 2.0)
     _cy = rect_adjacent['y0'] + (rect_adjacent['h'] / 2.0)
-    
+
+    return relative_position_of_center(cx, cy, _cx, _cy)
+
+
+def relative_position_of_center(cx, cy, _cx, _cy):
+    """
+        Same as relative_position_of_rect, from the two centers
+    """
+
     # angle 
     angle_in_rad = angle_between_3_points((cx + 100, cy), (cx, cy), (_cx, _cy))
 
@@ -1358,61 +1832,81 @@ def relative_position_of_rect(rect_center, rect_adjacent):
     return nbr_of_90
 
 
-def fitUsingNeighbours(to_be_fitted_rectangles, template_rectangles):
+def fitUsingNeighbours(to_be_fitted_rectangles, template_rectangles, max_level=None):
     """
-        Look at unfitted rects and match to neighboring fitted rects
+        Look at unfitted rects and match to neighboring fitted rects.
+        Walks the template's adjacency graph breadth first from the fitted rects: each unfitted rect is adjusted once,
+        from its neighbours closer to a fitted rect, then its own unfitted neighbours are queued (up to {max_level} walls away)
     """
 
-    # split the fitted & unfitted rectangles
-    fitted_rectangles_index = [i for i, rectangle in enumerate(to_be_fitted_rectangles) if 'fitted' in rectangle and rectangle['fitted'] == True]
-    unfitted_rectangles_index = [i for i, rectangle in enumerate(to_be_fitted_rectangles) if 'fitted' not in rectangle or rectangle['fitted'] == False]
+    # default
+    if max_level is None:
+        max_level = NEIGHBOURS_FIT_MAX_LEVEL
+
+    # work on arrays
+    rectangles = get_rect_set(to_be_fitted_rectangles)
+    template = get_rect_set(template_rectangles)
+    fitted = rectangles.fitted if rectangles.fitted is not None else np.zeros(len(rectangles), dtype=bool)
 
-    # go through unfitted rectangles and try to fit using adjacent fitted rectangles
-    for i in unfitted_rectangles_index:
+    # adjacent rectangles of the template (built once per template)
+    adjacency = template.adjacency()
 
-        # grab unfitted rectangle
-        unfitted_rectangle = to_be_fitted_rectangles[i]
+    # positions and centers, updated as the rects are adjusted
+    boxes = rectangles.boxes.tolist()
+    centers = (rectangles.boxes[:, :2] + rectangles.boxes[:, 2:] / 2.0).tolist()
 
-        # grab corresponding template rectangle
-        template_rectangle = template_rectangles[i]
+    # distance to the closest fitted rect, in number of walls
+    levels = [0 if is_fitted else -1 for is_fitted in fitted.tolist()]
 
-        # get the index of all adjacent rectangles
-        adjacent_rectangles_index = get_adjacent_rectangles_index(template_rectangle, template_rectangles)
+    # start from the unfitted rects adjacent to a fitted one
+    queue = deque()
+    for i in np.nonzero(~fitted)[0].tolist():
+        if max_level > 0 and any(fitted[_i] for _i, _ in adjacency[i]):
+            levels[i] = 1
+            queue.append(i)
 
-        # only keep the index of adjacent rectangles that have been fitted
-        adjacent_fitted_rectangles_index = [_i for _i in adjacent_rectangles_index if 'fitted' in to_be_fitted_rectangles[_i] and to_be_fitted_rectangles[_i]['fitted'] == True]
+    # go through unfitted rectangles and try to fit using adjacent rectangles of a lower level
+    while len(queue) > 0:
 
-        # skip if none
-        if len(adjacent_fitted_rectangles_index) == 0: continue
+        # grab next rectangle
+        i = queue.popleft()
+        level = levels[i]
 
-        # grab current position
-        x0 = unfitted_rectangle['x0']
-        y0 = unfitted_rectangle['y0']
-        w = unfitted_rectangle['w']
-        h = unfitted_rectangle['h']
+        # queue its unvisited neighbours
+        for _i, _ in adjacency[i]:
+            if levels[_i] == -1 and level < max_level:
+                levels[_i] = level + 1
+                queue.append(_i)
 
-        # init new positions
-        new_x0 = x0
-        new_y0 = y0
-        new_w = w
-        new_h = h
+        # sources: the neighbours closer to a fitted rect
+        sources = [_i for _i, _ in adjacency[i] if 0 <= levels[_i] < level]
 
-        for j in range(0, 3):
-            for _i in adjacent_fitted_rectangles_index:
+        # compute max delta
+        max_x_delta = template.boxes[i, 2] * CLOSENESS_FACTOR
+        max_y_delta = template.boxes[i, 3] * CLOSENESS_FACTOR
 
-                # grab adjacent rect
-                _rectangle = to_be_fitted_rectangles[_i]
+        # two rounds (the sources don't move, the second round starts from the adjusted origin)
+        for j in range(0, 2):
+
+            # grab current position
+            x0, y0, w, h = boxes[i]
+            cx, cy = centers[i]
+
+            # init new positions
+            new_x0 = x0
+            new_y0 = y0
+            new_w = w
+            new_h = h
+
+            for _i in sources:
 
                 # find position
-                nbr_of_90_turn = relative_position_of_rect(unfitted_rectangle, _rectangle)
+                nbr_of_90_turn = relative_position_of_center(cx, cy, *centers[_i])
                 if not isNumber(nbr_of_90_turn): continue
 
                 # get cell corners
-                _h = _rectangle['h']
-                _w = _rectangle['w']
-                _x0 = _rectangle['x0']
-                _y0 = _rectangle['y0']
-                
+                _x0, _y0, _w, _h = boxes[_i]
+
                 # adjust line
                 if nbr_of_90_turn == 0:
                     new_w = _x0 - x0
@@ -1423,201 +1917,134 @@ def fitUsingNeighbours(to_be_fitted_rectangles, template_rectangles):
                 elif nbr_of_90_turn == 3:
                     new_h = _y0 - y0
 
-        # compute max delta
-        max_x_delta = template_rectangle['w'] * CLOSENESS_FACTOR
-        max_y_delta = template_rectangle['h'] * CLOSENESS_FACTOR
+            # update
+            if abs(x0 - new_x0) < max_x_delta:
+                x0 = new_x0
+            if abs(w - new_w) < max_x_delta:
+                w = new_w
+            if abs(y0 - new_y0) < max_y_delta:
+                y0 = new_y0
+            if abs(h - new_h) < max_y_delta:
+                h = new_h
 
-        # update
-        if abs(x0 - new_x0) < max_x_delta:
-            to_be_fitted_rectangles[i]['x0'] = new_x0
-        if abs(w - new_w) < max_x_delta:
-            to_be_fitted_rectangles[i]['w'] = new_w
-        if abs(y0 - new_y0) < max_y_delta:
-            to_be_fitted_rectangles[i]['y0'] = new_y0
-        if abs(h - new_h) < max_y_delta:
-            to_be_fitted_rectangles[i]['h'] = new_h
+            boxes[i] = [x0, y0, w, h]
+            centers[i] = [x0 + w / 2.0, y0 + h / 2.0]
+
+    # write back
+    if len(boxes) > 0:
+        rectangles.boxes = np.array(boxes, dtype=np.float64)
 
-    return to_be_fitted_rectangles
+    # keep the input's format
+    if not isinstance(to_be_fitted_rectangles, RectSet):
+        return rectangles.to_rectangles()
 
+    return rectangles
 
+
+@timed('fit_rects')
 def fitRects(table, template_rectangles, horz_lines, vert_lines):
 
     # grab dimensions
     height = table.shape[0]
     width = table.shape[1]
 
-    # create a copy of the rectangles
-    to_be_fitted_rectangles = [deepcopy(rect) for rect in template_rectangles]
+    # work on arrays, on a copy of the rectangles
+    template = get_rect_set(template_rectangles)
+    rectangles = template.copy()
 
     """
         First fit using raw hough lines
     """
 
     # fit using hough lines
-    to_be_fitted_rectangles, horz_lines, vert_lines = fitUsingHough(to_be_fitted_rectangles, horz_lines, vert_lines, CLOSENESS_FACTOR)
+    rectangles, horz_lines, vert_lines = fitUsingHough(rectangles, horz_lines, vert_lines, CLOSENESS_FACTOR)
 
     # fit using neighbors
-    for i in range(0, 2):
-        to_be_fitted_rectangles = fitUsingNeighbours(to_be_fitted_rectangles, template_rectangles)
+    rectangles = fitUsingNeighbours(rectangles, template)
 
     """
         Make sure the fitted rects are at least close to the area occupied by the template equivalent
     """
 
-    # rect corners
-    for i, rectangle in enumerate(to_be_fitted_rectangles):
+    # areas of the adjusted and template rects
+    rect_area = rectangles.boxes[:, 2] * rectangles.boxes[:, 3]
+    rect_area_t = template.boxes[:, 2] * template.boxes[:, 3]
 
-        # grab data of adjusted rect
-        fitted = rectangle['fitted']
-        x0 = rectangle['x0']
-        y0 = rectangle['y0']
-        w = rectangle['w']
-        h = rectangle['h']
-        rect_area = w * h
-
-        # grab data of template rect
-        template_rectangle = template_rectangles[i]
-        x0_t = template_rectangle['x0']
-        y0_t = template_rectangle['y0']
-        w_t = template_rectangle['w']
-        h_t = template_rectangle['h']
-        rect_area_t = w_t * h_t
-
-        # skip
-        if fitted == False: continue
-        if rect_area_t <= 1: continue
+    # ratio
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rect_area_ratio = np.abs(1 - ( rect_area / rect_area_t ))
 
-        # ratio
-        rect_area_ratio = abs(1 - ( rect_area / float(rect_area_t) ))
-
-        # check if within
-        if rect_area_ratio > MAX_RECT_AREA_RATIO_DIFF:
-            to_be_fitted_rectangles[i]['fitted'] = False
-            to_be_fitted_rectangles[i]['x0'] = x0_t
-            to_be_fitted_rectangles[i]['y0'] = y0_t
-            to_be_fitted_rectangles[i]['w'] = w_t
-            to_be_fitted_rectangles[i]['h'] = h_t
+    # reset the fitted rects too far from their template
+    reset = rectangles.fitted & (rect_area_t > 1) & (rect_area_ratio > MAX_RECT_AREA_RATIO_DIFF)
+    rectangles.fitted[reset] = False
+    rectangles.boxes[reset] = template.boxes[reset]
 
     """
         Make sure the points don't fall out of the table
     """
 
-    for i, rectangle in enumerate(to_be_fitted_rectangles):
-
-        # grab data of adjusted rect
-        x0 = rectangle['x0']
-        y0 = rectangle['y0']
-        w = rectangle['w']
-        h = rectangle['h']
-
-        # change mapping
-        x1 = x0
-        y1 = y0
-        x2 = x0 + w
-        y2 = y0 + h
-
-        # check
-        if x2 < 0 or y2 < 0 or x1 > width or y1 > height or x1 == x2 or y1 == y2:
-            print('ERROR: Invalid cell size after fit')
-            return None
-
-        # init
-        new_x1 = x1
-        new_y1 = y1
-        new_x2 = x2
-        new_y2 = y2
-
-        # adjust
-        if x1 < 0:
-            new_x1 = 0
-        if y1 < 0:
-            new_y1 = 0
-        if x2 > width:
-            new_x2 = width
-        if y2 > height:
-            new_y2 = height
-
-        # update
-        to_be_fitted_rectangles[i]['x0'] = new_x1
-        to_be_fitted_rectangles[i]['y0'] = new_y1
-        to_be_fitted_rectangles[i]['w'] = new_x2 - new_x1
-        to_be_fitted_rectangles[i]['h'] = new_y2 - new_y1
-
-    return to_be_fitted_rectangles
-
+    # change mapping
+    x1, y1, x2, y2 = rectangles.corners()
 
-def fitAOI(fitted_rectangle, template_rectangle):
+    # check
+    if np.any((x2 < 0) | (y2 < 0) | (x1 > width) | (y1 > height) | (x1 == x2) | (y1 == y2)):
+        print('ERROR: Invalid cell size after fit')
+        return None
 
-    # grab coordinates of template rectangle
-    x0_template = template_rectangle['x0']
-    y0_template = template_rectangle['y0']
-    w_template = template_rectangle['w']
-    h_template = template_rectangle['h']
+    # adjust
+    new_x1 = np.maximum(x1, 0)
+    new_y1 = np.maximum(y1, 0)
+    new_x2 = np.minimum(x2, width)
+    new_y2 = np.minimum(y2, height)
 
-    # grab coordinates of aoi of template rectangle
-    x0_aoi_template = template_rectangle['aoi']['x0']
-    y0_aoi_template = template_rectangle['aoi']['y0']
-    w_aoi_template = template_rectangle['aoi']['w']
-    h_aoi_template = template_rectangle['aoi']['h']
+    # update
+    rectangles.boxes = np.stack([new_x1, new_y1, new_x2 - new_x1, new_y2 - new_y1], axis=1)
 
-    # grab coordinates of fitted rectangle
-    x0_fitted = fitted_rectangle['x0']
-    y0_fitted = fitted_rectangle['y0']
-    w_fitted = fitted_rectangle['w']
-    h_fitted = fitted_rectangle['h']
+    # keep the input's format
+    if not isinstance(template_rectangles, RectSet):
+        return rectangles.to_rectangles()
 
-    # change mapping
-    x1_template, y1_template, x2_template, y2_template = remap_rectangles_origin_to_corners(x0_template, y0_template, w_template, h_template)
-    x1_aoi_template, y1_aoi_template, x2_aoi_template, y2_aoi_template = remap_rectangles_origin_to_corners(x0_aoi_template, y0_aoi_template, w_aoi_template, h_aoi_template)
-    x1_fitted, y1_fitted, x2_fitted, y2_fitted = remap_rectangles_origin_to_corners(x0_fitted, y0_fitted, w_fitted, h_fitted)
+    return rectangles
 
-    # get the ratio of the aoi rectangle length over the original rectangle length
-    w_aoi_ratio = w_aoi_template / float( w_template )
-    h_aoi_ratio = h_aoi_template / float( h_template )
 
-    # fitted
-    w_aoi_fitted = w_aoi_ratio * w_fitted
-    h_aoi_fitted = h_aoi_ratio * h_fitted
+def cropAOIRects(fitted_rectangles, template_rectangles):
 
-    # init new position
-    new_x0 = x0_fitted
-    new_y0 = y0_fitted
-    new_w = w_aoi_fitted
-    new_h = h_aoi_fitted
+    # work on arrays
+    rectangles = get_rect_set(fitted_rectangles)
+    template = get_rect_set(template_rectangles)
 
-    if abs(x1_template - x1_aoi_template) > 1:
-        # left side of aoi and rectangle are not touching
-        new_x0 = x2_fitted - w_aoi_fitted
+    # split the rectangles with a AOI
+    aoi = template.aoi_mask
 
-    elif abs(y1_template - y1_aoi_template) > 1:
-        # top side of aoi and rectangle are not touching
-        new_y0 = y2_fitted - h_aoi_fitted
+    # grab coordinates of the template, aoi and fitted rectangles
+    x1_template, y1_template = template.boxes[aoi, 0], template.boxes[aoi, 1]
+    w_template, h_template = template.boxes[aoi, 2], template.boxes[aoi, 3]
+    x1_aoi_template, y1_aoi_template = template.aoi_boxes[aoi, 0], template.aoi_boxes[aoi, 1]
+    w_aoi_template, h_aoi_template = template.aoi_boxes[aoi, 2], template.aoi_boxes[aoi, 3]
+    x0_fitted, y0_fitted, w_fitted, h_fitted = rectangles.boxes[aoi].T
 
-    return new_x0, new_y0, new_w, new_h
+    # get the ratio of the aoi rectangle length over the original rectangle length, then fitted
+    w_aoi_fitted = (w_aoi_template / w_template) * w_fitted
+    h_aoi_fitted = (h_aoi_template / h_template) * h_fitted
 
+    # left side of aoi and rectangle are not touching, or else top side
+    left = np.abs(x1_template - x1_aoi_template) > 1
+    top = ~left & (np.abs(y1_template - y1_aoi_template) > 1)
 
-def cropAOIRects(fitted_rectangles, template_rectangles):
-
-    # split the rectangles with a AOI
-    aoi_rectangles_index = [i for i, rectangle in enumerate(template_rectangles) if 'aoi' in rectangle]
+    # new position
+    new_x0 = np.where(left, x0_fitted + w_fitted - w_aoi_fitted, x0_fitted)
+    new_y0 = np.where(top, y0_fitted + h_fitted - h_aoi_fitted, y0_fitted)
 
     # update the coordinates of the rectangles with AOI
-    for i in aoi_rectangles_index:
-
-        # grab rectangles
-        fitted_rectangle = fitted_rectangles[i]
-        template_rectangle = template_rectangles[i]
+    if not isinstance(fitted_rectangles, RectSet):
+        rectangles = rectangles.copy()
+    rectangles.boxes[aoi] = np.stack([new_x0, new_y0, w_aoi_fitted, h_aoi_fitted], axis=1)
 
-        # fit aoi
-        aoi_x0, aoi_y0, aoi_w, aoi_h = fitAOI(fitted_rectangle, template_rectangle)
-
-        # update
-        fitted_rectangles[i]['x0'] = aoi_x0
-        fitted_rectangles[i]['y0'] = aoi_y0
-        fitted_rectangles[i]['w'] = aoi_w
-        fitted_rectangles[i]['h'] = aoi_h
+    # keep the input's format
+    if not isinstance(fitted_rectangles, RectSet):
+        return rectangles.to_rectangles()
 
-    return fitted_rectangles
+    return rectangles
 
 
 def reprojRects(table, rectangles, transform_matrix):
@@ -1633,33 +2060,34 @@ def reprojRects(table, rectangles, transform_matrix):
     max_x = 0
     max_y = 0
 
-    # go through db rectangles and reproject them on source image using transform matrix
-    for rectangle in rectangles:
+    # work on arrays
+    rectangles = get_rect_set(rectangles)
+
+    # change mapping
+    x1, y1, x2, y2 = rectangles.corners()
+
+    # reproject the 4 corners of all the rectangles at once (tl, tr, br, bl)
+    if len(rectangles) > 0:
+        reprojected = retrieve_src_from_projected_array(transform_matrix, np.stack([x1, x2, x2, x1], axis=1), np.stack([y1, y1, y2, y2], axis=1))
+        if reprojected is None:
+            print("ERROR: Couldn't reproject rectangle")
+            return None
+        xs, ys = reprojected
+        xs = xs.tolist()
+        ys = ys.tolist()
+
+    # go through db rectangles and build the cells
+    for i, (x0, y0, w, h) in enumerate(rectangles.boxes.tolist()):
 
         # grab data of adjusted rect
-        rect_id = rectangle['id']
-        x0 = rectangle['x0']
-        y0 = rectangle['y0']
-        w = rectangle['w']
-        h = rectangle['h']
+        rect_id = rectangles.ids[i]
 
         # change mapping
         x1, y1, x2, y2 = remap_rectangles_origin_to_corners(x0, y0, w, h)
 
-        # reproject
-        tl_pt = retrieve_src_from_projected(transform_matrix, x1, y1)
-        tr_pt = retrieve_src_from_projected(transform_matrix, x2, y1)
-        br_pt = retrieve_src_from_projected(transform_matrix, x2, y2)
-        bl_pt = retrieve_src_from_projected(transform_matrix, x1, y2)
-        if tl_pt is None or tr_pt is None or br_pt is None or bl_pt is None:
-            print("ERROR: Couldn't reproject rectangle")
-            return None
-
         # split
-        tl_x, tl_y = tl_pt
-        tr_x, tr_y = tr_pt
-        br_x, br_y = br_pt
-        bl_x, bl_y = bl_pt
+        tl_x, tr_x, br_x, bl_x = xs[i]
+        tl_y, tr_y, br_y, bl_y = ys[i]
 
         # round
         tl_x = int(tl_x)
@@ -1709,8 +2137,8 @@ def reprojRects(table, rectangles, transform_matrix):
         }
 
         # set info
-        cell['data_type'] = rectangle['data_type']
-        cell['opts'] = rectangle['opts']
+        cell['data_type'] = rectangles.data_types[i]
+        cell['opts'] = rectangles.opts[i]
 
         # append to array
         reproj_rects.append(cell)
@@ -1757,26 +2185,32 @@ def reprojRects(table, rectangles, transform_matrix):
     return (reproj_rects, max_width, max_height)
 
 
-def extract_contours(img):
+@timed('extract_contours')
+def extract_contours(img, search_stats=None, quiet=False):
     """
-        Find the contours of elements that look like tables
+        Find the contours of elements that look like tables (quiet: no error printed if none, the caller handles it)
     """
 
+    # blur and derive once, shared by every pass of both sweeps
+    edges_cache = init_edges_cache(img)
+
     # find contours
-    contours = bruteForceFindContour(img, extra_dilate=False)
+    contours = bruteForceFindContour(img, extra_dilate=False, edges_cache=edges_cache, search_stats=search_stats)
 
-    # try again with dilation
+    # try again with dilation (reuses the edges of the first sweep)
     if len(contours) == 0:
-        contours = bruteForceFindContour(img, extra_dilate=True)
+        contours = bruteForceFindContour(img, extra_dilate=True, edges_cache=edges_cache, search_stats=search_stats)
 
     # if failed
     if not isListNonEmpty(contours):
-        print("ERROR: No contours could be found")
+        if not quiet:
+            print("ERROR: No contours could be found")
         return None
 
     return contours
 
 
+@timed('compute_corners')
 def compute_corners(img, contours):
     """
         Extract the corners of each contour
@@ -1803,6 +2237,7 @@ def compute_corners(img, contours):
         contours_corners.append(corners)
 
     # check if we have corners
+    count('tables_found', len(contours_corners))
     if not isListNonEmpty(contours_corners):
         print("ERROR: No corners of contours could be found")
         return None
@@ -1810,6 +2245,146 @@ def compute_corners(img, contours):
     return contours_corners
 
 
+def get_pyramid_factor(width, height, longest_dim=None):
+    """
+        Returns the integer downscaling factor bringing the longest side of an image closest to (not under) longest_dim
+    """
+
+    # default
+    if longest_dim is None:
+        longest_dim = PROCESS_DETECT_LONGEST_DIM
+
+    return max(int(max(width, height) // longest_dim), 1)
+
+
+def downscale(img, factor):
+    """
+        Downscales an image by an integer factor: each pixel is the average of a factor x factor block,
+        so (x, y) on the downscaled copy maps to (x*factor, y*factor)
+    """
+
+    # keep the full blocks only
+    height = (img.shape[0] // factor) * factor
+    width = (img.shape[1] // factor) * factor
+
+    return cv.resize(img[:height, :width], (width // factor, height // factor), interpolation=cv.INTER_AREA)
+
+
+def get_boxes_overlap(box_1, box_2):
+    """
+        Returns the intersection over union of two (x, y, w, h) boxes
+    """
+
+    # intersection
+    w = min(box_1[0] + box_1[2], box_2[0] + box_2[2]) - max(box_1[0], box_2[0])
+    h = min(box_1[1] + box_1[3], box_2[1] + box_2[3]) - max(box_1[1], box_2[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+
+    # union
+    intersection = w * h
+    union = box_1[2] * box_1[3] + box_2[2] * box_2[3] - intersection
+
+    return intersection / float(union)
+
+
+@timed('refine_contour')
+def refine_contour(img, contour, factor, params, extra_dilate=False):
+    """
+        Returns the contour, found on the downscaled copy, at the resolution of img: the pass that found it is run again
+        on a crop of img around it. Returns the crop's (x, y) offset and the contour relative to the crop, or None
+    """
+
+    # region of interest, with a margin
+    x, y, w, h = cv.boundingRect(contour)
+    margin = int(max(w, h) * PROCESS_ROI_MARGIN) + 2
+    x0 = max((x - margin) * factor, 0)
+    y0 = max((y - margin) * factor, 0)
+    x1 = min((x + w + margin) * factor, img.shape[1])
+    y1 = min((y + h + margin) * factor, img.shape[0])
+    crop = img[y0:y1, x0:x1]
+
+    # same pass, at full resolution
+    low_thresh, up_thresh, close_lines = params
+    contours = get_contours_tables(crop, low_thresh=low_thresh, up_thresh=up_thresh, close_lines=close_lines, extra_dilate=extra_dilate)
+    if not isListNonEmpty(contours):
+        return None
+
+    # keep the contour covering the same area as the downscaled one
+    box = (x * factor - x0, y * factor - y0, w * factor, h * factor)
+    overlaps = [get_boxes_overlap(cv.boundingRect(_contour), box) for _contour in contours]
+    best = int(np.argmax(overlaps))
+    if overlaps[best] < 0.5:
+        return None
+
+    return (x0, y0), crop, contours[best]
+
+
+@timed('extract_corners_pyramid')
+def extract_corners_pyramid(img, search_stats=None, pyramid_stats=None):
+    """
+        Finds the tables on a downscaled copy of the image, then computes their corners on crops of the image.
+        Returns the corners of each table (in img coordinates), or None if the image is too small to be downscaled or no
+        table was found on the downscaled copy. Nothing is printed then, the caller falls back to the single scale
+    """
+
+    # integer factor
+    factor = get_pyramid_factor(img.shape[1], img.shape[0])
+    if pyramid_stats is not None:
+        pyramid_stats['factor'] = factor
+
+    # not downscaled, the single scale sweep is the same without the refinement
+    if factor == 1:
+        return None
+
+    # find contours on the downscaled copy
+    search_stats = search_stats if search_stats is not None else {}
+    img_small = downscale(img, factor)
+    contours_small = extract_contours(img_small, search_stats=search_stats, quiet=True)
+    if not isListNonEmpty(contours_small) or 'params' not in search_stats:
+        return None
+
+    # go through contours
+    contours_corners = []
+    nbr_of_refined = 0
+    for contour_small in contours_small:
+
+        # refine the contour on a crop at full resolution
+        refined = refine_contour(img, contour_small, factor, search_stats['params'], extra_dilate=search_stats['extra_dilate'])
+
+        if refined is not None:
+
+            # compute corners on the crop
+            (x0, y0), crop, contour = refined
+            corners = approximate_corners(crop.shape[0], crop.shape[1], contour)
+            nbr_of_refined += 1
+
+        else:
+
+            # otherwise on the scaled up contour
+            x0, y0 = 0, 0
+            corners = approximate_corners(img.shape[0], img.shape[1], contour_small * factor)
+
+        # check
+        if not isListNonEmpty(corners) or len(corners) != 4:
+            continue
+
+        # append, in img coordinates
+        contours_corners.append([np.float32([corner[0] + x0, corner[1] + y0]) for corner in corners])
+
+    # report
+    if pyramid_stats is not None:
+        pyramid_stats['nbr_of_tables'] = len(contours_small)
+        pyramid_stats['nbr_of_refined'] = nbr_of_refined
+
+    # check if we have corners
+    count('tables_found', len(contours_corners))
+    if not isListNonEmpty(contours_corners):
+        return None
+
+    return contours_corners
+
+
 def extract_tables(img, tables_corners):
 
     # init variables
@@ -1841,7 +2416,8 @@ def extract_tables(img, tables_corners):
     return tables, tables_transform_matrix
 
 
-def compute_hough_lines(img):
+@timed('compute_hough_lines')
+def compute_hough_lines(img, hough_mode=None, hough_stats=None, line_detector=None):
 
     # extract dimensions
     height = img.shape[0]
@@ -1851,57 +2427,63 @@ def compute_hough_lines(img):
     horz_lines = []
     vert_lines = []
 
+    # edge maps and hough lines shared by all the thresholds
+    hough_cache = init_hough_cache(img, hough_mode=hough_mode)
+
+    # set line detector
+    if line_detector is None:
+        line_detector = LINE_DETECTOR
+    get_lines = get_table_horz_vert_lines_profile if line_detector == 'profile' else get_table_horz_vert_lines
+
     # compute Hough for small Lines
     for lines_threshold in HOUGH_SMALL_LINES_TRESH:
-        temp_horz_lines, temp_vert_lines = get_table_horz_vert_lines(img, minLineLength=MIN_LINE_LENGTH, up_thresh=lines_threshold, close_lines=False)
+        temp_horz_lines, temp_vert_lines = get_lines(img, minLineLength=MIN_LINE_LENGTH, up_thresh=lines_threshold, close_lines=False, hough_cache=hough_cache)
         horz_lines = horz_lines + temp_horz_lines
         vert_lines = vert_lines + temp_vert_lines
 
     # compute Hough for long Lines: with morph lines closed
     for lines_threshold in HOUGH_LONG_LINES_TRESH:
-        temp_horz_lines, temp_vert_lines = get_table_horz_vert_lines(img, minLineLength=0.8, up_thresh=lines_threshold, close_lines=True)
+        temp_horz_lines, temp_vert_lines = get_lines(img, minLineLength=0.8, up_thresh=lines_threshold, close_lines=True, hough_cache=hough_cache)
         horz_lines = horz_lines + temp_horz_lines
         vert_lines = vert_lines + temp_vert_lines
 
+    # report how much work was shared
+    if hough_stats is not None:
+        hough_stats.update(hough_cache['stats'])
+
     # group lines
     horz_lines, vert_lines = group_lines(horz_lines, vert_lines, width, height)
+    count('lines_found', len(horz_lines) + len(vert_lines))
 
     return horz_lines, vert_lines
 
 
-def filter_table_templates(table, table_templates):
-
-    # init variable holding best table templates candidates
-    filtered_table_templates = []
+def filter_table_templates(table, table_templates, filter_stats=None):
 
     # extract dimensions
     height = table.shape[0]
     width = table.shape[1]
 
-    # get aspect ratio (w / h)
-    aspect_ratio_table = width / float(height)
+    # get the templates index (compiled once per process)
+    template_index = get_template_index(table_templates)
 
-    # go through all table templates
-    for table_template in table_templates:
+    # filter table templates based on aspect ratio mismatch
+    indexes = template_index.filter(width, height)
 
-        # extract table template dimensions
-        template_width, template_height = get_table_template_dimensions(table_template)
+    # report how many templates were pruned
+    if filter_stats is not None:
+        filter_stats['nbr_of_templates'] = filter_stats.get('nbr_of_templates', 0) + len(template_index)
+        filter_stats['nbr_of_candidates'] = filter_stats.get('nbr_of_candidates', 0) + len(indexes)
+        filter_stats['pruning_rate'] = 1.0 - filter_stats['nbr_of_candidates'] / float(max(filter_stats['nbr_of_templates'], 1))
 
-        # get aspect ratio
-        aspect_ratio_template = template_width / float(template_height)
+    # same type as the input
+    if isinstance(table_templates, TemplateIndex):
+        return template_index.subset(indexes)
 
-        # filter table templates based on aspect ratio mismatch
-        aspect_ratio_frac = min([aspect_ratio_template, aspect_ratio_table]) / float(max([aspect_ratio_template, aspect_ratio_table]))
-        if aspect_ratio_frac < MIN_ASPECT_RATIO_TABLE_AND_TABLE_TEMPLATE:
-            continue
+    return [template_index.table_templates[i] for i in indexes]
 
-        # append
-        filtered_table_templates.append(table_template)
 
-    return filtered_table_templates
-
-
-def score_rectangles_fit(table, fitted_rectangles, template_rectangles):
+def score_rectangles_fit(table, fitted_rectangles, template_rectangles, template_intersection_points=None):
 
     # extract dimensions
     height = table.shape[0]
@@ -1910,8 +2492,9 @@ def score_rectangles_fit(table, fitted_rectangles, template_rectangles):
     # get template's lines intersections points
     fitted_intersection_points = get_rectangles_intersections(fitted_rectangles)
 
-    # get template's lines intersections points
-    template_intersection_points = get_rectangles_intersections(template_rectangles)
+    # get template's lines intersections points (unless precomputed by the templates index)
+    if template_intersection_points is None:
+        template_intersection_points = get_rectangles_intersections(template_rectangles)
 
     # score template fit
     score = score_table_template_fit(fitted_intersection_points, template_intersection_points, width, height)
@@ -1919,7 +2502,8 @@ def score_rectangles_fit(table, fitted_rectangles, template_rectangles):
     return score
 
 
-def match_table_templates(table, table_templates, horz_lines, vert_lines, DEBUG=True):
+@timed('match_table_templates')
+def match_table_templates(table, table_templates, horz_lines, vert_lines, DEBUG=True, match_stats=None):
 
     # extract dimensions
     height = table.shape[0]
@@ -1929,17 +2513,31 @@ def match_table_templates(table, table_templates, horz_lines, vert_lines, DEBUG=
     max_score = 0
     max_score_table_template = None
 
-    # get lines intersection points
-    table_intersection_points = get_horz_vert_intersections(horz_lines, vert_lines, extension_factor=LINES_EXTENSION_FACTOR)
+    # get lines intersection points, (N, 2)
+    table_intersection_points = get_horz_vert_intersections_array(horz_lines, vert_lines, extension_factor=LINES_EXTENSION_FACTOR)
+
+    # get the templates index (compiled once per process)
+    template_index = get_template_index(table_templates)
+
+    # only fully score the templates whose rows/columns look like the table's lines
+    shortlist = template_index.shortlist(horz_lines, vert_lines, width, height, TEMPLATE_SHORTLIST_SIZE)
+    count('templates_scored', len(shortlist))
+
+    # report how many templates were pruned
+    if match_stats is not None:
+        match_stats['nbr_of_templates'] = match_stats.get('nbr_of_templates', 0) + len(template_index)
+        match_stats['nbr_of_scored'] = match_stats.get('nbr_of_scored', 0) + len(shortlist)
+        match_stats['pruning_rate'] = 1.0 - match_stats['nbr_of_scored'] / float(max(match_stats['nbr_of_templates'], 1))
 
     # go through table templates
-    for table_template in table_templates:
+    for i in shortlist:
 
-        # get template's lines intersections points
-        template_intersection_points = get_rectangles_intersections(table_template['rectangles'])
+        # grab template
+        table_template = template_index.table_templates[i]
+        compiled = template_index.compiled[i]
 
-        # score template fit
-        score = score_table_template_fit(table_intersection_points, template_intersection_points, width, height)
+        # score template fit, with the template's precomputed lines intersections points
+        score = score_table_template_fit(table_intersection_points, compiled['intersections'], width, height)
 
         # update best matching template
         if score > max_score:
@@ -0,0 +1,195 @@
+"""
+    This file contains the metrics of a run: the time spent in each stage and counters of the work done,
+    collected while a Metrics is active. They end up in the result json, and optionally in a trace file
+    (chrome trace .json, or one event per line .jsonl)
+"""
+
+# import basic libs
+import os
+import json
+import time
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+
+# metrics of the run in progress, one per process (the batch runs its images in separate processes)
+_active = None
+
+
+class Metrics:
+    """
+        Durations by stage (calls, total and max) and counters, plus the trace events if tracing.
+        The canny sweep runs on several threads, so the updates go through a lock
+    """
+
+    def __init__(self, trace=False):
+
+        # origin of the trace timestamps
+        self.start = time.perf_counter()
+
+        # durations and counters
+        self.stages = {}
+        self.counters = {}
+
+        # trace events, only if tracing
+        self.events = [] if trace else None
+
+        self.lock = threading.Lock()
+
+    def add_duration(self, name, start, duration):
+        """
+            Records a call of the {name} stage that started at {start} (perf_counter) and lasted {duration} seconds
+        """
+
+        with self.lock:
+
+            # accumulate
+            stage = self.stages.setdefault(name, {'calls': 0, 'total': 0.0, 'max': 0.0})
+            stage['calls'] += 1
+            stage['total'] += duration
+            stage['max'] = max(stage['max'], duration)
+
+            # complete event, in microseconds
+            if self.events is not None:
+                self.events.append({
+                    'name': name,
+                    'cat': 'meza_contour',
+                    'ph': 'X',
+                    'ts': round((start - self.start)*1e6, 1),
+                    'dur': round(duration*1e6, 1),
+                    'pid': os.getpid(),
+                    'tid': threading.get_ident()
+                })
+
+    def count(self, name, value=1):
+        """
+            Adds {value} to the {name} counter
+        """
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        """
+            Returns the metrics block of the result json, durations in milliseconds
+        """
+
+        return {
+            'total_ms': round((time.perf_counter() - self.start)*1e3, 3),
+            'stages': {
+                name: {
+                    'calls': stage['calls'],
+                    'total_ms': round(stage['total']*1e3, 3),
+                    'max_ms': round(stage['max']*1e3, 3)
+                } for name, stage in self.stages.items()
+            },
+            'counters': dict(self.counters)
+        }
+
+    def write_trace(self, trace_outpath, args=None):
+        """
+            Writes the trace events: appended one per line to a .jsonl (several runs can share the file),
+            otherwise as a chrome trace (chrome://tracing, perfetto). {args} is attached to every timed call
+        """
+
+        # nothing traced
+        if self.events is None:
+            return False
+
+        # attach the args (e.g. the image path) to the timed calls
+        events = self.events
+        if args is not None:
+            events = [dict(event, args=args) for event in events]
+
+        # counters at the end of the run (their args are the plotted values)
+        ts = round((time.perf_counter() - self.start)*1e6, 1)
+        events = events + [{'name': name, 'cat': 'meza_contour', 'ph': 'C', 'ts': ts, 'pid': os.getpid(), 'args': {name: value}} for name, value in self.counters.items()]
+
+        try:
+            if trace_outpath.endswith('.jsonl'):
+
+                # a single write, so that concurrent runs do not interleave their lines
+                with open(trace_outpath, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(event) + '\n' for event in events))
+
+            else:
+                with open(trace_outpath, 'w', encoding='utf-8') as f:
+                    json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+        except:
+            print("ERROR: Trace could not be written")
+            return False
+
+        return True
+
+
+@contextmanager
+def collect(metrics):
+    """
+        Makes {metrics} the active metrics for the duration of the block
+    """
+
+    global _active
+
+    previous = _active
+    _active = metrics
+
+    try:
+        yield metrics
+    finally:
+        _active = previous
+
+
+@contextmanager
+def timer(name):
+    """
+        Times the block as a call of the {name} stage (does nothing if no metrics are active)
+    """
+
+    metrics = _active
+    if metrics is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_duration(name, start, time.perf_counter() - start)
+
+
+def timed(name):
+    """
+        Decorator, times each call of the function as a call of the {name} stage
+    """
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+
+            # not collecting
+            metrics = _active
+            if metrics is None:
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.add_duration(name, start, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, value=1):
+    """
+        Adds {value} to the {name} counter of the active metrics (does nothing if no metrics are active)
+    """
+
+    metrics = _active
+    if metrics is not None:
+        metrics.count(name, value)
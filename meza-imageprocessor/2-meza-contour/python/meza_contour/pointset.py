@@ -0,0 +1,116 @@
+"""
+    This file contains the vectorized operations on sets of points: (N, 2) arrays, or contours in the (N, 1, 2) opencv format
+"""
+
+# import core image processing libs
+import numpy as np
+
+
+def as_points(pts):
+    """
+        Returns a set of points ((N, 2), (N, 1, 2) or a list of either) as a (N, 2) array
+    """
+
+    return np.asarray(pts).reshape(-1, 2)
+
+
+def normalize_points(pts, width, height):
+    """
+        Returns the points centered around the origin and scaled by the dimensions
+    """
+
+    # center and scale
+    center = np.array([width/2.0, height/2.0])
+    scale = np.array([float(width), float(height)])
+
+    return (pts - center) / scale
+
+
+def points_dot(pts1, pts2):
+    """
+        Returns the sum of the dot products of the pairs of points of two (N, 2) arrays
+    """
+
+    return np.einsum('ij,ij->', pts1, pts2)
+
+
+def points_norm(pts):
+    """
+        Returns the norm of a (N, 2) array of points, seen as one vector
+    """
+
+    return np.linalg.norm(pts)
+
+
+def cosine_similarity(pts1, pts2, width, height):
+    """
+        Returns the cosine angle between two (N, 2) arrays of points, once centered and scaled by the dimensions
+    """
+
+    # center points around origin and scale them
+    _pts1 = normalize_points(pts1, width, height)
+    _pts2 = normalize_points(pts2, width, height)
+
+    # accumulate dot product
+    nume = points_dot(_pts1, _pts2)
+
+    # compute denominator
+    denom = (points_norm(_pts1)*points_norm(_pts2) + 0.00000001)
+
+    cos_sim = nume/denom
+
+    return cos_sim
+
+
+def get_k_nearest_indexes(pts, pts_pool, k=1, chunk_size=512):
+    """
+        Takes two (N, 2) and (M, 2) arrays and returns, for each point of pts, the (N, k) indexes of its k closest points
+        in pts_pool, closest first. The distance matrix is computed by chunks of points to bound its size
+    """
+
+    # can't select more than the pool
+    k = min(k, len(pts_pool))
+
+    # init
+    indexes = np.empty((len(pts), k), dtype=np.intp)
+    if k == 0:
+        return indexes
+
+    # only one candidate
+    if len(pts_pool) == 1:
+        indexes[:] = 0
+        return indexes
+
+    # go through chunks of points
+    for start in range(0, len(pts), chunk_size):
+
+        # difference between the points and the pool of points
+        deltas = pts_pool[np.newaxis, :, :] - pts[start:start+chunk_size, np.newaxis, :]
+
+        # compute distances
+        distances = np.einsum('ijk,ijk->ij', deltas, deltas)
+
+        # k closests, row by row
+        closests = np.argpartition(distances, min(k, len(pts_pool) - 1), axis=1)[:, :k]
+
+        # order them by distance
+        order = np.argsort(np.take_along_axis(distances, closests, axis=1), axis=1, kind='stable')
+        indexes[start:start+chunk_size] = np.take_along_axis(closests, order, axis=1)
+
+    return indexes
+
+
+def get_nearest_indexes(pts, pts_pool, chunk_size=512):
+    """
+        Takes two (N, 2) and (M, 2) arrays and returns, for each point of pts, the index of its closest point in pts_pool
+    """
+
+    return get_k_nearest_indexes(pts, pts_pool, k=1, chunk_size=chunk_size)[:, 0]
+
+
+def get_nearest_points(pts, pts_pool, chunk_size=512):
+    """
+        Takes two (N, 2) and (M, 2) arrays and returns, for each point of pts, its closest point in pts_pool
+    """
+
+    return pts_pool[get_nearest_indexes(pts, pts_pool, chunk_size=chunk_size)]
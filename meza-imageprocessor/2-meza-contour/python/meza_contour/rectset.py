@@ -0,0 +1,188 @@
+"""
+    This file contains the array-backed representation of a table template's rectangles used by the fitting pipeline,
+    the list of dicts format is only used at the json boundary
+"""
+
+# import table templates index
+from .template_index import get_boxes_intersections, get_boxes_adjacency
+
+# import core image processing libs
+import numpy as np
+
+
+def to_number(value):
+    """
+        Returns a float as an int when it has no decimals, like the coordinates of the json rectangles
+    """
+
+    value = float(value)
+
+    return int(value) if value.is_integer() else value
+
+
+class RectSet:
+    """
+        Rectangles held in contiguous arrays: [x0, y0, w, h] boxes, AOI boxes and fitted flags.
+        Ids, data types and opts are kept per rectangle, with the source dicts for the export
+    """
+
+    __slots__ = ('boxes', 'aoi_mask', 'aoi_boxes', 'fitted', 'ids', 'data_types', 'opts', 'rectangles', 'graph')
+
+    def __init__(self, boxes, aoi_mask, aoi_boxes, fitted=None, ids=None, data_types=None, opts=None, rectangles=None):
+
+        # arrays
+        self.boxes = boxes
+        self.aoi_mask = aoi_mask
+        self.aoi_boxes = aoi_boxes
+        self.fitted = fitted
+
+        # per rectangle values
+        self.ids = ids if ids is not None else [None]*len(boxes)
+        self.data_types = data_types if data_types is not None else [None]*len(boxes)
+        self.opts = opts if opts is not None else [None]*len(boxes)
+        self.rectangles = rectangles if rectangles is not None else [{} for _ in range(len(boxes))]
+
+        # adjacency graph, built on first use
+        self.graph = None
+
+    @classmethod
+    def from_rectangles(cls, rectangles):
+        """
+            Returns the rect set of a list of rectangle dicts ({id, x0, y0, w, h, aoi, data_type, opts, fitted})
+        """
+
+        # boxes
+        boxes = np.array([[r['x0'], r['y0'], r['w'], r['h']] for r in rectangles], dtype=np.float64).reshape(-1, 4)
+
+        # areas of interest
+        aoi_mask = np.array(['aoi' in r for r in rectangles], dtype=bool)
+        aoi_boxes = np.array([[r['aoi']['x0'], r['aoi']['y0'], r['aoi']['w'], r['aoi']['h']] if 'aoi' in r else [0, 0, 0, 0] for r in rectangles], dtype=np.float64).reshape(-1, 4)
+
+        # fitted flags, only if the rectangles went through a fit
+        fitted = None
+        if any('fitted' in r for r in rectangles):
+            fitted = np.array([r.get('fitted') == True for r in rectangles], dtype=bool)
+
+        return cls(
+            boxes,
+            aoi_mask,
+            aoi_boxes,
+            fitted=fitted,
+            ids=[r.get('id') for r in rectangles],
+            data_types=[r.get('data_type') for r in rectangles],
+            opts=[r.get('opts') for r in rectangles],
+            rectangles=list(rectangles)
+        )
+
+    def to_rectangles(self):
+        """
+            Returns the rectangles as a list of dicts, the source dicts updated with the arrays
+        """
+
+        # init
+        rectangles = []
+
+        for i, (x0, y0, w, h) in enumerate(self.boxes.tolist()):
+
+            # copy the source dict
+            rectangle = dict(self.rectangles[i])
+
+            # update
+            rectangle['x0'] = to_number(x0)
+            rectangle['y0'] = to_number(y0)
+            rectangle['w'] = to_number(w)
+            rectangle['h'] = to_number(h)
+
+            # area of interest
+            if self.aoi_mask[i]:
+                aoi_x0, aoi_y0, aoi_w, aoi_h = self.aoi_boxes[i].tolist()
+                rectangle['aoi'] = dict(rectangle.get('aoi', {}), x0=to_number(aoi_x0), y0=to_number(aoi_y0), w=to_number(aoi_w), h=to_number(aoi_h))
+
+            # fitted flag
+            if self.fitted is not None:
+                rectangle['fitted'] = bool(self.fitted[i])
+
+            # append
+            rectangles.append(rectangle)
+
+        return rectangles
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def copy(self):
+        """
+            Returns a copy, arrays are copied and the per rectangle values shared (not the adjacency graph, the copy's boxes will move)
+        """
+
+        return RectSet(
+            self.boxes.copy(),
+            self.aoi_mask,
+            self.aoi_boxes.copy(),
+            fitted=self.fitted.copy() if self.fitted is not None else None,
+            ids=self.ids,
+            data_types=self.data_types,
+            opts=self.opts,
+            rectangles=self.rectangles
+        )
+
+    def scale(self, width_ratio, height_ratio):
+        """
+            Returns a copy with the boxes and AOI boxes scaled, truncated to integers like scale_table_template
+        """
+
+        # ratios
+        ratios = np.array([width_ratio, height_ratio] * 2)
+
+        # scale
+        scaled = self.copy()
+        scaled.boxes = np.trunc(self.boxes * ratios)
+        scaled.aoi_boxes = np.trunc(self.aoi_boxes * ratios)
+
+        return scaled
+
+    def corners(self):
+        """
+            Returns the (x1, y1, x2, y2) arrays of the top left and bottom right corners
+        """
+
+        return self.boxes[:, 0], self.boxes[:, 1], self.boxes[:, 0] + self.boxes[:, 2], self.boxes[:, 1] + self.boxes[:, 3]
+
+    def dimensions(self):
+        """
+            Returns the (width, height) of the area covered by the rectangles
+        """
+
+        x1, y1, x2, y2 = self.corners()
+
+        return to_number(np.max(x2, initial=0)), to_number(np.max(y2, initial=0))
+
+    def intersections(self):
+        """
+            Returns the unique corners of the rectangles as a (K, 2) array
+        """
+
+        return get_boxes_intersections(self.boxes)
+
+    def adjacency(self):
+        """
+            Returns, for each rectangle, the (index, side) of the rectangles sharing one of its walls.
+            Built once and kept with the set, only call it on a set whose boxes are not modified (a template)
+        """
+
+        if self.graph is None:
+            self.graph = get_boxes_adjacency(self.boxes)
+
+        return self.graph
+
+
+def get_rect_set(rectangles):
+    """
+        Returns the rect set of a list of rectangle dicts (or the rect set itself)
+    """
+
+    # already a rect set
+    if isinstance(rectangles, RectSet):
+        return rectangles
+
+    return RectSet.from_rectangles(rectangles)
@@ -0,0 +1,322 @@
+"""
+    This file contains the table templates index: everything the matcher and the fitter need from
+    the table_template rows, computed once per process instead of once per image
+"""
+
+# import config
+from .config import MIN_ASPECT_RATIO_TABLE_AND_TABLE_TEMPLATE, TEMPLATE_SIGNATURE_BINS
+
+# import basic libs
+import hashlib
+
+# import core image processing libs
+import numpy as np
+
+
+# constant of are_rectangles_adjacent
+ADJACENCY_MIN_DIST = 4
+
+
+def get_boxes_intersections(boxes):
+    """
+        Returns the unique corners of (N, 4) [x0, y0, w, h] boxes as a (K, 2) float64 array,
+        in the same order as get_rectangles_intersections
+    """
+
+    # init empty set
+    intersection_points = set()
+
+    for x0, y0, w, h in boxes.tolist():
+
+        # 4 corners
+        intersection_points.add((x0, y0))
+        intersection_points.add((x0, y0 + h))
+        intersection_points.add((x0 + w, y0))
+        intersection_points.add((x0 + w, y0 + h))
+
+    return np.ascontiguousarray(list(intersection_points), dtype=np.float64).reshape(-1, 2)
+
+
+def get_boxes_adjacency(boxes):
+    """
+        Returns, for each box, the list of (index, side) of the boxes sharing one of its walls.
+        Same rules as are_rectangles_adjacent, for all the pairs at once
+    """
+
+    # middle points and corners
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = boxes[:, 0] + boxes[:, 2]
+    y2 = boxes[:, 1] + boxes[:, 3]
+    mid_x = boxes[:, 0] + boxes[:, 2]/2.0
+    mid_y = boxes[:, 1] + boxes[:, 3]/2.0
+
+    # pairwise tests, [i, j] is box i against box j
+    same_row = np.abs(mid_y[:, None] - mid_y[None, :]) < ADJACENCY_MIN_DIST
+    same_col = np.abs(mid_x[:, None] - mid_x[None, :]) < ADJACENCY_MIN_DIST
+    same_center = (mid_x[:, None] == mid_x[None, :]) & (mid_y[:, None] == mid_y[None, :])
+
+    # sides, by priority
+    sides = [
+        ('r', same_row & (np.abs(x2[:, None] - x1[None, :]) < ADJACENCY_MIN_DIST)),
+        ('l', same_row & (np.abs(x1[:, None] - x2[None, :]) < ADJACENCY_MIN_DIST)),
+        ('b', same_col & (np.abs(y2[:, None] - y1[None, :]) < ADJACENCY_MIN_DIST)),
+        ('t', same_col & (np.abs(y1[:, None] - y2[None, :]) < ADJACENCY_MIN_DIST))
+    ]
+
+    # first matching side wins
+    side_index = np.full(same_center.shape, -1, dtype=np.int8)
+    for k in range(len(sides) - 1, -1, -1):
+        side_index[sides[k][1]] = k
+    side_index[same_center] = -1
+
+    # format
+    adjacency = [[] for _ in range(len(boxes))]
+    for i, j in zip(*np.nonzero(side_index >= 0)):
+        adjacency[i].append((int(j), sides[side_index[i, j]][0]))
+
+    return adjacency
+
+
+def get_lines_signature(positions, length, nbr_of_bins=TEMPLATE_SIGNATURE_BINS):
+    """
+        Returns the normalized and lightly smoothed histogram of line positions along a dimension
+    """
+
+    # histogram of the relative positions
+    if length <= 0 or len(positions) == 0:
+        return np.zeros(nbr_of_bins, dtype=np.float32)
+    histogram, _ = np.histogram(np.clip(np.asarray(positions, dtype=np.float64) / length, 0.0, 1.0), bins=nbr_of_bins, range=(0.0, 1.0))
+
+    # tolerate lines falling in a neighboring bin
+    histogram = np.convolve(histogram.astype(np.float32), np.array([0.5, 1.0, 0.5], dtype=np.float32), mode='same')
+
+    # normalize
+    norm = np.linalg.norm(histogram)
+    if norm > 0:
+        histogram /= norm
+
+    return histogram
+
+
+def get_lines_shape_signature(horz_lines, vert_lines, width, height):
+    """
+        Returns the (rows, columns) signature of a table from its horz and vert lines
+    """
+
+    # average position of each line
+    rows = [(p1[1] + p2[1])/2.0 for p1, p2 in horz_lines]
+    cols = [(p1[0] + p2[0])/2.0 for p1, p2 in vert_lines]
+
+    return get_lines_signature(rows, height), get_lines_signature(cols, width)
+
+
+def get_boxes_shape_signature(boxes, width, height):
+    """
+        Returns the (rows, columns) signature of a table template from its boxes
+    """
+
+    # unique horz and vert lines
+    rows = np.unique(np.concatenate([boxes[:, 1], boxes[:, 1] + boxes[:, 3]]))
+    cols = np.unique(np.concatenate([boxes[:, 0], boxes[:, 0] + boxes[:, 2]]))
+
+    return get_lines_signature(rows, height), get_lines_signature(cols, width)
+
+
+def compile_table_template(table_template):
+    """
+        Returns the arrays describing a table template
+    """
+
+    # grab rectangles
+    rectangles = table_template['rectangles']
+
+    # boxes
+    boxes = np.array([[r['x0'], r['y0'], r['w'], r['h']] for r in rectangles], dtype=np.float64).reshape(-1, 4)
+
+    # areas of interest, relative to their rectangle
+    aoi_mask = np.array(['aoi' in r for r in rectangles], dtype=bool)
+    aoi_boxes = np.array([[r['aoi']['x0'], r['aoi']['y0'], r['aoi']['w'], r['aoi']['h']] if 'aoi' in r else [0, 0, 0, 0] for r in rectangles], dtype=np.float64).reshape(-1, 4)
+    aoi_ratios = np.zeros((len(rectangles), 2), dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aoi_ratios[aoi_mask] = aoi_boxes[aoi_mask, 2:] / boxes[aoi_mask, 2:]
+
+    # dimensions
+    width = float(np.max(boxes[:, 0] + boxes[:, 2], initial=0))
+    height = float(np.max(boxes[:, 1] + boxes[:, 3], initial=0))
+
+    # shape signature
+    rows_signature, cols_signature = get_boxes_shape_signature(boxes, width, height)
+
+    return {
+        'id': table_template.get('id'),
+        'table_template': table_template,
+        'width': width,
+        'height': height,
+        'aspect_ratio': width / float(height) if height > 0 else 0.0,
+        'boxes': boxes,
+        'intersections': get_boxes_intersections(boxes),
+        'adjacency': get_boxes_adjacency(boxes),
+        'aoi_mask': aoi_mask,
+        'aoi_boxes': aoi_boxes,
+        'aoi_ratios': aoi_ratios,
+        'rows_signature': rows_signature,
+        'cols_signature': cols_signature
+    }
+
+
+def scale_compiled_table_template(compiled, width, height):
+    """
+        Returns the boxes, aoi boxes and intersections of a compiled template scaled to (width, height),
+        truncated to integers like scale_table_template
+    """
+
+    # ratios
+    ratios = np.array([width / compiled['width'], height / compiled['height']] * 2)
+
+    # scale
+    boxes = np.trunc(compiled['boxes'] * ratios)
+    aoi_boxes = np.trunc(compiled['aoi_boxes'] * ratios)
+
+    return {
+        'boxes': boxes,
+        'aoi_boxes': aoi_boxes,
+        'intersections': get_boxes_intersections(boxes)
+    }
+
+
+def get_table_template_digest(table_template):
+    """
+        Returns a digest of what compile_table_template reads from the rectangles of a table template (boxes and aois)
+    """
+
+    values = []
+    for r in table_template['rectangles']:
+        values += [r['x0'], r['y0'], r['w'], r['h']]
+        values += [r['aoi']['x0'], r['aoi']['y0'], r['aoi']['w'], r['aoi']['h']] if 'aoi' in r else [np.nan]*4
+
+    return hashlib.blake2b(np.array(values, dtype=np.float64).tobytes(), digest_size=16).digest()
+
+
+# templates compiled by this process, by id and content of the table_template row (a row edited in place is compiled again)
+_compiled_table_templates = {}
+MAX_COMPILED_TABLE_TEMPLATES = 4096
+
+
+def get_compiled_table_template(table_template):
+    """
+        Returns the compiled table template, compiled on first use
+    """
+
+    # lookup
+    key = (table_template.get('id'), get_table_template_digest(table_template))
+    if key in _compiled_table_templates:
+        return dict(_compiled_table_templates[key], table_template=table_template)
+
+    # bound the memory if rows are reloaded over and over
+    if len(_compiled_table_templates) >= MAX_COMPILED_TABLE_TEMPLATES:
+        _compiled_table_templates.clear()
+
+    # compile
+    compiled = compile_table_template(table_template)
+    _compiled_table_templates[key] = compiled
+
+    return compiled
+
+
+class TemplateIndex:
+    """
+        Table templates compiled once: dimensions, aspect ratios, corner intersections, adjacency graphs and AOI ratios
+    """
+
+    def __init__(self, table_templates):
+
+        # keep rows and compiled templates in the same order
+        self.table_templates = list(table_templates)
+        self.compiled = [get_compiled_table_template(table_template) for table_template in self.table_templates]
+
+        # contiguous arrays for the filters
+        self.build_arrays()
+
+    def build_arrays(self):
+
+        # aspect ratios, and their sorted order for range lookups
+        self.aspect_ratios = np.array([compiled['aspect_ratio'] for compiled in self.compiled], dtype=np.float64)
+        self.aspect_ratios_order = np.argsort(self.aspect_ratios, kind='stable')
+        self.sorted_aspect_ratios = self.aspect_ratios[self.aspect_ratios_order]
+
+        # shape signatures, one row per template
+        self.rows_signatures = np.array([compiled['rows_signature'] for compiled in self.compiled], dtype=np.float32).reshape(len(self.compiled), TEMPLATE_SIGNATURE_BINS)
+        self.cols_signatures = np.array([compiled['cols_signature'] for compiled in self.compiled], dtype=np.float32).reshape(len(self.compiled), TEMPLATE_SIGNATURE_BINS)
+
+    def __len__(self):
+        return len(self.compiled)
+
+    def filter(self, width, height):
+        """
+            Returns the indexes (in template order) of the templates whose aspect ratio is close enough to (width, height)
+        """
+
+        # get aspect ratio (w / h)
+        aspect_ratio_table = width / float(height)
+
+        # range of acceptable aspect ratios, widened by one template on each side for rounding
+        start = np.searchsorted(self.sorted_aspect_ratios, aspect_ratio_table * MIN_ASPECT_RATIO_TABLE_AND_TABLE_TEMPLATE, side='left')
+        end = np.searchsorted(self.sorted_aspect_ratios, aspect_ratio_table / MIN_ASPECT_RATIO_TABLE_AND_TABLE_TEMPLATE, side='right')
+        candidates = self.aspect_ratios_order[max(start - 1, 0):end + 1]
+
+        # aspect ratio mismatch, only for the candidates
+        aspect_ratios = self.aspect_ratios[candidates]
+        aspect_ratio_frac = np.minimum(aspect_ratios, aspect_ratio_table) / np.maximum(aspect_ratios, aspect_ratio_table)
+
+        return sorted(candidates[aspect_ratio_frac >= MIN_ASPECT_RATIO_TABLE_AND_TABLE_TEMPLATE].tolist())
+
+    def rank(self, horz_lines, vert_lines, width, height):
+        """
+            Returns the shape similarity of every template with a table's lines, in [0, 1]
+        """
+
+        # table signature
+        rows_signature, cols_signature = get_lines_shape_signature(horz_lines, vert_lines, width, height)
+
+        # cosine similarity, rows and columns weighted equally
+        return (self.rows_signatures @ rows_signature + self.cols_signatures @ cols_signature) / 2.0
+
+    def shortlist(self, horz_lines, vert_lines, width, height, size):
+        """
+            Returns the indexes (in template order) of the {size} templates whose shape is closest to the table's lines
+        """
+
+        # nothing to prune
+        if size <= 0 or size >= len(self):
+            return list(range(len(self)))
+
+        # best similarities (stable, so ties go to the first templates)
+        similarities = self.rank(horz_lines, vert_lines, width, height)
+        best = np.argsort(-similarities, kind='stable')[:size]
+
+        return sorted(best.tolist())
+
+    def subset(self, indexes):
+        """
+            Returns an index over some of the templates, without recompiling them
+        """
+
+        index = TemplateIndex([])
+        index.table_templates = [self.table_templates[i] for i in indexes]
+        index.compiled = [self.compiled[i] for i in indexes]
+        index.build_arrays()
+
+        return index
+
+
+def get_template_index(table_templates):
+    """
+        Returns the index of a list of table templates (each template is only compiled once per process)
+    """
+
+    # already an index
+    if isinstance(table_templates, TemplateIndex):
+        return table_templates
+
+    return TemplateIndex(table_templates)
@@ -1,6 +1,7 @@
 # import basic libs
 import os
 import sys
+import json
 
 # set name
 package_name = 'meza-contour'
@@ -10,6 +11,35 @@ sys.path.append(os.path.abspath(os.path.join(package_name)))
 
 # import decoder
 import meza_contour
+from meza_contour.batch import run_batch, load_manifest, jobs_from_directory
+
+# batch mode: run.py --batch <manifest.json | directory> <summary.json> [nbr_of_workers]
+# the status of each image is printed to stdout (one json per line) as soon as it is done, then the summary path
+if len(sys.argv) > 1 and sys.argv[1] == '--batch':
+
+    # check args
+    try:
+        source = sys.argv[2]
+        summary_outpath = sys.argv[3]
+        nbr_of_workers = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    except:
+        raise Exception("error while loading argument")
+
+    # list jobs
+    if os.path.isdir(source):
+        jobs = jobs_from_directory(source)
+    else:
+        jobs = load_manifest(source)
+
+    if jobs is None:
+        raise Exception("error while loading manifest")
+
+    # run, print each image's status as it completes
+    run_batch(jobs, summary_outpath=summary_outpath, nbr_of_workers=nbr_of_workers, on_done=lambda status: print(json.dumps(status), flush=True))
+
+    # print summary path to stdout
+    print(summary_outpath)
+    sys.exit(0)
 
 # check args
 try:
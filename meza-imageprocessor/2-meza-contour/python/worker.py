@@ -0,0 +1,78 @@
+# import basic libs
+import os
+import sys
+import json
+
+# set name
+package_name = 'meza-contour'
+
+# append path to decoder
+sys.path.append(os.path.abspath(os.path.join(package_name)))
+
+# import decoder (once for all the jobs)
+import meza_contour
+from meza_contour.batch import run_job
+from meza_contour.datatype import isDict, isStringNonEmpty
+
+# check args: number of jobs after which the worker exits (0: never)
+try:
+    max_jobs = int(sys.argv[1])
+except:
+    max_jobs = 0
+
+# stdout is the protocol channel, everything else printed goes to stderr
+protocol = sys.stdout
+
+
+def reply(message):
+    """
+        Writes one json message per line on the protocol channel
+    """
+
+    protocol.write(json.dumps(message) + '\n')
+    protocol.flush()
+
+
+def process_job(job):
+    """
+        Runs meza_contour on one job ({id, path, outpath}), returns the reply message
+    """
+
+    # run
+    status = run_job(job)
+
+    return {
+        'id': job.get('id'),
+        'outpath': status['outpath'],
+        'error': status['error']
+    }
+
+
+# signal the parent that imports are done
+reply({'ready': True})
+
+# process jobs, one per line
+nbr_of_jobs = 0
+for line in sys.stdin:
+
+    # skip empty lines
+    line = line.strip()
+    if len(line) == 0:
+        continue
+
+    # parse
+    try:
+        job = json.loads(line)
+    except:
+        job = None
+
+    # validate (same as the batch manifest), then run
+    if not isDict(job) or not isStringNonEmpty(job.get('path')) or not isStringNonEmpty(job.get('outpath')):
+        reply({'id': job.get('id') if isDict(job) else None, 'outpath': None, 'error': 'Invalid job'})
+    else:
+        reply(process_job(job))
+
+    # exit, the parent will start a fresh worker (invalid jobs count too, the parent counts every job it sent)
+    nbr_of_jobs += 1
+    if max_jobs > 0 and nbr_of_jobs >= max_jobs:
+        break
@@ -0,0 +1,126 @@
+'use strict';
+
+// child process spawner
+import { spawn } from 'child_process';
+
+// line reader
+import readline from 'readline';
+
+
+// Long-lived python process running meza_contour on many images.
+// Jobs and replies are line-delimited json over stdin/stdout:
+//      job:    { id, path, outpath }
+//      reply:  { id, outpath, error }
+// The python process exits after max_jobs jobs, or may crash, a new one is spawned on the next job.
+export class ContourWorker {
+
+    constructor(script_path, max_jobs = 0, job_timeout = 0, env = process.env){
+        this.script_path = script_path;
+        this.max_jobs = max_jobs;
+        this.job_timeout = job_timeout;
+        this.env = env;
+        this.worker = null;
+        this.next_id = 0;
+    }
+
+    spawn(){
+
+        // run the script
+        const child = spawn('/usr/bin/python3', [this.script_path, `${this.max_jobs}`], { env: this.env });
+
+        // state of this process
+        const worker = {
+            child: child,
+            pending: new Map(),
+            jobs_sent: 0,
+            closed: false
+        };
+
+        // reject every job still waiting on this process
+        const fail_pending = (error) => {
+            worker.closed = true;
+            for (const { reject, timer } of worker.pending.values()){
+                if (timer) clearTimeout(timer);
+                reject(error);
+            }
+            worker.pending.clear();
+            if (this.worker === worker) this.worker = null;
+        };
+
+        // replies
+        readline.createInterface({ input: child.stdout }).on('line', (line) => {
+
+            // parse
+            let message = null;
+            try {
+                message = JSON.parse(line);
+            } catch (error) {
+                console.log(line);
+                return;
+            }
+
+            // find the job
+            const job = worker.pending.get(message.id);
+            if (job === undefined) return;
+            worker.pending.delete(message.id);
+            if (job.timer) clearTimeout(job.timer);
+
+            job.resolve(message.outpath || '');
+        });
+
+        // writing to a dead process, handled on close
+        child.stdin.on('error', () => {});
+
+        // logs
+        child.stderr.on('data', (data) => {
+            console.log(data.toString().trim()); // to print out the errors as they come in
+        });
+
+        child.on('close', (code) => {
+            fail_pending(`Contour worker exited with code ${code}`);
+        });
+
+        child.on('error', (error) => {
+            fail_pending('Failed to start subprocess. ' + error);
+        });
+
+        return worker;
+    }
+
+    run(path, outpath){
+
+        // start a worker if none, or if the current one will exit after its last job
+        if (this.worker === null || this.worker.closed || (this.max_jobs > 0 && this.worker.jobs_sent >= this.max_jobs)){
+            this.worker = this.spawn();
+        }
+
+        // grab worker
+        const worker = this.worker;
+
+        // build job
+        const id = this.next_id++;
+        const job = { 'id': id, 'path': path, 'outpath': outpath };
+        worker.jobs_sent += 1;
+
+        return new Promise((resolve, reject) => {
+
+            // kill the process if the job hangs, its pending jobs are rejected on close
+            const timer = this.job_timeout > 0 ? setTimeout(() => worker.child.kill('SIGKILL'), this.job_timeout) : null;
+
+            // register
+            worker.pending.set(id, { resolve, reject, timer });
+
+            // send
+            worker.child.stdin.write(JSON.stringify(job) + '\n');
+        });
+    }
+
+    stop(){
+
+        // close stdin, the process exits once its current jobs are done
+        if (this.worker !== null){
+            this.worker.child.stdin.end();
+            this.worker = null;
+        }
+    }
+}
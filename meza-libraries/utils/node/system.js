@@ -6,4 +6,27 @@ export async function wait(in_ms){
             resolve();
         }, +in_ms)
     })
-}
\ No newline at end of file
+}
+
+export async function run_with_concurrency(items, concurrency, fn){
+
+    // index of the next item to process, shared by the runners
+    let next_index = 0;
+
+    // each runner processes one item at a time until there are none left
+    async function runner(slot){
+        while(next_index < items.length){
+            const item = items[next_index++];
+            await fn(item, slot);
+        }
+    }
+
+    // start at most {concurrency} runners
+    const nbr_of_runners = Math.max(1, Math.min(+concurrency, items.length));
+    const runners = [];
+    for (let slot = 0; slot < nbr_of_runners; slot++){
+        runners.push(runner(slot));
+    }
+
+    await Promise.all(runners);
+}